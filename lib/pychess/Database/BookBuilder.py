@@ -0,0 +1,220 @@
+""" Polyglot opening books made of the games of a .pgn file.
+
+    The moves of the first plies of the main lines of the games are counted
+    by a process pool, over parts of the file like for the position index.
+    Every process sums the games and points of the moves in memory, and
+    writes them to a sorted temporary file every RUN_SIZE moves, so the
+    memory used doesn't grow with the number of games. The temporary files
+    are merged into the book at the end.
+
+    The weight of a move is the number of points it scored for the side
+    playing it, 2 per win and 1 per draw, scaled down in the positions where
+    it doesn't fit in 16 bits. Only normal chess games are used, so books
+    of variant games can't be made. The book can be limited to some games of
+    the file, like the filtered ones of the game list, by their offsets.
+"""
+
+import bisect
+import functools
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+
+from pychess.Utils.const import NORMALCHESS, FEN_START, WHITE, BLACK, WHITEWON, BLACKWON, DRAW
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parseSAN, toPolyglot
+from pychess.Savers.movetext import iter_moves
+from pychess.System.compressed import is_compressed
+from pychess.System.protoopen import protoopen
+from pychess.Database.PgnImport import split_games, read_stream_parts
+from pychess.Database.PositionIndex import iter_games, read_run, write_records, merge_tree
+
+# hash, polyglot move, weight, learn
+BOOK_ENTRY = struct.Struct(">QHHI")
+
+# hash, polyglot move, games, points
+MOVE_ENTRY = struct.Struct(">QHII")
+
+MAX_WEIGHT = 0xffff
+
+# Moves kept in memory at once, before they are written sorted to a
+# temporary file to be merged with the others
+RUN_SIZE = 1 << 19
+
+# Parts of the file counted by the processes
+PART_SIZE = 8 * 1024 * 1024
+
+# Points of white and black by result
+POINTS = {WHITEWON: (2, 0), DRAW: (1, 1), BLACKWON: (0, 2)}
+
+
+def replay_opening(text, fen, depth):
+    """ Return the hashes of the positions the moves of the main line of the
+        game text are played in, up to ply depth, and their polyglot moves.
+        The line ends at the first move that can't be read. """
+
+    board = LBoard(NORMALCHESS)
+    hashes = []
+    moves = []
+    try:
+        board.applyFen(fen or FEN_START)
+    except SyntaxError:
+        return hashes, moves
+    for move in iter_moves(board, text, depth, parseSAN):
+        hashes.append(board.hash)
+        moves.append(toPolyglot(board, move))
+        board.applyMove(move)
+    return hashes, moves
+
+
+class MoveCounter:
+    """ Sums the games and points of the moves of games, and writes them to
+        sorted temporary files in directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.moves = {}
+        self.runs = []
+
+    def add_game(self, offset, record, hashes, moves):
+        points = POINTS.get(record["result"], (0, 0))
+        fen = record["fen"]
+        color = BLACK if fen and fen.split()[1:2] == ["b"] else WHITE
+        for hash, move in zip(hashes, moves):
+            key = hash << 16 | move
+            entry = self.moves.get(key)
+            if entry is None:
+                entry = self.moves[key] = [0, 0]
+            entry[0] += 1
+            entry[1] += points[color]
+            color = 1 - color
+        if len(self.moves) >= RUN_SIZE:
+            self.write_run()
+
+    def write_run(self):
+        pack = MOVE_ENTRY.pack
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"".join([pack(key >> 16, key & 0xffff, *self.moves[key]) for key in sorted(self.moves)]))
+        self.runs.append(path)
+        self.moves = {}
+
+    def close(self):
+        if self.moves:
+            self.write_run()
+        return self.runs
+
+
+def offset_filter(offsets):
+    """ The select function of iter_games() for the games at offsets, or None
+        for all the games """
+
+    if offsets is None:
+        return None
+    offsets = frozenset(offsets)
+    return lambda record: record["offset"] in offsets
+
+
+def count_range(path, start, end, directory, depth, offsets=None):
+    """ MoveCounter runs of the games in a byte range of the .pgn file at
+        path, only of the ones at offsets if it isn't None """
+
+    counter = MoveCounter(directory)
+    replay = functools.partial(replay_opening, depth=depth)
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for game in iter_games(data, start, end, replay=replay, select=offset_filter(offsets)):
+                counter.add_game(*game)
+        finally:
+            data.close()
+    return counter.close()
+
+
+def book_entries(moves, min_games=1, min_score=0):
+    """ Yield the BOOK_ENTRY values of the merged MOVE_ENTRY values of moves,
+        sorted by hash. Moves played in less than min_games games, or scoring
+        less than min_score percent of the points, are left out. """
+
+    for hash, group in itertools.groupby(moves, key=lambda entry: entry[0]):
+        kept = [(points, move) for _, move, games, points in group
+                if games >= min_games and points * 50 >= min_score * games]
+        if not kept:
+            continue
+        best = max(kept)[0]
+        # The best moves first, like polyglot does
+        for points, move in sorted(kept, reverse=True):
+            yield hash, move, points if best <= MAX_WEIGHT else points * MAX_WEIGHT // best, 0
+
+
+def build_book(path, book_path, depth, min_games=1, min_score=0, processes=None, cancel_event=None,
+               progress=None, offsets=None):
+    """ Write the polyglot book of the moves of the first depth plies of the
+        games of the .pgn file at path to book_path, see book_entries() for
+        min_games and min_score. Only the games at offsets are counted if it
+        isn't None. The counting stops when cancel_event is set, and then
+        False is returned without writing the book. progress is called with
+        the done fraction of the uncompressed files. """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if offsets is not None:
+        offsets = sorted(offsets)
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(book_path)))
+    runs = []
+    pool = None
+    try:
+        if is_compressed(path):
+            counter = MoveCounter(directory)
+            replay = functools.partial(replay_opening, depth=depth)
+            handle = protoopen(path)
+            try:
+                for data, end, base_offset, line_end_fix in read_stream_parts(handle.buffer):
+                    if cancelled():
+                        return False
+                    for game in iter_games(data, 0, end, base_offset, line_end_fix, replay,
+                                           offset_filter(offsets)):
+                        counter.add_game(*game)
+            finally:
+                handle.close()
+            runs = counter.close()
+        elif os.path.getsize(path) > 0:
+            parts = split_games(path, PART_SIZE)
+            # Every part gets only the offsets of its own games, which are up
+            # to a line end before the game, so some of the previous part too
+            args = [(path, start, end, directory, depth,
+                     None if offsets is None else
+                     offsets[bisect.bisect_left(offsets, start - 2):bisect.bisect_left(offsets, end)])
+                    for start, end in parts]
+            if processes > 1 and len(parts) > 1:
+                pool = multiprocessing.Pool(processes)
+                results = [pool.apply_async(count_range, part_args).get for part_args in args]
+            else:
+                results = [functools.partial(count_range, *part_args) for part_args in args]
+            for i, result in enumerate(results):
+                if cancelled():
+                    return False
+                runs += result()
+                if progress is not None:
+                    progress((i + 1) / len(parts))
+
+        moves = merge_tree(heapq.merge(*[read_run(run, MOVE_ENTRY) for run in runs]))
+        # Replace the old book only when the new one is complete
+        write_records(book_path + ".tmp", book_entries(moves, min_games, min_score), BOOK_ENTRY)
+        os.replace(book_path + ".tmp", book_path)
+        return True
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for run in os.listdir(directory):
+            os.remove(os.path.join(directory, run))
+        os.rmdir(directory)
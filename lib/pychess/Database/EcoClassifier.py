@@ -0,0 +1,123 @@
+""" ECO codes of the games of a .pgn file without an ECO tag.
+
+    The main lines of the games are replayed by a process pool, over parts of
+    the file like for the position index, only while they stay in the lines
+    of eco.db. The code of the deepest position ending an ECO line is the one
+    of the game, so games transposing back into the lines later keep the code
+    of the position they left them at. Only normal chess games are
+    classified.
+"""
+
+import mmap
+import multiprocessing
+import os
+
+from sqlalchemy import and_, bindparam
+
+from pychess.Utils.const import NORMALCHESS, FEN_START
+from pychess.Utils import eco
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parseSAN
+from pychess.Savers.movetext import iter_moves
+from pychess.System.compressed import is_compressed
+from pychess.System.protoopen import protoopen
+from pychess.Database.PgnImport import split_games, read_stream_parts
+from pychess.Database.PositionIndex import iter_games
+from pychess.Database.model import game
+
+# Parts of the file classified by the processes
+PART_SIZE = 8 * 1024 * 1024
+
+
+def iter_hashes(text, fen=None):
+    """ Yield the hashes of the positions after the moves of the main line of
+        the game text, replaying them as they are asked for. The line ends at
+        the first move that can't be read. """
+
+    board = LBoard(NORMALCHESS)
+    try:
+        board.applyFen(fen or FEN_START)
+    except SyntaxError:
+        return
+    for move in iter_moves(board, text, parse=parseSAN):
+        board.applyMove(move)
+        yield board.hash
+
+
+def classify_game(text, fen=None):
+    """ Return the get_eco() opening of the game text, see classify() """
+    opening = eco.classify(iter_hashes(text, fen), within_lines=True)
+    # A 1-tuple, so that it can be the replay function of iter_games()
+    return (opening, )
+
+
+def without_eco(record):
+    return not record["eco"]
+
+
+def iter_openings(data, start=0, end=None, base_offset=0, line_end_fix=None):
+    """ Yield the offset and ECO code of the classified games without an ECO
+        tag in the bytes data[start:end] of a .pgn file """
+
+    for offset, record, opening in iter_games(data, start, end, base_offset, line_end_fix,
+                                              classify_game, without_eco):
+        if opening is not None:
+            yield offset, opening[0]
+
+
+def classify_range(path, start, end):
+    """ iter_openings() of the games in a byte range of the .pgn file at path """
+
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return list(iter_openings(data, start, end))
+        finally:
+            data.close()
+
+
+def classify_file(path, start=0, processes=None):
+    """ Return the (offset, ECO code) of the classified games without an ECO
+        tag of the .pgn file at path, from byte start on """
+
+    if not eco.ECO_OK:
+        return []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # Read the openings once, before the processes are forked
+    eco.get_openings(eco.ECO_MAIN_LANG)
+
+    if is_compressed(path):
+        openings = []
+        handle = protoopen(path)
+        try:
+            for data, end, base_offset, line_end_fix in read_stream_parts(handle.buffer):
+                openings += [opening for opening in iter_openings(data, 0, end, base_offset, line_end_fix)
+                             if opening[0] >= start]
+        finally:
+            handle.close()
+        return openings
+
+    if os.path.getsize(path) <= start:
+        return []
+    parts = split_games(path, PART_SIZE, start)
+    if processes > 1 and len(parts) > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(classify_range, [(path, start, end) for start, end in parts])
+    else:
+        results = [classify_range(path, start, end) for start, end in parts]
+    return [opening for result in results for opening in result]
+
+
+def store_eco(engine, path, start=0, processes=None):
+    """ Set the eco column of the games of the tag database of engine which
+        have none to the code classify_file() finds for them, and return the
+        number of games classified """
+
+    openings = classify_file(path, start, processes)
+    if openings:
+        with engine.begin() as conn:
+            conn.execute(game.update().where(and_(game.c.offset == bindparam("b_offset"), game.c.eco == "")).
+                         values(eco=bindparam("b_eco")),
+                         [{"b_offset": offset, "b_eco": code} for offset, code in openings])
+    return len(openings)
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import mmap
+import multiprocessing
 import os
 import re
 import subprocess
 import zipfile
+import zlib
 
 from gi.repository import GLib
 
@@ -15,8 +18,10 @@ from pychess.Utils.const import NORMALCHESS, RUNNING, DRAW, WHITEWON, BLACKWON
 from pychess.Variants import name2variant
 from pychess.System.Log import log
 from pychess.System import download_file
-from pychess.System.protoopen import protoopen, protosave, PGN_ENCODING
-from pychess.Database.model import event, site, player, game, annotator, tag_game, source
+from pychess.System.compressed import is_compressed
+from pychess.System.protoopen import protoopen, protosave, textopen, PGN_ENCODING
+from pychess.Database.model import event, site, player, game, annotator, tag_game, source, \
+    date_key, parse_int
 # from pychess.System import profile_me
 
 # Editable (on game info dialog) tags
@@ -26,6 +31,14 @@ dedicated_tags = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'WhiteElo'
 other_game_tags = ('Result', 'SetUp', 'FEN', 'ECO', 'Variant', 'PlyCount', 'Annotator', 'offset', 'offset8')
 
 TAG_REGEX = re.compile(r"\[([a-zA-Z0-9_]+)\s+\"(.*)\"\]")
+TAG_REGEX_BYTES = re.compile(TAG_REGEX.pattern.encode())
+# The tag lines and single line comments heading a game, and the tags in them
+HEADER_REGEX_BYTES = re.compile(rb'(?:(?:\[[a-zA-Z0-9_]+[^\S\n]+"[^\n]*"\][^\n]*|%[^\n]*)(?:\n|\Z))+')
+HEADER_TAG_REGEX = re.compile(r'^\[([a-zA-Z0-9_]+)[^\S\n]+"(.*)"\]', re.MULTILINE)
+
+# Files bigger than this are split into parts of this size at game
+# boundaries, and the headers of the parts are read by a process pool
+PARALLEL_CHUNK = 8 * 1024 * 1024
 
 GAME, EVENT, SITE, PLAYER, ANNOTATOR, SOURCE, STAT = range(7)
 
@@ -46,10 +59,14 @@ pgn2Const = {"*": RUNNING,
 
 
 class PgnImport():
-    def __init__(self, chessfile, append_pgn=False):
+    def __init__(self, chessfile, append_pgn=False, processes=None):
         self.chessfile = chessfile
         self.append_pgn = append_pgn
         self.cancel = False
+        # Number of processes reading the headers of big files
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
 
     def initialize(self):
         self.db_handle = self.chessfile.handle
@@ -146,12 +163,14 @@ class PgnImport():
         self.cancel = True
 
     # @profile_me
-    def do_import(self, filename, info=None, progressbar=None):
+    def do_import(self, filename, info=None, progressbar=None, start=0):
+        """ Import the game headers of filename, or with start > 0 the ones of
+            the games appended to the .pgn file filename from byte start on """
         self.progressbar = progressbar
 
         orig_filename = filename
         count_source = self.conn.execute(self.count_source.where(source.c.name == orig_filename)).scalar()
-        if count_source > 0:
+        if count_source > 0 and start == 0:
             log.info("%s is already imported" % filename)
             return
 
@@ -175,12 +194,16 @@ class PgnImport():
                 log.info("Can't open %s" % filename)
                 return
 
+        if self.append_pgn and is_compressed(self.chessfile.path):
+            log.info("Can't append games to compressed %s" % self.chessfile.path)
+            return
+
+        # .zip members and compressed files are read as they are decompressed
         if filename.lower().endswith(".zip") and zipfile.is_zipfile(filename):
-            with zipfile.ZipFile(filename, "r") as zf:
-                path = os.path.dirname(filename)
-                files = [os.path.join(path, f) for f in zf.namelist() if f.lower().endswith(".pgn")]
-                zf.extractall(path)
+            zf = zipfile.ZipFile(filename, "r")
+            files = [f for f in zf.namelist() if f.lower().endswith(".pgn")]
         else:
+            zf = None
             files = [filename]
 
         for pgnfile in files:
@@ -192,130 +215,86 @@ class PgnImport():
             else:
                 log.info("Reading %s ..." % pgnfile)
 
-            size = os.path.getsize(pgnfile)
-            handle = protoopen(pgnfile)
+            if zf is not None:
+                size = zf.getinfo(pgnfile).file_size
+                handle = textopen(zf.open(pgnfile), pgnfile)
+            else:
+                size = os.path.getsize(pgnfile) - start
+                handle = protoopen(pgnfile)
 
             # estimated game count
             all_games = max(size / 840, 1)
 
             get_id = self.get_id
 
+            if zf is not None or is_compressed(pgnfile):
+                records = (tags2record(tags, basename) for tags in
+                           read_stream_games(handle.buffer, handle.pgn_encoding))
+            elif self.processes > 1 and size > PARALLEL_CHUNK:
+                records = read_records_parallel(pgnfile, handle.pgn_encoding,
+                                                basename, self.processes, start=start)
+            else:
+                records = (tags2record(tags, basename) for tags in
+                           read_file_games(pgnfile, handle.pgn_encoding, start))
+
             # use transaction to avoid autocommit slowness
             # and to let undo importing (rollback) if self.cancel was set
             trans = self.conn.begin()
             try:
                 i = 0
-                for tags in read_games(handle):
-                    if not tags:
-                        log.info("Empty game #%s" % (i + 1))
-                        continue
-
+                for record in records:
                     if self.cancel:
+                        records.close()
                         trans.rollback()
                         return
 
-                    fenstr = tags["FEN"]
-
-                    variant = tags["Variant"]
-                    if variant:
-                        if "fischer" in variant.lower() or "960" in variant:
-                            variant = "Fischerandom"
-                        else:
-                            variant = variant.lower().capitalize()
-
-                    # Fixes for some non statndard Chess960 .pgn
-                    if fenstr and variant == "Fischerandom":
-                        parts = fenstr.split()
-                        parts[0] = parts[0].replace(".", "/").replace("0", "")
-                        if len(parts) == 1:
-                            parts.append("w")
-                            parts.append("-")
-                            parts.append("-")
-                        fenstr = " ".join(parts)
-
-                    if variant:
-                        if variant not in name2variant:
-                            log.info("Unknown variant: %s" % variant)
-                            continue
-                        variant = name2variant[variant].variant
-                        if variant == NORMALCHESS:
-                            # lichess uses tag [Variant "Standard"]
-                            variant = 0
-                    else:
-                        variant = 0
-
-                    if basename == "eco.pgn":
-                        white = tags["Opening"]
-                        black = tags["Variation"]
-                    else:
-                        white = tags["White"]
-                        black = tags["Black"]
-
-                    event_id = get_id(tags["Event"], event, EVENT)
-
-                    site_id = get_id(tags["Site"], site, SITE)
-
-                    date = tags["Date"]
-
-                    game_round = tags['Round']
-
-                    white_id = get_id(white, player, PLAYER)
-                    black_id = get_id(black, player, PLAYER)
-
-                    result = tags["Result"]
-                    if result in pgn2Const:
-                        result = pgn2Const[result]
-                    else:
-                        result = RUNNING
-
-                    white_elo = tags['WhiteElo']
-                    black_elo = tags['BlackElo']
-
-                    time_control = tags["TimeControl"]
+                    if record is None:
+                        continue
 
-                    eco = tags["ECO"][:3]
+                    # Names are given ids here, in file order, so parallel
+                    # and serial imports make the same database
+                    event_id = get_id(record["event"], event, EVENT)
 
-                    fen = tags["FEN"]
+                    site_id = get_id(record["site"], site, SITE)
 
-                    board_tag = int(tags["Board"]) if "Board" in tags else 0
+                    white_id = get_id(record["white"], player, PLAYER)
+                    black_id = get_id(record["black"], player, PLAYER)
 
-                    annotator_id = get_id(tags["Annotator"], annotator, ANNOTATOR)
+                    annotator_id = get_id(record["annotator"], annotator, ANNOTATOR)
 
                     source_id = get_id(orig_filename, source, SOURCE, info=info)
 
-                    ply_count = tags["PlyCount"] if "PlyCount" in tags else 0
-
-                    offset = base_offset + int(tags["offset"])
+                    offset = base_offset + record["offset"]
 
                     self.game_data.append({
                         'offset': offset,
                         'offset8': (offset >> 3) << 3,
                         'event_id': event_id,
                         'site_id': site_id,
-                        'date': date,
-                        'round': game_round,
+                        'date': record["date"],
+                        'date_key': record["date_key"],
+                        'round': record["round"],
                         'white_id': white_id,
                         'black_id': black_id,
-                        'result': result,
-                        'white_elo': white_elo,
-                        'black_elo': black_elo,
-                        'ply_count': ply_count,
-                        'eco': eco,
-                        'fen': fen,
-                        'variant': variant,
-                        'board': board_tag,
-                        'time_control': time_control,
+                        'result': record["result"],
+                        'white_elo': record["white_elo"],
+                        'black_elo': record["black_elo"],
+                        'ply_count': record["ply_count"],
+                        'eco': record["eco"],
+                        'fen': record["fen"],
+                        'variant': record["variant"],
+                        'board': record["board"],
+                        'time_control': record["time_control"],
                         'annotator_id': annotator_id,
                         'source_id': source_id,
                     })
 
-                    for tag in tags:
-                        if tag not in dedicated_tags and tag not in other_game_tags and tags[tag]:
-                            self.tag_game_data.append({
-                                'game_id': self.next_id[GAME],
-                                'tag_name': tag,
-                                'tag_value': tags[tag],
-                            })
+                    for tag, value in record["tags"]:
+                        self.tag_game_data.append({
+                            'game_id': self.next_id[GAME],
+                            'tag_name': tag,
+                            'tag_value': value,
+                        })
 
                     self.next_id[GAME] += 1
                     i += 1
@@ -402,7 +381,7 @@ class PgnImport():
                         self.db_handle.writelines(handle)
                         handle.close()
 
-                    if self.chessfile.scoutfish is not None:
+                    if self.chessfile.scoutfish is not None and zf is None and not is_compressed(pgnfile):
                         # create new .scout from pgnfile we are importing
                         from pychess.Savers.pgn import scoutfish_path
                         args = [scoutfish_path, "make", pgnfile, "%s" % base_offset]
@@ -422,64 +401,301 @@ class PgnImport():
                 trans.rollback()
                 log.info("Importing %s failed! \n%s" % (pgnfile, e))
 
+        if zf is not None:
+            zf.close()
+
+
+def tags2record(tags, basename):
+    """ Return the game table values of a game as a dict, but with the names of
+        the event, site, players and annotator instead of their ids, and its
+        other tags under "tags". Games of unknown variants give None. """
+
+    if not tags:
+        log.info("Empty game")
+        return None
+
+    variant, fenstr = parse_variant(tags)
+    if variant is None:
+        return None
+
+    if basename == "eco.pgn":
+        white = tags["Opening"]
+        black = tags["Variation"]
+    else:
+        white = tags["White"]
+        black = tags["Black"]
+
+    result = tags["Result"]
+    if result in pgn2Const:
+        result = pgn2Const[result]
+    else:
+        result = RUNNING
+
+    return {
+        'offset': int(tags["offset"]),
+        'event': tags["Event"],
+        'site': tags["Site"],
+        'date': tags["Date"],
+        'date_key': date_key(tags["Date"]),
+        'round': tags['Round'],
+        'white': white,
+        'black': black,
+        'result': result,
+        'white_elo': parse_int(tags['WhiteElo']),
+        'black_elo': parse_int(tags['BlackElo']),
+        'ply_count': parse_int(tags["PlyCount"]),
+        'eco': tags["ECO"][:3],
+        'fen': tags["FEN"],
+        'variant': variant,
+        'board': int(tags["Board"]) if "Board" in tags else 0,
+        'time_control': tags["TimeControl"],
+        'annotator': tags["Annotator"],
+        'tags': [(tag, tags[tag]) for tag in tags
+                 if tag not in dedicated_tags and tag not in other_game_tags and tags[tag]],
+    }
+
+
+def parse_variant(tags):
+    """ Return the variant of the game with header tags, 0 for normal chess
+        and None for unknown variants, and its FEN tag with fixes for some
+        non standard Chess960 .pgn """
+
+    fenstr = tags["FEN"]
+
+    variant = tags["Variant"]
+    if variant:
+        if "fischer" in variant.lower() or "960" in variant:
+            variant = "Fischerandom"
+        else:
+            variant = variant.lower().capitalize()
+
+    # Fixes for some non statndard Chess960 .pgn
+    if fenstr and variant == "Fischerandom":
+        parts = fenstr.split()
+        parts[0] = parts[0].replace(".", "/").replace("0", "")
+        if len(parts) == 1:
+            parts.append("w")
+            parts.append("-")
+            parts.append("-")
+        fenstr = " ".join(parts)
+
+    if variant:
+        if variant not in name2variant:
+            log.info("Unknown variant: %s" % variant)
+            return None, fenstr
+        variant = name2variant[variant].variant
+        if variant == NORMALCHESS:
+            # lichess uses tag [Variant "Standard"]
+            variant = 0
+    else:
+        variant = 0
+
+    return variant, fenstr
+
+
+def split_games(path, chunk=PARALLEL_CHUNK, start=0):
+    """ Split the .pgn file at path from byte start on into (start, end)
+        byte ranges of about chunk bytes, each starting with the first header
+        tag of a game """
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        starts = [start]
+        pos = start + chunk
+        while pos < size:
+            f.seek(pos)
+            # Skip the partial line, and look for a tag after an empty line
+            f.readline()
+            after_empty = False
+            while True:
+                start = f.tell()
+                line = f.readline()
+                if not line or after_empty and TAG_REGEX_BYTES.match(line):
+                    break
+                after_empty = not line.strip()
+            if not line:
+                break
+            starts.append(start)
+            pos = start + chunk
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def file_checksum(path, end, start=0, checksum=0):
+    """ crc32 of the bytes of the file at path up to end, from the crc32
+        checksum of the bytes before start """
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        size = end - start
+        while size > 0:
+            data = f.read(min(size, PARALLEL_CHUNK))
+            if not data:
+                break
+            checksum = zlib.crc32(data, checksum)
+            size -= len(data)
+    return checksum
+
+
+def read_range(path, start, end, pgn_encoding, basename):
+    """ Return the tags2record() records of the games in the given byte range
+        of the .pgn file at path """
+
+    return [tags2record(tags, basename) for tags in
+            read_file_games(path, pgn_encoding, start, end)]
+
+
+def read_records_parallel(path, pgn_encoding, basename, processes, chunk=PARALLEL_CHUNK, start=0):
+    """ Yield the tags2record() records of the games in the .pgn file at path
+        from byte start on in file order, reading its split_games() parts in a
+        process pool """
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Only keep a few parts ahead of the database inserts in memory
+        pending = collections.deque()
+        for part_start, part_end in split_games(path, chunk, start):
+            pending.append(pool.apply_async(read_range, (path, part_start, part_end, pgn_encoding, basename)))
+            if len(pending) >= 2 * processes:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def scan_games(data, start=0, end=None, pgn_encoding=PGN_ENCODING, base_offset=0, line_end_fix=None):
+    """ Yield the header tags of the games in the bytes of a whole .pgn
+        file (an mmap for instance) from start to end, with the byte offset
+        of the game under "offset". Only header values are decoded. When
+        data is a part of the file, base_offset is its offset in the file,
+        and line_end_fix the one of the file. """
+
+    if end is None:
+        end = len(data)
 
-def read_games(handle):
-    """Based on chess.pgn.scan_headers() from Niklas Fiekas python-chess"""
+    # scoutfish creates game offsets at previous game end
+    if line_end_fix is None:
+        line_end_fix = get_line_end_fix(data)
 
     in_comment = False
+    pos = start
+    while pos < end:
+        if not in_comment and data[pos] == 91:  # "["
+            header_match = HEADER_REGEX_BYTES.match(data, pos, end)
+            if header_match is not None:
+                header = data[pos:header_match.end()]
+                try:
+                    tags = HEADER_TAG_REGEX.findall(header.decode(pgn_encoding))
+                except UnicodeDecodeError:
+                    # Only the tag values must be valid
+                    tags = [(tag_name, tag_value.encode(PGN_ENCODING).decode(pgn_encoding))
+                            for tag_name, tag_value in HEADER_TAG_REGEX.findall(header.decode(PGN_ENCODING))]
+                if b"\\" in header:
+                    tags = [(tag_name, tag_value.replace("\\\"", "\"").replace("\\\\", "\\"))
+                            for tag_name, tag_value in tags]
+                game_headers = collections.defaultdict(str, tags)
+                game_headers["offset"] = max(0, base_offset + pos - line_end_fix)
+                yield game_headers
+                pos = header_match.end()
+                if pos >= end:
+                    break
+
+        # Jump over the movetext to the next line starting with "[". The
+        # comment state after it is given by the last brace in it.
+        eol = data.find(b"\n[", pos, end)
+        next_pos = end if eol < 0 else eol + 1
+        if data[pos] == 37 or data.find(b"\n%", pos, next_pos) >= 0:
+            # Single line comments don't count, so go line by line
+            while pos < next_pos:
+                eol = data.find(b"\n", pos, next_pos)
+                eol = next_pos if eol < 0 else eol + 1
+                if data[pos] != 37:
+                    in_comment = braces_state(data, pos, eol, in_comment)
+                pos = eol
+        else:
+            in_comment = braces_state(data, pos, next_pos, in_comment)
+        pos = next_pos
 
-    game_headers = None
-    game_pos = None
 
-    last_pos = 0
-    line = handle.readline()
+def get_line_end_fix(data):
+    """ Length of the line ends in the bytes of a .pgn file """
 
-    # scoutfish creates game offsets at previous game end
-    line_end_fix = 2 if line.endswith("\r\n") else 1
-
-    while line:
-        # Skip single line comments.
-        if line.startswith("%"):
-            last_pos += len(line)
-            line = handle.readline()
-            continue
-
-        # Reading a header tag. Parse it and add it to the current headers.
-        if not in_comment and line.startswith("["):
-            tag_match = TAG_REGEX.match(line)
-            if tag_match:
-                if game_pos is None:
-                    game_headers = collections.defaultdict(str)
-                    game_pos = last_pos
-
-                tag_value = tag_match.group(2)
-                tag_value = tag_value.replace("\\\"", "\"")
-                tag_value = tag_value.replace("\\\\", "\\")
-
-                if handle.pgn_encoding != PGN_ENCODING:
-                    tag_value = tag_value.encode(PGN_ENCODING).decode(handle.pgn_encoding)
-                game_headers[tag_match.group(1)] = tag_value
-
-                last_pos += len(line)
-                line = handle.readline()
+    eol = data.find(b"\n")
+    return 2 if eol > 0 and data[eol - 1] == 13 else 1
+
+
+def braces_state(data, start, end, in_comment):
+    """ Whether a {comment} is open after the bytes from start to end """
+
+    open_pos = data.rfind(b"{", start, end)
+    close_pos = data.rfind(b"}", start, end)
+    if open_pos < 0 and close_pos < 0:
+        return in_comment
+    return open_pos > close_pos
+
+
+def read_file_games(path, pgn_encoding=PGN_ENCODING, start=0, end=None):
+    """ scan_games() over an mmap of the .pgn file at path """
+
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield from scan_games(data, start, end, pgn_encoding)
+        finally:
+            data.close()
+
+
+def read_stream_games(stream, pgn_encoding=PGN_ENCODING, chunk=PARALLEL_CHUNK):
+    """ scan_games() over a binary file object, like a decompressed file or a
+        .zip member, read in parts of about chunk bytes """
+
+    for data, end, base_offset, line_end_fix in read_stream_parts(stream, chunk):
+        yield from scan_games(data, 0, end, pgn_encoding, base_offset, line_end_fix)
+
+
+def read_stream_parts(stream, chunk=PARALLEL_CHUNK):
+    """ Yield the bytes of a binary file object of a .pgn file in parts of
+        about chunk bytes from its position on, as (data, end, base_offset,
+        line_end_fix) where data[:end] are whole games, starting at
+        base_offset in the file """
+
+    data = b""
+    base_offset = stream.tell()
+    line_end_fix = None
+    while True:
+        block = stream.read(chunk)
+        data = data + block
+        if line_end_fix is None:
+            if block and data.find(b"\n") < 0:
                 continue
+            line_end_fix = get_line_end_fix(data)
 
-        # Reading movetext. Update parser state in_comment in order to skip
-        # comments that look like header tags.
-        if (not in_comment and "{" in line) or (in_comment and "}" in line):
-            in_comment = line.rfind("{") > line.rfind("}")
-
-        # Reading movetext. If there were headers, previously, those are now
-        # complete and can be yielded.
-        if game_pos is not None:
-            game_headers["offset"] = max(0, game_pos - line_end_fix)
-            yield game_headers
-            game_pos = None
-
-        last_pos += len(line)
-        line = handle.readline()
-
-    # Yield the headers of the last game.
-    if game_pos is not None:
-        game_headers["offset"] = max(0, game_pos - line_end_fix)
-        yield game_headers
+        if block:
+            # Only give up to the last game start, the game there may be cut
+            end = last_game_start(data)
+            if end <= 0:
+                continue
+        else:
+            end = len(data)
+
+        yield data, end, base_offset, line_end_fix
+        if not block:
+            break
+        data = data[end:]
+        base_offset += end
+
+
+def last_game_start(data):
+    """ Offset of the last tag line after an empty line in data, or -1 """
+
+    pos = len(data)
+    while True:
+        pos = max(data.rfind(b"\n\n[", 0, pos), data.rfind(b"\n\r\n[", 0, pos))
+        if pos < 0:
+            return -1
+        start = data.index(b"[", pos)
+        if TAG_REGEX_BYTES.match(data, start):
+            return start
@@ -0,0 +1,347 @@
+""" Index of the positions in the main lines of the games of a .pgn file, and
+    its opening tree, made without external tools.
+
+    The index file is a sorted array of (position hash, game offset << 16 | ply)
+    pairs of big endian unsigned 64 bit ints, so the games a position occurs
+    in are found by a binary search. A game has one pair per position, with
+    the first ply the position occurs at, so pages of the games of a position
+    are found by seeking. The hashes are the polyglot ones LBoard keeps.
+
+    The opening tree file is a sorted array of TREE_ENTRY structs, with the
+    number of games, results and Elo sum of the players of every move played
+    in the first TREE_MAX_PLY plies of the games.
+
+    Only normal chess games are indexed.
+"""
+
+import heapq
+import itertools
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+
+from pychess.Utils.const import NORMALCHESS, FEN_START, WHITE, BLACK, WHITEWON, BLACKWON, DRAW
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parseSAN, toPolyglot
+from pychess.Savers.movetext import iter_moves
+from pychess.System.compressed import is_compressed
+from pychess.System.protoopen import protoopen, PGN_ENCODING
+from pychess.Database.PgnImport import scan_games, tags2record, split_games, \
+    read_stream_parts
+
+POSTING = struct.Struct(">QQ")
+
+# hash, polyglot move, games, white wins, draws, black wins, Elo sum and
+# number of games with the Elo of the player of the move
+TREE_ENTRY = struct.Struct(">QHIIIIQI")
+
+MAX_PLY = 0xffff
+
+TREE_MAX_PLY = 40
+
+# Postings or tree entries kept in memory at once, before they are written
+# sorted to a temporary file to be merged with the others
+RUN_SIZE = 1 << 20
+
+# Files bigger than this are split into parts of this size at game
+# boundaries, and the parts are indexed by a process pool
+PART_SIZE = 8 * 1024 * 1024
+
+
+def replay_game(text, fen=None):
+    """ Return the hashes of the start position and the positions after every
+        move of the main line of the game text, and the polyglot moves of its
+        first TREE_MAX_PLY plies. The game ends at the first move that can't
+        be read. """
+
+    board = LBoard(NORMALCHESS)
+    hashes = []
+    moves = []
+    try:
+        board.applyFen(fen or FEN_START)
+    except SyntaxError:
+        return hashes, moves
+    hashes.append(board.hash)
+    for move in iter_moves(board, text, parse=parseSAN):
+        if len(moves) < TREE_MAX_PLY:
+            moves.append(toPolyglot(board, move))
+        board.applyMove(move)
+        hashes.append(board.hash)
+    return hashes, moves
+
+
+def iter_game_spans(data, start=0, end=None, pgn_encoding=PGN_ENCODING, base_offset=0, line_end_fix=None):
+    """ Yield the scan_games() tags of the games in the bytes data[start:end]
+        of a .pgn file, where data starts at base_offset of the file, and the
+        start and end in data of their text. The next game is read ahead for
+        the end of every game. """
+
+    if end is None:
+        end = len(data)
+
+    games = scan_games(data, start, end, pgn_encoding, base_offset, line_end_fix)
+    tags = next(games, None)
+    while tags is not None:
+        next_tags = next(games, None)
+        next_offset = next_tags["offset"] if next_tags is not None else base_offset + end
+        yield tags, max(0, tags["offset"] - base_offset), next_offset - base_offset
+        tags = next_tags
+
+
+def iter_games(data, start=0, end=None, base_offset=0, line_end_fix=None, replay=replay_game, select=None):
+    """ Yield the offset, tags2record() record and replay_game() hashes and
+        moves, or the ones of another replay function, of the normal chess
+        games in the bytes data[start:end] of a .pgn file, where data starts
+        at base_offset of the file. The games whose record select() returns
+        False for are skipped without being replayed. """
+
+    for tags, text_start, text_end in iter_game_spans(data, start, end, base_offset=base_offset,
+                                                      line_end_fix=line_end_fix):
+        record = tags2record(tags, "")
+        if record is None or record["variant"] != 0 or (select is not None and not select(record)):
+            continue
+        yield (tags["offset"], record) + replay(data[text_start:text_end].decode("latin_1"), record["fen"])
+
+
+class RunWriter:
+    """ Collects the postings and tree entries of games, and writes them to
+        sorted temporary files in directory """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.postings = []
+        self.tree = {}
+        self.posting_runs = []
+        self.tree_runs = []
+
+    def add_game(self, offset, record, hashes, moves):
+        game_key = offset << 16
+        seen = set()
+        # The start position is only indexed for games with a FEN
+        for ply in range(0 if record["fen"] else 1, min(len(hashes), MAX_PLY + 1)):
+            hash = hashes[ply]
+            # Repeated positions only at their first ply
+            if hash not in seen:
+                seen.add(hash)
+                self.postings.append(hash << 64 | game_key | ply)
+        if len(self.postings) >= RUN_SIZE:
+            self.write_postings()
+
+        result = record["result"]
+        score = (1, result == WHITEWON, result == DRAW, result == BLACKWON)
+        elos = (record["white_elo"], record["black_elo"])
+        fen = record["fen"]
+        color = BLACK if fen and fen.split()[1:2] == ["b"] else WHITE
+        for ply, move in enumerate(moves):
+            elo = elos[color]
+            key = hashes[ply] << 16 | move
+            entry = self.tree.get(key)
+            if entry is None:
+                entry = self.tree[key] = [0, 0, 0, 0, 0, 0]
+            for i in range(4):
+                entry[i] += score[i]
+            if elo:
+                entry[4] += elo
+                entry[5] += 1
+            color = 1 - color
+        if len(self.tree) >= RUN_SIZE:
+            self.write_tree()
+
+    def write_postings(self):
+        self.postings.sort()
+        pack = POSTING.pack
+        self.posting_runs.append(self.write_run(
+            [pack(key >> 64, key & 0xffffffffffffffff) for key in self.postings]))
+        self.postings = []
+
+    def write_tree(self):
+        pack = TREE_ENTRY.pack
+        self.tree_runs.append(self.write_run(
+            [pack(key >> 16, key & 0xffff, *self.tree[key]) for key in sorted(self.tree)]))
+        self.tree = {}
+
+    def write_run(self, records):
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"".join(records))
+        return path
+
+    def close(self):
+        if self.postings:
+            self.write_postings()
+        if self.tree:
+            self.write_tree()
+        return self.posting_runs, self.tree_runs
+
+
+def read_run(path, record_struct):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(record_struct.size * 4096)
+            if not data:
+                break
+            yield from record_struct.iter_unpack(data)
+
+
+def write_records(path, records, record_struct):
+    with open(path, "wb") as f:
+        pack = record_struct.pack
+        while True:
+            block = [pack(*record) for record in itertools.islice(records, 4096)]
+            if not block:
+                break
+            f.write(b"".join(block))
+
+
+def merge_tree(entries):
+    """ Sum the counts of the consecutive entries of the same move """
+
+    last = None
+    for entry in entries:
+        if last is not None and entry[:2] == last[:2]:
+            last = last[:2] + tuple(a + b for a, b in zip(last[2:], entry[2:]))
+        else:
+            if last is not None:
+                yield last
+            last = entry
+    if last is not None:
+        yield last
+
+
+def index_range(path, start, end, directory):
+    """ RunWriter runs of the games in a byte range of the .pgn file at path """
+
+    writer = RunWriter(directory)
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for game in iter_games(data, start, end):
+                writer.add_game(*game)
+        finally:
+            data.close()
+    return writer.close()
+
+
+def build_position_index(path, index_path, tree_path, start=0, processes=None):
+    """ Write the position index and the opening tree of the .pgn file at
+        path to index_path and tree_path. With start > 0 the games from byte
+        start on are added to the existing files. """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(index_path)))
+    posting_runs = []
+    tree_runs = []
+    try:
+        if is_compressed(path):
+            writer = RunWriter(directory)
+            handle = protoopen(path)
+            try:
+                handle.buffer.seek(start)
+                for data, end, base_offset, line_end_fix in read_stream_parts(handle.buffer):
+                    for game in iter_games(data, 0, end, base_offset, line_end_fix):
+                        writer.add_game(*game)
+            finally:
+                handle.close()
+            posting_runs, tree_runs = writer.close()
+        elif processes > 1 and os.path.getsize(path) - start > PART_SIZE:
+            pool = multiprocessing.Pool(processes)
+            try:
+                for runs in pool.starmap(index_range, [(path, part_start, part_end, directory)
+                                                       for part_start, part_end in split_games(path, PART_SIZE, start)]):
+                    posting_runs += runs[0]
+                    tree_runs += runs[1]
+            finally:
+                pool.terminate()
+                pool.join()
+        elif os.path.getsize(path) > start:
+            posting_runs, tree_runs = index_range(path, start, None, directory)
+
+        postings = [read_run(run, POSTING) for run in posting_runs]
+        entries = [read_run(run, TREE_ENTRY) for run in tree_runs]
+        if start > 0:
+            postings.append(read_run(index_path, POSTING))
+            entries.append(read_run(tree_path, TREE_ENTRY))
+
+        # Replace the old files only when the new ones are complete
+        write_records(index_path + ".tmp", heapq.merge(*postings), POSTING)
+        write_records(tree_path + ".tmp", merge_tree(heapq.merge(*entries)), TREE_ENTRY)
+        os.replace(index_path + ".tmp", index_path)
+        os.replace(tree_path + ".tmp", tree_path)
+    finally:
+        for run in os.listdir(directory):
+            os.remove(os.path.join(directory, run))
+        os.rmdir(directory)
+
+
+class SortedFile:
+    """ Reader of a file of records sorted by their first field """
+
+    record_struct = POSTING
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.count = os.fstat(self.file.fileno()).st_size // self.record_struct.size
+        if self.count > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.count > 0:
+            self.data.close()
+        self.file.close()
+
+    def lower_bound(self, key):
+        """ Index of the first record of key, or of the next bigger key """
+
+        unpack_from = self.record_struct.unpack_from
+        size = self.record_struct.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack_from(self.data, mid * size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def iter_records(self, key, skip=0):
+        """ Yield the records of key, but the first skip ones """
+        unpack_from = self.record_struct.unpack_from
+        size = self.record_struct.size
+        for i in range(self.lower_bound(key) + skip, self.count):
+            record = unpack_from(self.data, i * size)
+            if record[0] != key:
+                break
+            yield record
+
+
+class PositionIndex(SortedFile):
+    """ Reader of a position index file """
+
+    def has_position(self, hash):
+        return next(self.iter_records(hash), None) is not None
+
+    def iter_games(self, hash, skip=0):
+        """ Yield the (offset, ply) of the games with the position of hash in
+            file order, with the first ply the position occurs at, but the
+            first skip games """
+
+        for posting_hash, key in self.iter_records(hash, skip):
+            yield key >> 16, key & MAX_PLY
+
+
+class OpeningTree(SortedFile):
+    """ Reader of an opening tree file """
+
+    record_struct = TREE_ENTRY
+
+    def get_moves(self, hash):
+        """ Return the (polyglot move, games, white wins, draws, black wins,
+            average Elo) of the moves played in the position of hash """
+
+        return [(move, games, white_wins, draws, black_wins, elo_sum // elo_games if elo_games else 0)
+                for hash, move, games, white_wins, draws, black_wins, elo_sum, elo_games
+                in self.iter_records(hash)]
@@ -1,35 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
 import shutil
-import time
+import sqlite3
 
 from sqlalchemy import create_engine, MetaData, Table, Column, Integer,\
-    String, SmallInteger, ForeignKey, event, select
+    String, SmallInteger, ForeignKey, Index, event, select, DDL
+from sqlalchemy.schema import CreateTable
 from sqlalchemy.engine import Engine
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.event import listen
+from sqlalchemy.pool import StaticPool, QueuePool
 from sqlalchemy.exc import OperationalError
 # from sqlalchemy.ext.compiler import compiles
 # from sqlalchemy.sql.expression import Executable, ClauseElement, _literal_as_text
 
+from pychess.System import conf
 from pychess.System.Log import log
 from pychess.System.prefix import addUserCachePrefix
 
 
-@event.listens_for(Engine, "before_cursor_execute")
-def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    context._query_start_time = time.time()
-    log.debug("Start Query:\n%s" % statement, extra={"task": "SQL"})
-    log.debug("Parameters:\n%r" % (parameters,), extra={"task": "SQL"})
-
-
-@event.listens_for(Engine, "after_cursor_execute")
-def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    total = time.time() - context._query_start_time
-    log.debug("Query Complete!", extra={"task": "SQL"})
-    log.debug("Total Time: %.02fms" % (total * 1000), extra={"task": "SQL"})
-
-
 # Just to make sphinx happy...
 # try:
 #     class Explain(Executable, ClauseElement):
@@ -47,19 +37,36 @@ def after_cursor_execute(conn, cursor, statement, parameters, context, executema
 #     return text
 
 
+# Milliseconds a connection waits for the lock of another one
+BUSY_TIMEOUT = 10000
+
+# Connections of the read engine of a database
+READ_POOL_SIZE = 4
+
+
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     # www.sqlite.org/pragma.html
     cursor.execute("PRAGMA page_size = 4096")
-    cursor.execute("PRAGMA cache_size=10000")
+    # Negative cache sizes are in KiB
+    cursor.execute("PRAGMA cache_size=-%d" % conf.get("sqlite_cache_size"))
+    cursor.execute("PRAGMA mmap_size=%d" % conf.get("sqlite_mmap_size"))
     # cursor.execute("PRAGMA locking_mode=EXCLUSIVE")
     cursor.execute("PRAGMA synchronous=NORMAL")
-    # cursor.execute("PRAGMA journal_mode=WAL")
+    # With a write-ahead log the game list can read while an import writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=%d" % BUSY_TIMEOUT)
     # cursor.execute("PRAGMA foreign_keys=ON")
     cursor.close()
 
 
+def set_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
 def insert_or_ignore(engine, stmt):
     if engine.name == "sqlite":
         # can't use "OR UPDATE" because it delete+insert records
@@ -74,13 +81,46 @@ def insert_or_ignore(engine, stmt):
 engines = {}
 
 # PyChess database schema version
-SCHEMA_VERSION = "20180221"
+SCHEMA_VERSION = "20261020"
 
 
 def get_schema_version(engine):
     return engine.execute(select([schema_version.c.version])).scalar()
 
 
+def parseDateTag(tag):
+    elements = re.match(r"^([0-9\?]{4})(\.([0-9\?]{2})(\.([0-9\?]{2}))?)?$", tag)
+    if elements is None:
+        y, m, d = None, None, None
+    else:
+        elements = elements.groups()
+        try:
+            y = int(elements[0])
+        except Exception:
+            y = None
+        try:
+            m = int(elements[2])
+        except Exception:
+            m = None
+        try:
+            d = int(elements[4])
+        except Exception:
+            d = None
+    return y, m, d
+
+
+def date_key(tag):
+    """ The yyyymmdd int of a Date tag, with 0 for its unknown parts """
+    y, m, d = parseDateTag(tag)
+    return (y or 0) * 10000 + (m or 0) * 100 + (d or 0)
+
+
+def parse_int(tag):
+    """ The int of an Elo or PlyCount tag, 0 when it is unknown """
+    tag = str(tag)
+    return int(tag) if tag.isdigit() else 0
+
+
 def get_engine(path=None, dialect="sqlite", echo=False):
     if path is None:
         # In memory database
@@ -99,6 +139,9 @@ def get_engine(path=None, dialect="sqlite", echo=False):
                 shutil.copyfile(empty_db, path)
             engine = create_engine(url, echo=echo)
 
+        if path is not None and path != empty_db and get_schema_version(engine) in migrations:
+            migrate(engine)
+
         if path != empty_db and (path is None or get_schema_version(engine) != SCHEMA_VERSION):
             metadata.drop_all(engine)
             metadata.create_all(engine)
@@ -108,6 +151,26 @@ def get_engine(path=None, dialect="sqlite", echo=False):
         return engine
 
 
+read_engines = {}
+
+
+def get_read_engine(engine):
+    """ Return the engine of a pool of read only connections to the database
+        of engine. Writes, like imports, go through engine, one connection
+        at a time, and don't block these readers. """
+    path = engine.url.database
+    if not path:
+        # An in memory database has only one connection
+        return engine
+
+    if path not in read_engines:
+        read_engine = create_engine(engine.url, connect_args={'check_same_thread': False},
+                                    echo=engine.echo, poolclass=QueuePool, pool_size=READ_POOL_SIZE)
+        listen(read_engine, "connect", set_query_only)
+        read_engines[path] = read_engine
+    return read_engines[path]
+
+
 metadata = MetaData()
 
 source = Table(
@@ -144,6 +207,46 @@ player = Table(
 pl1 = player.alias()
 pl2 = player.alias()
 
+
+def has_fts5_trigram():
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE VIRTUAL TABLE test USING fts5(name, tokenize='trigram')")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+# SQLite 3.34 and later can index the names by their trigrams, so that the
+# names containing a text are found without reading them all
+FTS5_TRIGRAM = has_fts5_trigram()
+
+name_tables = (player, event, site, annotator)
+
+# The FTS5 tables of the names, with the rowid of their name table rows
+fts_metadata = MetaData()
+fts_tables = {}
+
+FTS_CREATE = ("CREATE VIRTUAL TABLE %(table)s_fts USING fts5"
+              "(name, content='%(table)s', content_rowid='id', tokenize='trigram')")
+FTS_TRIGGER = ("CREATE TRIGGER %(table)s_fts_insert AFTER INSERT ON %(table)s BEGIN "
+               "INSERT INTO %(table)s_fts(rowid, name) VALUES (new.id, new.name); END")
+
+for table in name_tables:
+    fts_tables[table] = Table(
+        "%s_fts" % table.name, fts_metadata,
+        Column('rowid', Integer, primary_key=True),
+        Column('name', String(256)),
+    )
+    listen(table, "after_create", DDL(FTS_CREATE).execute_if(
+        dialect="sqlite", callable_=lambda *args, **kwargs: FTS5_TRIGRAM))
+    listen(table, "after_create", DDL(FTS_TRIGGER).execute_if(
+        dialect="sqlite", callable_=lambda *args, **kwargs: FTS5_TRIGRAM))
+    listen(table, "before_drop", DDL(
+        "DROP TABLE IF EXISTS %(table)s_fts"
+    ).execute_if(dialect="sqlite"))
+
 game = Table(
     'game', metadata,
     Column('id', Integer, primary_key=True, index=True),
@@ -152,13 +255,14 @@ game = Table(
     Column('event_id', Integer, ForeignKey('event.id'), index=True),
     Column('site_id', Integer, ForeignKey('site.id'), index=True),
     Column('date', String(10), default=""),
+    Column('date_key', Integer, default=0),
     Column('round', String(8), default=""),
     Column('white_id', Integer, ForeignKey('player.id'), index=True),
     Column('black_id', Integer, ForeignKey('player.id'), index=True),
     Column('result', SmallInteger, default=0),
-    Column('white_elo', String(4), default=""),
-    Column('black_elo', String(4), default=""),
-    Column('ply_count', String(3), default=""),
+    Column('white_elo', Integer, default=0),
+    Column('black_elo', Integer, default=0),
+    Column('ply_count', Integer, default=0),
     Column('eco', String(3), default=""),
     Column('time_control', String(7), default=""),
     Column('board', SmallInteger, default=0),
@@ -166,6 +270,10 @@ game = Table(
     Column('variant', SmallInteger, default=0),
     Column('annotator_id', Integer, ForeignKey('annotator.id'), index=True),
     Column('source_id', Integer, ForeignKey('source.id'), index=True),
+    # Sorted pages of games are read from these in order
+    Index('ix_game_date_key_offset', 'date_key', 'offset'),
+    Index('ix_game_white_elo_offset', 'white_elo', 'offset'),
+    Index('ix_game_black_elo_offset', 'black_elo', 'offset'),
 )
 
 tag_game = Table(
@@ -182,6 +290,16 @@ schema_version = Table(
     Column('version', String(8)),
 )
 
+# Size and crc32 of the start of the .pgn file the .sqlite and .pos indexes
+# were made from, to find out if games were only appended to it since
+indexed_file = Table(
+    'indexed_file', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(8), unique=True),
+    Column('size', Integer),
+    Column('checksum', Integer),
+)
+
 
 def drop_indexes(engine):
     for table in metadata.tables.values():
@@ -208,6 +326,86 @@ def ini_schema_version(engine):
     conn.close()
 
 
+def get_indexed_file(engine, name):
+    """ Return the (size, checksum) of the .pgn file the name index was made
+        from, or None """
+    row = engine.execute(select([indexed_file.c.size, indexed_file.c.checksum])
+                         .where(indexed_file.c.name == name)).first()
+    return None if row is None else tuple(row)
+
+
+def set_indexed_file(engine, name, size, checksum):
+    conn = engine.connect()
+    with conn.begin():
+        conn.execute(indexed_file.delete().where(indexed_file.c.name == name))
+        conn.execute(indexed_file.insert(), [{"name": name, "size": size, "checksum": checksum}, ])
+    conn.close()
+
+
+def migrate_20180221(conn):
+    """ The indexed_file table and the FTS5 tables of the names were added """
+    indexed_file.create(bind=conn, checkfirst=True)
+    if FTS5_TRIGRAM:
+        for table in name_tables:
+            names = {"table": table.name}
+            conn.execute("DROP TABLE IF EXISTS %(table)s_fts" % names)
+            conn.execute("DROP TRIGGER IF EXISTS %(table)s_fts_insert" % names)
+            conn.execute(FTS_CREATE % names)
+            conn.execute(FTS_TRIGGER % names)
+            # Index the names already in the table
+            conn.execute("INSERT INTO %(table)s_fts(%(table)s_fts) VALUES('rebuild')" % names)
+
+
+def migrate_20261019(conn):
+    """ Elo, ply count and date key columns became numbers """
+    raw_conn = conn.connection
+    raw_conn.create_function("parse_int", 1, parse_int)
+    raw_conn.create_function("date_key", 1, date_key)
+
+    # Keep the references of the other tables to game while it is renamed
+    conn.execute("PRAGMA legacy_alter_table=ON")
+    conn.execute("ALTER TABLE game RENAME TO game_old")
+    conn.execute("PRAGMA legacy_alter_table=OFF")
+    for index in game.indexes:
+        conn.execute("DROP INDEX IF EXISTS %s" % index.name)
+    conn.execute(CreateTable(game))
+
+    columns = [column.name for column in game.columns]
+    values = {
+        "date_key": "date_key(date)",
+        "white_elo": "parse_int(white_elo)",
+        "black_elo": "parse_int(black_elo)",
+        "ply_count": "parse_int(ply_count)",
+    }
+    conn.execute('INSERT INTO game (%s) SELECT %s FROM game_old' % (
+        ", ".join('"%s"' % column for column in columns),
+        ", ".join(values.get(column, '"%s"' % column) for column in columns)))
+    conn.execute("DROP TABLE game_old")
+    for index in game.indexes:
+        index.create(bind=conn)
+
+
+# schema version: (next schema version, function migrating the databases)
+migrations = {
+    "20180221": ("20261019", migrate_20180221),
+    "20261019": ("20261020", migrate_20261019),
+}
+
+
+def migrate(engine):
+    """ Migrate the database to the current schema version, if possible
+        without making it again """
+    version = get_schema_version(engine)
+    conn = engine.connect()
+    while version in migrations:
+        log.info("Migrating database from schema version %s" % version)
+        version, migration = migrations[version]
+        with conn.begin():
+            migration(conn)
+            conn.execute(schema_version.update().values(version=version))
+    conn.close()
+
+
 # create an empty database to use as skeleton
 empty_db = os.path.join(addUserCachePrefix("%s.sqlite" % SCHEMA_VERSION))
 if not os.path.isfile(empty_db):
@@ -0,0 +1,141 @@
+""" Opt-in profiling of the SQL statements run by all engines.
+
+    Nothing listens to the engines until enable() is called, so the
+    statements cost nothing extra otherwise. While enabled, the run time of
+    every statement is collected under its shape, the statement with the
+    lists of ? of IN clauses and of multi-row VALUES collapsed, and the
+    slowest single runs are kept with their parameters.
+"""
+
+import heapq
+import itertools
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from pychess.System.Log import log
+
+# A run of ? placeholders, like the ones of an IN list
+PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+# Rows of placeholders of a multi-row VALUES
+VALUE_ROWS = re.compile(r"(\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+")
+
+
+def statement_shape(statement):
+    shape = PLACEHOLDERS.sub("?...", " ".join(statement.split()))
+    return VALUE_ROWS.sub(r"\1...", shape)
+
+
+def percentile(times, fraction):
+    """ The time at fraction of the sorted times """
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+
+class QueryProfiler:
+    """ Collects the run times of the SQL statements of the engines """
+
+    def __init__(self, slowest=10):
+        self.slowest_size = slowest
+        self.reset()
+
+    def reset(self):
+        # shape: [run times]
+        self.times = {}
+        # statement: shape
+        self.shapes = {}
+        # heap of the slowest (time, run number, statement, parameters), the
+        # run number keeping the equal times from comparing the parameters
+        self.slowest = []
+        self.run_numbers = itertools.count()
+        # rows of executemany() runs by shape
+        self.rows = {}
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+
+        shape = self.shapes.get(statement)
+        if shape is None:
+            shape = self.shapes[statement] = statement_shape(statement)
+        times = self.times.get(shape)
+        if times is None:
+            times = self.times[shape] = []
+        times.append(elapsed)
+        if executemany:
+            self.rows[shape] = self.rows.get(shape, 0) + len(parameters)
+
+        run = (elapsed, next(self.run_numbers), statement, parameters)
+        if len(self.slowest) < self.slowest_size:
+            heapq.heappush(self.slowest, run)
+        elif elapsed > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, run)
+
+    def handle_error(self, context):
+        # No after_execute() for the failed statement
+        conn = context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+    def get_stats(self):
+        """ Return the (shape, runs, rows of executemany() runs, total time,
+            median time, 95th percentile time, max time) of the statements,
+            the ones taking most time first """
+
+        stats = []
+        for shape, times in self.times.items():
+            times = sorted(times)
+            stats.append((shape, len(times), self.rows.get(shape, 0), sum(times),
+                          percentile(times, 0.5), percentile(times, 0.95), times[-1]))
+        stats.sort(key=lambda stat: stat[3], reverse=True)
+        return stats
+
+    def get_slowest(self):
+        """ Return the (time, statement, parameters) of the slowest runs,
+            the slowest first """
+        return [(elapsed, statement, parameters) for elapsed, number, statement, parameters
+                in sorted(self.slowest, key=lambda run: run[0], reverse=True)]
+
+    def report(self, count=20):
+        lines = ["%8s %8s %10s %9s %9s %9s  %s" % (
+            "runs", "rows", "total ms", "p50 ms", "p95 ms", "max ms", "statement")]
+        for shape, runs, rows, total, median, p95, longest in self.get_stats()[:count]:
+            lines.append("%8d %8d %10.1f %9.2f %9.2f %9.2f  %s" % (
+                runs, rows, total * 1000, median * 1000, p95 * 1000, longest * 1000, shape[:200]))
+        lines.append("Slowest:")
+        for elapsed, statement, parameters in self.get_slowest():
+            lines.append("%9.2f ms  %s  %r" % (elapsed * 1000, " ".join(statement.split())[:200],
+                                               parameters if len(repr(parameters)) < 200 else "..."))
+        return "\n".join(lines)
+
+
+profiler = None
+
+
+def enable(slowest=10):
+    """ Start profiling the statements of all engines, and return the
+        profiler collecting them """
+    global profiler
+    if profiler is None:
+        profiler = QueryProfiler(slowest)
+        event.listen(Engine, "before_cursor_execute", profiler.before_execute)
+        event.listen(Engine, "after_cursor_execute", profiler.after_execute)
+        event.listen(Engine, "handle_error", profiler.handle_error)
+    return profiler
+
+
+def disable():
+    global profiler
+    if profiler is not None:
+        event.remove(Engine, "before_cursor_execute", profiler.before_execute)
+        event.remove(Engine, "after_cursor_execute", profiler.after_execute)
+        event.remove(Engine, "handle_error", profiler.handle_error)
+        profiler = None
+
+
+def log_report():
+    if profiler is not None:
+        log.info("SQL statements:\n%s" % profiler.report(), extra={"task": "SQL"})
@@ -12,9 +12,12 @@ try:
     from pychess.Utils.const import WHITE, ASEANCHESS, SITTUYINCHESS, ATOMICCHESS, reprResult, \
         CAMBODIANCHESS, LOSERSCHESS, KINGOFTHEHILLCHESS, DRAW, BLACKWON, WHITEWON, MAKRUKCHESS, \
         SUICIDECHESS, GIVEAWAYCHESS, THREECHECKCHESS, HORDECHESS, RACINGKINGSCHESS, PLACEMENTCHESS  # nopep8
-    from pychess.Utils.lutils import lsearch  # nopep8
+    from pychess.Utils.lutils import lsearch, leval  # nopep8
     from pychess.Utils.lutils.ldata import MAXPLY  # nopep8
     from pychess.Utils.lutils.lsearch import alphaBeta  # nopep8
+    from pychess.Utils.lutils.lsmp import HelperPool  # nopep8
+    from pychess.Utils.lutils.TranspositionTable import TranspositionTable, \
+        FileTranspositionTable  # nopep8
     from pychess.Utils.lutils.lmove import listToSan, toSAN  # nopep8
     from pychess.System.Log import log  # nopep8
 except ImportError:
@@ -38,6 +41,7 @@ class PyChess:
         self.post = False
         self.debug = True
         self.outOfBook = False
+        self.helpers = None  # Helper processes for parallel search
 
     def print(self, text):
         try:
@@ -46,6 +50,60 @@ class PyChess:
         except BrokenPipeError:
             sys.exit(0)
 
+    # Search related
+
+    def setCores(self, cores):
+        """ Search with cores - 1 helper processes besides our own """
+        if self.helpers is not None:
+            if self.helpers.count == cores - 1:
+                return
+            self.helpers.close()
+            self.helpers = None
+        if cores > 1:
+            self.helpers = HelperPool(cores - 1)
+
+    def setHashTable(self, maxSize, path=""):
+        """ Replace the transposition table by an empty one of maxSize bytes,
+            kept in the file at path if any, so its entries survive restarts """
+        cores = self.helpers.count + 1 if self.helpers is not None else 1
+        self.setCores(1)
+        # Release the old table first, as it may be mapped from the same file
+        lsearch.table.close()
+        lsearch.table = None
+        if path:
+            try:
+                lsearch.table = FileTranspositionTable(maxSize, path)
+            except (OSError, ValueError) as err:
+                self.print("tellusererror Cannot use hash file: %s" % err)
+        if lsearch.table is None:
+            lsearch.table = TranspositionTable(maxSize)
+        self.setCores(cores)
+
+    def setHashFile(self, path):
+        if path != getattr(lsearch.table, "path", ""):
+            self.setHashTable(lsearch.table.maxSize, path)
+
+    def setHashSize(self, maxSize):
+        if maxSize != lsearch.table.maxSize:
+            self.setHashTable(maxSize, getattr(lsearch.table, "path", ""))
+
+    def setMemory(self, megabytes):
+        """ Share megabytes between the transposition table and the pawn
+            hash """
+        size = megabytes * 1024 * 1024
+        # The pawn hash gets about 1/32 of it, as a power of two entries
+        entries = (size // 32) // leval.pawnEntryType.size
+        entries = 1 << max(entries.bit_length() - 1, 8)
+        if entries != leval.PAWN_HASH_SIZE:
+            leval.setPawnHashSize(entries)
+        self.setHashSize(size - entries * leval.pawnEntryType.size)
+
+    def searchedNodes(self):
+        nodes = lsearch.nodes
+        if self.helpers is not None:
+            nodes += self.helpers.getNodes()
+        return nodes
+
     # Play related
 
     def __remainingMovesA(self):
@@ -125,6 +183,11 @@ class PyChess:
                 else:
                     self.print("# Searching to depth %d without timelimit" % self.sd)
 
+            # The helpers take the search_id from the shared table
+            lsearch.table.newSearch()
+            if self.helpers is not None:
+                self.helpers.start(self.board)
+
             for depth in range(1, self.sd + 1):
                 # Heuristic time saving
                 # Don't waste time, if the estimated isn't enough to complete
@@ -141,7 +204,7 @@ class PyChess:
                         pv1 = " ".join(listToSan(self.board, mvs))
                         time_cs = int(100 * (time() - starttime))
                         self.print("%s %s %s %s %s" % (
-                            depth, self.scr, time_cs, lsearch.nodes, pv1))
+                            depth, self.scr, time_cs, self.searchedNodes(), pv1))
                 else:
                     # We were interrupted
                     if depth == 1:
@@ -152,6 +215,9 @@ class PyChess:
                 self.clock[self.playingAs] -= time(
                 ) - starttime - self.increment
 
+            if self.helpers is not None:
+                self.helpers.halt()
+
             if not mvs:
                 if not lsearch.searching:
                     # We were interupted
@@ -190,6 +256,11 @@ class PyChess:
         start = time()
         lsearch.endtime = sys.maxsize
         lsearch.searching = True
+        lsearch.nodes = 0
+
+        lsearch.table.newSearch()
+        if self.helpers is not None:
+            self.helpers.start(self.board)
 
         for depth in range(1, self.sd):
             if not lsearch.searching:
@@ -199,9 +270,12 @@ class PyChess:
 
             pv1 = " ".join(listToSan(board, mvs))
             time_cs = int(100 * (time() - start))
-            self.print("%s %s %s %s %s" % (depth, scr, time_cs, lsearch.nodes, pv1))
+            # The nodes of the whole search, like the helpers count them
+            self.print("%s %s %s %s %s" % (depth, scr, time_cs, self.searchedNodes(), pv1))
 
-            lsearch.nodes = 0
+        if self.helpers is not None:
+            self.helpers.halt()
+        lsearch.nodes = 0
 
 
 if __name__ == "__main__":
@@ -14,7 +14,7 @@ from pychess.Utils.const import NORMALCHESS, FEN_START, BLACK, FISCHERRANDOMCHES
     SITTUYINCHESS, GIVEAWAYCHESS, HORDECHESS, RACINGKINGSCHESS, PLACEMENTCHESS, \
     SCHESS, LIGHTBRIGADECHESS, WHITE
 from pychess.Utils.lutils.Benchmark import benchmark
-from pychess.Utils.lutils.perft import perft
+from pychess.Utils.lutils.perft import perft, fast_perft
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.lutils.ldata import MAXPLY
 from pychess.Utils.lutils import lsearch, leval
@@ -72,11 +72,15 @@ class PyChessCECP(PyChess):
             "pause": 0,  # Unimplemented
             "nps": 0,  # Unimplemented
             "debug": 1,
-            "memory": 0,  # Unimplemented
-            "smp": 0,  # Unimplemented
+            "memory": 1,
+            "smp": 1,
             "egt": "gaviota",
-            "option": "skipPruneChance -slider 0 0 100"
         }
+        self.options = [
+            "skipPruneChance -slider 0 0 100",
+            "Hash -spin 32 1 4096",
+            "hashFile -file ",
+        ]
         python = sys.executable.split("/")[-1]
         python_version = "%s.%s.%s" % sys.version_info[0:3]
         self.print("# %s [%s %s]" %
@@ -114,6 +118,8 @@ class PyChessCECP(PyChess):
                     stringPairs = ["=".join([k, '"%s"' % v if isinstance(
                         v, str) else str(v)]) for k, v in self.features.items()]
                     self.print("feature %s" % " ".join(stringPairs))
+                    for option in self.options:
+                        self.print('feature option="%s"' % option)
                     self.print("feature done=1")
 
                 elif lines[0] in ("accepted", "rejected"):
@@ -333,20 +339,24 @@ class PyChessCECP(PyChess):
                 # Unimplemented: pause, resume
 
                 elif lines[0] == "memory":
-                    # FIXME: this is supposed to control the *total* memory use.
+                    # Helper processes of a parallel search share the
+                    # transposition table, but have their own pawn hash.
                     if lsearch.searching:
-                        self.print("Error (already searching):", line)
+                        self.print("Error (already searching): %s" % line)
                     else:
                         limit = int(lines[1])
                         if limit < 1:
-                            self.print("Error (limit too low):", line)
+                            self.print("Error (limit too low): %s" % line)
                         else:
-                            pass
-                            # TODO implement
-                            # lsearch.setHashSize(limit)
+                            self.setMemory(limit)
 
                 elif lines[0] == "cores":
-                    pass  # We aren't SMP-capable.
+                    self.__stopSearching()
+                    cores = int(lines[1])
+                    if cores < 1:
+                        self.print("Error (cores must be positive): %s" % line)
+                    else:
+                        self.setCores(cores)
 
                 elif lines[0] == "egtpath":
                     if len(lines) >= 3 and lines[1] == "gaviota":
@@ -358,12 +368,19 @@ class PyChessCECP(PyChess):
                         enableEGTB()
 
                 elif lines[0] == "option" and len(lines) > 1:
-                    name, eq, value = lines[1].partition("=")
-                    if value:
-                        value = int(
-                            value
-                        )  # CECP spec says option values are *always* numeric
-                    if name == "skipPruneChance":
+                    name, eq, value = line.strip().split(None, 1)[1].partition("=")
+                    if name == "Hash":
+                        value = int(value)
+                        if value < 1:
+                            self.print("Error (limit too low): %s" % line)
+                        else:
+                            self.__stopSearching()
+                            self.setHashSize(value * 1024 * 1024)
+                    elif name == "hashFile":
+                        self.__stopSearching()
+                        self.setHashFile(value)
+                    elif name == "skipPruneChance":
+                        value = int(value)
                         if 0 <= value <= 100:
                             self.skipPruneChance = value / 100.0
                         else:
@@ -420,6 +437,14 @@ class PyChessCECP(PyChess):
                     else:
                         self.print("Error (arguments must be integer")
 
+                elif lines[0] == "fastperft":
+                    root = "0" if len(lines) < 3 else lines[2]
+                    depth = "1" if len(lines) == 1 else lines[1]
+                    if root.isdigit() and depth.isdigit():
+                        fast_perft(self.board, int(depth), int(root))
+                    else:
+                        self.print("Error (arguments must be integer")
+
                 elif lines[0] == "stop_unittest":
                     break
 
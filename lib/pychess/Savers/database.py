@@ -1,35 +1,16 @@
 # -*- coding: UTF-8 -*-
-import re
-
-from sqlalchemy import select, func, and_, or_
+from sqlalchemy import select, func, and_, or_, bindparam
 
 from pychess.Utils.const import FEN_START, WHITE, BLACK, reprResult
 from pychess.Database import model as dbmodel
-from pychess.Database.model import game, event, site, player, pl1, pl2, annotator, source, tag_game
+from pychess.Database.model import game, event, site, player, pl1, pl2, annotator, source, tag_game, \
+    fts_tables, parseDateTag, date_key, parse_int
 
 
 count_games = select([func.count()]).select_from(game)
 
-
-def parseDateTag(tag):
-    elements = re.match(r"^([0-9\?]{4})(\.([0-9\?]{2})(\.([0-9\?]{2}))?)?$", tag)
-    if elements is None:
-        y, m, d = None, None, None
-    else:
-        elements = elements.groups()
-        try:
-            y = int(elements[0])
-        except Exception:
-            y = None
-        try:
-            m = int(elements[2])
-        except Exception:
-            m = None
-        try:
-            d = int(elements[4])
-        except Exception:
-            d = None
-    return y, m, d
+# Usual number of games of a page of the game list
+PAGE_SIZE = 100
 
 
 def save(path, model, offset, flip=False):
@@ -49,8 +30,8 @@ def save(path, model, offset, flip=False):
     time_control = model.tags["TimeControl"]
     board = int(model.tags["Board"]) if "Board" in model.tags else 0
 
-    white_elo = model.tags["WhiteElo"]
-    black_elo = model.tags["BlackElo"]
+    white_elo = parse_int(model.tags["WhiteElo"])
+    black_elo = parse_int(model.tags["BlackElo"])
 
     variant = model.variant.variant
 
@@ -89,6 +70,7 @@ def save(path, model, offset, flip=False):
             'event_id': event_id,
             'site_id': site_id,
             'date': date,
+            'date_key': date_key(date),
             'round': game_round,
             'white_id': white_id,
             'black_id': black_id,
@@ -128,6 +110,7 @@ col2label = {game.c.id: "Id",
              site.c.name: "Site",
              game.c.round: "Round",
              game.c.date: "Date",
+             game.c.date_key: "DateKey",
              game.c.white_elo: "WhiteElo",
              game.c.black_elo: "BlackElo",
              game.c.ply_count: "PlyCount",
@@ -166,6 +149,14 @@ class TagDatabase:
         self.where_offs = None
         self.where_offs8 = None
 
+        # Databases made with an SQLite without FTS5 trigrams have no name index
+        self.has_name_index = self.engine.has_table(fts_tables[player].name)
+
+        # The query of the next page is kept until the filters or the order
+        # change, so paging executes the same statement, compiled once
+        self.page_query = None
+        self.compiled_cache = {}
+
     def get_count(self):
         return self.engine.execute(count_games).scalar()
     count = property(get_count)
@@ -176,29 +167,53 @@ class TagDatabase:
     def build_order_by(self, order_col, is_desc):
         self.is_desc = is_desc
         self.order_cols = (order_col, game.c.offset)
+        self.page_query = None
+
+    def name_ids(self, table, name):
+        """ Select the ids of the names of table containing name """
+        pattern = "%%%s%%" % name
+        if self.has_name_index:
+            fts_table = fts_tables[table]
+            return select([fts_table.c.rowid]).where(fts_table.c.name.like(pattern))
+        else:
+            return select([table.c.id]).where(table.c.name.like(pattern))
+
+    def where_name(self, columns, table, name):
+        """ Where clause of the games with a name of table containing name
+            as the id in one of columns """
+        ids = self.name_ids(table, name)
+        games = sum(self.engine.execute(select([func.count()]).where(column.in_(ids))).scalar()
+                    for column in columns)
+        # Collecting and sorting all the games of the names for every page is
+        # slower than going through the games in order until a page is full
+        # when the names have many games, so the id indexes are not used then
+        if games * games > self.count * PAGE_SIZE:
+            columns = [column + 0 for column in columns]
+        return or_(*[column.in_(ids) for column in columns])
 
     def build_where_tags(self, tag_query):
+        # Names are looked up in their tables, and the games by the name ids,
+        # instead of matching the names of every game
+        self.page_query = None
         if tag_query is not None:
             tags = []
             if "white" in tag_query:
                 if "ignore_tag_colors" in tag_query:
-                    tags.append(or_(pl1.c.name.like("%%%s%%" % tag_query["white"]),
-                                    pl2.c.name.like("%%%s%%" % tag_query["white"])))
+                    tags.append(self.where_name((game.c.white_id, game.c.black_id), player, tag_query["white"]))
                 else:
-                    tags.append(pl1.c.name.like("%%%s%%" % tag_query["white"]))
+                    tags.append(self.where_name((game.c.white_id, ), player, tag_query["white"]))
 
             if "black" in tag_query:
                 if "ignore_tag_colors" in tag_query:
-                    tags.append(or_(pl1.c.name.like("%%%s%%" % tag_query["black"]),
-                                    pl2.c.name.like("%%%s%%" % tag_query["black"])))
+                    tags.append(self.where_name((game.c.white_id, game.c.black_id), player, tag_query["black"]))
                 else:
-                    tags.append(pl2.c.name.like("%%%s%%" % tag_query["black"]))
+                    tags.append(self.where_name((game.c.black_id, ), player, tag_query["black"]))
 
             if "event" in tag_query:
-                tags.append(event.c.name.like("%%%s%%" % tag_query["event"])),
+                tags.append(self.where_name((game.c.event_id, ), event, tag_query["event"]))
 
             if "site" in tag_query:
-                tags.append(site.c.name.like("%%%s%%" % tag_query["site"])),
+                tags.append(self.where_name((game.c.site_id, ), site, tag_query["site"]))
 
             if "eco_from" in tag_query:
                 tags.append(game.c.eco >= tag_query["eco_from"])
@@ -207,7 +222,7 @@ class TagDatabase:
                 tags.append(game.c.eco <= tag_query["eco_to"])
 
             if "annotator" in tag_query:
-                tags.append(annotator.c.name.like("%%%s%%" % tag_query["annotator"])),
+                tags.append(self.where_name((game.c.annotator_id, ), annotator, tag_query["annotator"]))
 
             if "variant" in tag_query:
                 tags.append(game.c.variant == int(tag_query["variant"])),
@@ -216,46 +231,36 @@ class TagDatabase:
                 tags.append(game.c.result == reprResult.index(tag_query["result"])),
 
             if "date_from" in tag_query:
-                tags.append(game.c.date >= tag_query["date_from"])
+                tags.append(game.c.date_key >= date_key(tag_query["date_from"]))
 
             if "date_to" in tag_query:
-                # When date_to is not given as full date we have to prepare
-                # date_to filled with some "?" to get correct query results
-                # because for example "2018.??.??" is greater than "2018"
-                date_to = tag_query["date_to"]
-                y, m, d = parseDateTag(date_to)
-                y = "%04d" % y if y is not None else "????"
-                m = "%02d" % m if m is not None else "??"
-                d = "%02d" % d if d is not None else "??"
-                date_to = "%s.%s.%s" % (y, m, d)
-
-                tags.append(game.c.date <= date_to)
+                # When date_to is not given as full date, all the days of its
+                # year or month are included, and games of unknown years are not
+                y, m, d = parseDateTag(tag_query["date_to"])
+                if y is not None:
+                    tags.append(game.c.date_key.between(10000, y * 10000 + (m or 99) * 100 + (d or 99)))
 
             if "elo_from" in tag_query:
-                tags.append(game.c.white_elo >= tag_query["elo_from"])
-                tags.append(game.c.black_elo >= tag_query["elo_from"])
-
-                # white_elo and black_elo are String(4) in game table
-                # we need to prevent selecting games where a player elo is 999 or 400
-                # when tag_query["elo_from"] is for example was set to 2200
-                tags.append(game.c.white_elo < "4")
-                tags.append(game.c.black_elo < "4")
+                tags.append(game.c.white_elo >= int(tag_query["elo_from"]))
+                tags.append(game.c.black_elo >= int(tag_query["elo_from"]))
 
             if "elo_to" in tag_query:
-                tags.append(game.c.white_elo <= tag_query["elo_to"])
-                tags.append(game.c.black_elo <= tag_query["elo_to"])
+                tags.append(game.c.white_elo <= int(tag_query["elo_to"]))
+                tags.append(game.c.black_elo <= int(tag_query["elo_to"]))
 
             self.where_tags = and_(*tags)
         else:
             self.where_tags = None
 
     def build_where_offs8(self, offset_list):
+        self.page_query = None
         if offset_list is not None and len(offset_list) > 0:
             self.where_offs8 = game.c.offset8.in_(offset_list)
         else:
             self.where_offs8 = None
 
     def build_where_offs(self, offset_list):
+        self.page_query = None
         if offset_list is not None and len(offset_list) > 0:
             self.where_offs = game.c.offset.in_(offset_list)
         else:
@@ -273,26 +278,38 @@ class TagDatabase:
         if self.where_offs is not None:
             self.query = self.query.where(self.where_offs)
 
-    def get_records(self, last_seen, limit):
+    def build_page_query(self):
         self.build_query()
+        self.compiled_cache.clear()
         # we use .where() to implement pagination because .offset() doesn't scale on big tables
         # http://sqlite.org/cvstrac/wiki?p=ScrollingCursor
         # https://stackoverflow.com/questions/21082956/sqlite-scrolling-cursor-how-to-scroll-correctly-with-duplicate-names
+        last_value = bindparam("last_value")
+        last_offset = bindparam("last_offset")
         if self.is_desc:
-            query = self.query.where(or_(self.order_cols[0] < last_seen[0],
-                                         and_(self.order_cols[0] == last_seen[0],
-                                              self.order_cols[1] < last_seen[1]))
-                                     ).order_by(self.order_cols[0].desc(), self.order_cols[1].desc()).limit(limit)
+            self.page_query = self.query.where(or_(self.order_cols[0] < last_value,
+                                                   and_(self.order_cols[0] == last_value,
+                                                        self.order_cols[1] < last_offset))
+                                               ).order_by(self.order_cols[0].desc(), self.order_cols[1].desc())
         else:
-            query = self.query.where(or_(self.order_cols[0] > last_seen[0],
-                                         and_(self.order_cols[0] == last_seen[0],
-                                              self.order_cols[1] > last_seen[1]))
-                                     ).order_by(*self.order_cols).limit(limit)
+            self.page_query = self.query.where(or_(self.order_cols[0] > last_value,
+                                                   and_(self.order_cols[0] == last_value,
+                                                        self.order_cols[1] > last_offset))
+                                               ).order_by(*self.order_cols)
+        self.page_query = self.page_query.limit(bindparam("limit"))
+
+    def get_records(self, last_seen, limit):
+        if self.page_query is None:
+            self.build_page_query()
 
         # log.debug(self.engine.execute(Explain(query)).fetchall(), extra={"task": "SQL"})
 
-        result = self.engine.execute(query)
-        records = result.fetchall()
+        conn = self.engine.connect().execution_options(compiled_cache=self.compiled_cache)
+        try:
+            result = conn.execute(self.page_query, last_value=last_seen[0], last_offset=last_seen[1], limit=limit)
+            records = result.fetchall()
+        finally:
+            conn.close()
 
         return records
 
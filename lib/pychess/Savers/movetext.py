@@ -0,0 +1,66 @@
+""" Tokens of the movetext of .pgn games """
+
+import re
+
+from pychess.Utils.lutils.lmove import parseAny, ParsingError
+
+# token categories
+COMMENT_REST, COMMENT_BRACE, COMMENT_NAG, \
+    VARIATION_START, VARIATION_END, \
+    RESULT, FULL_MOVE, MOVE, MOVE_COMMENT = range(1, 10)
+
+pattern = re.compile(r"""
+    (\;.*?[\n\r])        # comment, rest of line style
+    |(\{.*?\})           # comment, between {}
+    |(\$[0-9]+)          # comment, Numeric Annotation Glyph
+    |(\()                # variation start
+    |(\))                # variation end
+    |(\*|1-0|0-1|1/2)    # result (spec requires 1/2-1/2 for draw, but we want to tolerate simple 1/2 too)
+    |(
+    ([a-hKkQqRrBNnMmSsFHE][a-hxKQRBNMSFHE1-8+#=\-/]{1,6}
+    |[PNBRQMSFK]@[a-h][1-8][+#]?  # drop move
+    |o\-?o(?:\-?o)?      # castling notation using letter 'o' with or without '-'
+    |O\-?O(?:\-?O)?(?:/[HE][a-h][18]?)?      # castling notation using letter 'O' with or without '-'
+    |0\-0(?:\-0)?        # castling notation using zero with required '-'
+    |\-\-)               # non standard '--' is used for null move inside variations
+    ([\?!]{1,2})*
+    )    # move (full, count, move with ?!, ?!)
+    """, re.VERBOSE | re.DOTALL)
+
+# The empty, tag and single line comment lines before the movetext of a game
+HEADER_LINES = re.compile(r"(?:(?:[\[%][^\n]*)?\r?\n)*")
+
+
+def iter_mainline(text):
+    """ Yield the move strings of the main line of the game text, which may
+        start with its header. Variations, comments and NAGs are skipped. """
+
+    depth = 0
+    for match in pattern.finditer(text, HEADER_LINES.match(text).end()):
+        group = match.lastindex
+        if group == VARIATION_START:
+            depth += 1
+        elif group == VARIATION_END:
+            depth -= 1
+        elif depth == 0:
+            if group == FULL_MOVE:
+                yield match.group(MOVE)
+            elif group == RESULT:
+                break
+
+
+def iter_moves(board, text, depth=None, parse=parseAny):
+    """ Yield the lmoves of the iter_mainline() moves of the game text, read
+        on board by parse, which is at the start position of the game. The
+        caller makes every move on board before asking for the next one. The
+        line ends at the first move that can't be read, or at ply depth.
+        Batch tools reading only SAN pass parseSAN, which is faster. """
+
+    for mstr in iter_mainline(text):
+        if depth is not None and board.plyCount >= depth:
+            return
+        try:
+            move = parse(board, mstr)
+        except ParsingError:
+            return
+        yield move
@@ -2,6 +2,7 @@
 
 import shutil
 import collections
+import mmap
 import os
 from io import StringIO
 from os.path import getmtime
@@ -18,14 +19,15 @@ from pychess.external.chess_db import Parser
 from pychess.Utils.const import WHITE, BLACK, reprResult, FEN_START, FEN_EMPTY, \
     WON_RESIGN, DRAW, BLACKWON, WHITEWON, NORMALCHESS, DRAW_AGREE, FIRST_PAGE, PREV_PAGE, NEXT_PAGE, \
     ABORTED_REASONS, ADJOURNED_REASONS, ADJUDICATION_REASONS, WON_ADJUDICATION, DEATH_REASONS, CALLFLAG_REASONS, \
-    RUNNING, TOOL_NONE, TOOL_CHESSDB, TOOL_SCOUTFISH
+    RUNNING, TOOL_NONE, TOOL_CHESSDB, TOOL_SCOUTFISH, CASTLE_KK
 from pychess.System import conf
 from pychess.System.Log import log
-from pychess.System.protoopen import PGN_ENCODING
+from pychess.System.compressed import is_compressed
+from pychess.System.protoopen import protoopen, PGN_ENCODING
 from pychess.System.prefix import getEngineDataPrefix
 from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Utils.GameModel import GameModel
-from pychess.Utils.lutils.lmove import toSAN, parseAny, ParsingError
+from pychess.Utils.lutils.lmove import toSAN, toAN, parseAny, parsePolyglot, ParsingError
 from pychess.Utils.Move import Move
 from pychess.Utils.elo import get_elo_rating_change_pgn
 from pychess.Utils.logic import getStatus
@@ -33,39 +35,22 @@ from pychess.Variants import name2variant, NormalBoard, variants
 from pychess.Utils import formatTime
 from pychess.Savers.ChessFile import ChessFile, LoadingError
 from pychess.Savers.database import col2label, TagDatabase, parseDateTag
+from pychess.Savers.movetext import pattern, COMMENT_REST, COMMENT_BRACE, COMMENT_NAG, \
+    VARIATION_START, VARIATION_END, RESULT, FULL_MOVE, MOVE, MOVE_COMMENT, iter_moves
 from pychess.System.cpu import get_cpu
 from pychess.Database import model as dbmodel
-from pychess.Database.PgnImport import TAG_REGEX, pgn2Const, PgnImport
-from pychess.Database.model import game, create_indexes, drop_indexes, metadata, ini_schema_version
+from pychess.Database.PgnImport import TAG_REGEX, pgn2Const, PgnImport, file_checksum, \
+    read_stream_parts, parse_variant
+from pychess.Database.PositionIndex import PositionIndex, OpeningTree, build_position_index, iter_game_spans
+from pychess.Database.EcoClassifier import store_eco
+from pychess.Database.model import game, create_indexes, drop_indexes, metadata, ini_schema_version, \
+    get_indexed_file, set_indexed_file
 
 __label__ = _("Chess Game")
 __ending__ = "pgn"
 __append__ = True
 
 
-# token categories
-COMMENT_REST, COMMENT_BRACE, COMMENT_NAG, \
-    VARIATION_START, VARIATION_END, \
-    RESULT, FULL_MOVE, MOVE, MOVE_COMMENT = range(1, 10)
-
-pattern = re.compile(r"""
-    (\;.*?[\n\r])        # comment, rest of line style
-    |(\{.*?\})           # comment, between {}
-    |(\$[0-9]+)          # comment, Numeric Annotation Glyph
-    |(\()                # variation start
-    |(\))                # variation end
-    |(\*|1-0|0-1|1/2)    # result (spec requires 1/2-1/2 for draw, but we want to tolerate simple 1/2 too)
-    |(
-    ([a-hKkQqRrBNnMmSsFHE][a-hxKQRBNMSFHE1-8+#=\-/]{1,6}
-    |[PNBRQMSFK]@[a-h][1-8][+#]?  # drop move
-    |o\-?o(?:\-?o)?      # castling notation using letter 'o' with or without '-'
-    |O\-?O(?:\-?O)?(?:/[HE][a-h][18]?)?      # castling notation using letter 'O' with or without '-'
-    |0\-0(?:\-0)?        # castling notation using zero with required '-'
-    |\-\-)               # non standard '--' is used for null move inside variations
-    ([\?!]{1,2})*
-    )    # move (full, count, move with ?!, ?!)
-    """, re.VERBOSE | re.DOTALL)
-
 move_eval_re = re.compile(r"\[%eval\s+([+\-])?(?:#)?(\d+)(?:[,\.](\d{1,2}))?(?:/(\d{1,2}))?\]")
 move_time_re = re.compile(r"\[%emt\s+(\d:)?(\d{1,2}:)?(\d{1,4})(?:\.(\d{1,3}))?\]")
 
@@ -387,6 +372,42 @@ parser = "parser_x%s%s%s" % (cpuinfo['bitness'], MODERN, cpuinfo['binext'])
 chess_db_path = shutil.which(parser, mode=os.X_OK, path=altpath)
 
 
+def replay_mainline(text, variant, fen):
+    """ Return the iter_moves() lmoves of the main line of the game text,
+        and the hashes of the start position and of the positions after
+        every move """
+
+    board = LBoard(variant)
+    board.applyFen(fen or FEN_START)
+    moves = []
+    hashes = [board.hash]
+    for move in iter_moves(board, text):
+        board.applyMove(move)
+        moves.append(move)
+        hashes.append(board.hash)
+    return moves, hashes
+
+
+def iter_mainlines(data, start=0, end=None, pgn_encoding=PGN_ENCODING, base_offset=0, line_end_fix=None,
+                   fields=None):
+    """ Yield the (tags, moves, hashes) of the games in the bytes
+        data[start:end] of a .pgn file, with the replay_mainline() moves and
+        hashes. The tags are the scan_games() ones, or only the given fields.
+        Games of unknown variants or with a bad FEN are skipped. """
+
+    for tags, text_start, text_end in iter_game_spans(data, start, end, pgn_encoding, base_offset, line_end_fix):
+        variant, fenstr = parse_variant(tags)
+        if variant is None:
+            continue
+        try:
+            moves, hashes = replay_mainline(data[text_start:text_end].decode("latin_1"), variant, fenstr)
+        except SyntaxError:
+            continue
+        if fields is not None:
+            tags = {field: tags[field] for field in fields}
+        yield tags, moves, hashes
+
+
 class PGNFile(ChessFile):
     def __init__(self, handle, progressbar=None):
         ChessFile.__init__(self, handle)
@@ -403,17 +424,24 @@ class PGNFile(ChessFile):
             self.is_desc = False
             self.reset_last_seen()
 
-            # filter expressions to .sqlite .bin .scout
+            # filter expressions to .sqlite .bin .scout .pos
             self.tag_query = None
             self.fen = None
             self.scout_query = None
 
             self.scoutfish = None
             self.chess_db = None
+            self.position_index = None
+            self.opening_tree = None
+
+            # (mtime, size) -> crc32 of the first size bytes of the .pgn file
+            self.checksums = {}
 
             self.sqlite_path = os.path.splitext(self.path)[0] + '.sqlite'
+            # Imports write through engine, the game list reads through
+            # the read only connections of the tag database
             self.engine = dbmodel.get_engine(self.sqlite_path)
-            self.tag_database = TagDatabase(self.engine)
+            self.tag_database = TagDatabase(dbmodel.get_read_engine(self.engine))
 
             self.games, self.offs_ply = self.get_records(0)
             log.info("%s contains %s game(s)" % (self.path, self.count), extra={"task": "SQL"})
@@ -433,21 +461,63 @@ class PGNFile(ChessFile):
 
     def close(self):
         self.tag_database.close()
+        if self.position_index is not None:
+            self.position_index.close()
+        if self.opening_tree is not None:
+            self.opening_tree.close()
         ChessFile.close(self)
 
+    def prefix_checksum(self, size):
+        """ crc32 of the first size bytes of the .pgn file """
+        key = (getmtime(self.path), size)
+        if key not in self.checksums:
+            self.checksums[key] = file_checksum(self.path, size)
+        return self.checksums[key]
+
+    def get_indexed_size(self, name):
+        """ Size of the .pgn file when the name index was made, if games were
+            only appended to it since, else 0 """
+        if is_compressed(self.path):
+            return 0
+        indexed = get_indexed_file(self.engine, name)
+        if indexed is None:
+            return 0
+        size, checksum = indexed
+        if size > self.size or self.prefix_checksum(size) != checksum:
+            return 0
+        return size
+
+    def set_indexed_size(self, name, start=0):
+        """ Store the size and checksum of the .pgn file the name index is made
+            from now, where start is the size it had when indexed before """
+        if is_compressed(self.path):
+            return
+        size = self.size
+        mtime = getmtime(self.path)
+        indexed = get_indexed_file(self.engine, name)
+        if start > 0 and indexed is not None and indexed[0] == start:
+            # Only the appended games need to be read
+            self.checksums[(mtime, start)] = indexed[1]
+            self.checksums[(mtime, size)] = file_checksum(self.path, size, start, indexed[1])
+        set_indexed_file(self.engine, name, size, self.prefix_checksum(size))
+
     def init_tag_database(self, importer=None):
         """ Create/open .sqlite database of game header tags """
         # Import .pgn header tags to .sqlite database
 
-        sqlite_path = self.path.replace(".pgn", ".sqlite")
-        if os.path.isfile(self.path) and os.path.isfile(sqlite_path) and getmtime(self.path) > getmtime(sqlite_path):
-            metadata.drop_all(self.engine)
-            metadata.create_all(self.engine)
-            ini_schema_version(self.engine)
+        start = 0
+        if os.path.isfile(self.path) and os.path.isfile(self.sqlite_path) and \
+                getmtime(self.path) > getmtime(self.sqlite_path):
+            # When games were only appended, import just them
+            start = self.get_indexed_size(".sqlite")
+            if start == 0:
+                metadata.drop_all(self.engine)
+                metadata.create_all(self.engine)
+                ini_schema_version(self.engine)
 
         size = self.size
-        if size > 0 and self.tag_database.count == 0:
-            if size > 10000000:
+        if size > start and (start > 0 or self.tag_database.count == 0):
+            if size - start > 10000000:
                 drop_indexes(self.engine)
             if self.progressbar is not None:
                 from gi.repository import GLib
@@ -455,17 +525,31 @@ class PGNFile(ChessFile):
             if importer is None:
                 importer = PgnImport(self)
             importer.initialize()
-            importer.do_import(self.path, progressbar=self.progressbar)
-            if size > 10000000 and not importer.cancel:
+            importer.do_import(self.path, progressbar=self.progressbar, start=start)
+            if size - start > 10000000 and not importer.cancel:
                 create_indexes(self.engine)
+            if not importer.cancel:
+                self.classify_openings(start)
+                self.set_indexed_size(".sqlite", start)
+        elif start > 0:
+            self.set_indexed_size(".sqlite", start)
 
         return importer
 
+    def classify_openings(self, start=0):
+        """ Store in the .sqlite database the ECO codes of the games without
+            an ECO tag, from byte start of the .pgn file on """
+        if self.progressbar is not None:
+            from gi.repository import GLib
+            GLib.idle_add(self.progressbar.set_text, _("Classifying openings..."))
+        store_eco(self.engine, self.path, start)
+
     def init_chess_db(self):
         """ Create/open polyglot .bin file with extra win/loss/draw stats
             using chess_db parser from https://github.com/mcostalba/chess_db
         """
-        if chess_db_path is not None and self.path and self.size > 0:
+        # It can't read compressed files
+        if chess_db_path is not None and self.path and self.size > 0 and not is_compressed(self.path):
             try:
                 if self.progressbar is not None:
                     from gi.repository import GLib
@@ -492,7 +576,8 @@ class PGNFile(ChessFile):
         """ Create/open .scout database index file to help querying
             using scoutfish from https://github.com/mcostalba/scoutfish
         """
-        if scoutfish_path is not None and self.path and self.size > 0:
+        # It can't read compressed files
+        if scoutfish_path is not None and self.path and self.size > 0 and not is_compressed(self.path):
             try:
                 if self.progressbar is not None:
                     from gi.repository import GLib
@@ -512,18 +597,64 @@ class PGNFile(ChessFile):
                 self.scoutfish = None
                 log.warning("scoutfish failed (pexpect.EOF)")
 
+    def init_position_index(self):
+        """ Create/open .pos index file of the positions in the games and
+            .tree opening tree file of the moves played in them, to query
+            positions without external tools.
+            When games were only appended to the .pgn file since they were
+            made, just the new games are added to them.
+        """
+        if self.path and self.size > 0:
+            if self.position_index is not None:
+                self.position_index.close()
+                self.position_index = None
+            if self.opening_tree is not None:
+                self.opening_tree.close()
+                self.opening_tree = None
+            base = os.path.splitext(self.path)[0]
+            pos_path = base + '.pos'
+            tree_path = base + '.tree'
+            try:
+                if not os.path.isfile(pos_path) or not os.path.isfile(tree_path) or \
+                        getmtime(self.path) > min(getmtime(pos_path), getmtime(tree_path)):
+                    start = 0
+                    if os.path.isfile(pos_path) and os.path.isfile(tree_path):
+                        start = self.get_indexed_size(".pos")
+                    if start < self.size:
+                        if self.progressbar is not None:
+                            from gi.repository import GLib
+                            GLib.idle_add(self.progressbar.set_text, _("Creating .pos index file..."))
+                        build_position_index(self.path, pos_path, tree_path, start)
+                    else:
+                        os.utime(pos_path)
+                        os.utime(tree_path)
+                    self.set_indexed_size(".pos", start)
+                self.position_index = PositionIndex(pos_path)
+                self.opening_tree = OpeningTree(tree_path)
+            except OSError as err:
+                log.warning("Failed to create position index. OSError %s %s" % (err.errno, err.strerror))
+
     def get_book_moves(self, fen):
-        """ Get move-games-win-loss-draw stat of fen position """
+        """ Get move-games-win-loss-draw-elo stat of fen position """
         rows = []
-        if self.chess_db is not None:
+        if self.opening_tree is not None:
+            board = LBoard(NORMALCHESS)
+            board.applyFen(fen)
+            for move, games, white_wins, draws, black_wins, elo in self.opening_tree.get_moves(board.hash):
+                lmove = parsePolyglot(board, move)
+                rows.append((toAN(board, lmove, castleNotation=CASTLE_KK), games, white_wins, black_wins, draws, elo))
+        elif self.chess_db is not None:
             move_stat = self.chess_db.find("limit %s skip %s %s" % (1, 0, fen))
             for mstat in move_stat["moves"]:
-                rows.append((mstat["move"], int(mstat["games"]), int(mstat["wins"]), int(mstat["losses"]), int(mstat["draws"])))
+                rows.append((mstat["move"], int(mstat["games"]), int(mstat["wins"]), int(mstat["losses"]), int(mstat["draws"]), 0))
         return rows
 
     def has_position(self, fen):
-        # ChessDB (prioritary)
-        if self.chess_db is not None:
+        # Position index and ChessDB (prioritary) both find exact positions
+        if self.position_index is not None:
+            if self.position_index.has_position(fen_hash(fen)):
+                return TOOL_CHESSDB, True
+        elif self.chess_db is not None:
             ret = self.chess_db.find("limit %s skip %s %s" % (1, 0, fen))
             if len(ret["moves"]) > 0:
                 return TOOL_CHESSDB, True
@@ -556,8 +687,9 @@ class PGNFile(ChessFile):
         self.tag_database.build_where_tags(self.tag_query)
 
     def set_fen_filter(self, fen):
-        """ Set fen string we will use to get game offsets from .bin database """
-        if self.chess_db is not None and fen is not None and fen != FEN_START:
+        """ Set fen string we will use to get game offsets from .pos or .bin database """
+        if (self.position_index is not None or self.chess_db is not None) and \
+                fen is not None and fen != FEN_START:
             self.fen = fen
         else:
             self.fen = None
@@ -615,10 +747,33 @@ class PGNFile(ChessFile):
                 self.tag_database.build_where_offs(offsets)
 
     def get_offs8(self, skip, filtered_offs_list=None):
-        """ Get offsets from .bin database and
+        """ Get offsets from .pos or .bin database and
             create where clause we will use to query header tag .sqlite database
         """
-        if self.fen:
+        if self.fen and self.position_index is not None:
+            if filtered_offs_list is not None:
+                filtered_offs_list = set(filtered_offs_list)
+
+            offsets = []
+            if filtered_offs_list is None:
+                # Every game has one posting of the position, so the page
+                # starts skip postings after the first one
+                games = self.position_index.iter_games(fen_hash(self.fen), skip)
+                skip = 0
+            else:
+                games = self.position_index.iter_games(fen_hash(self.fen))
+            for offs, ply in games:
+                if filtered_offs_list is None or offs in filtered_offs_list:
+                    if skip > 0:
+                        skip -= 1
+                        continue
+                    offsets.append((offs >> 3) << 3)
+                    self.offs_ply[offs] = ply
+                    if len(offsets) == self.limit:
+                        break
+            self.tag_database.build_where_offs8(offsets)
+
+        elif self.fen:
             move_stat = self.chess_db.find("limit %s skip %s %s" % (self.limit, skip, self.fen))
 
             offsets = []
@@ -708,8 +863,10 @@ class PGNFile(ChessFile):
             model.tags[tag] = rec[tag]
 
         # Load other tags
-        for tag in ('WhiteElo', 'BlackElo', 'ECO', 'TimeControl', 'Annotator'):
+        for tag in ('ECO', 'TimeControl', 'Annotator'):
             model.tags[tag] = rec[tag]
+        for tag in ('WhiteElo', 'BlackElo'):
+            model.tags[tag] = str(rec[tag]) if rec[tag] else ""
 
         if self.pgn_is_string:
             for tag in rec:
@@ -927,91 +1084,77 @@ class PGNFile(ChessFile):
 
         return model
 
-    def parse_movetext(self, string, board, position, variation=False):
-        """Recursive parses a movelist part of one game.
+    def parse_movetext(self, string, board, position):
+        """Parses a movelist part of one game in a single pass. The lines of
+           the enclosing variations are kept on a stack, so nested variations
+           are not scanned again.
 
            Arguments:
-           srting - str (movelist)
+           string - str (movelist)
            board - lboard (initial position)
            position - int (maximum ply to parse)
-           variation- boolean (True if the string is a variation)"""
 
-        boards = []
-        boards_append = boards.append
+           Returns the boards of the main line. The boards of a variation are
+           put in the children of the board its alternative move is made in,
+           after an extra first board holding the comments before its first
+           move."""
 
+        # (boards, initial board, last board, board the variation is a child
+        # of) of the enclosing lines
+        stack = []
+        boards = [board]
         last_board = board
-        if variation:
-            # this board used only to hold initial variation comments
-            boards_append(LBoard(board.variant))
-        else:
-            # initial game board
-            boards_append(board)
-
-        # status = None
-        parenthesis = 0
-        v_string = ""
-        v_last_board = None
-        for m in re.finditer(pattern, string):
-            group, text = m.lastindex, m.group(m.lastindex)
-            if parenthesis > 0:
-                v_string += ' ' + text
-
-            if group == VARIATION_END:
-                parenthesis -= 1
-                if parenthesis == 0:
-                    if last_board.prev is None:
-                        errstr1 = _("Error parsing %(mstr)s") % {"mstr": string}
-                        self.error = LoadingError(errstr1, "")
-                        return boards  # , status
-
-                    v_last_board.children.append(
-                        self.parse_movetext(v_string[:-1], last_board.prev, position, variation=True))
-                    v_string = ""
-                    continue
+        parent = None
+        # Nested parentheses to skip, of variations not parsed
+        skip = 0
+
+        for m in pattern.finditer(string):
+            group = m.lastindex
+
+            if skip > 0:
+                if group == VARIATION_START:
+                    skip += 1
+                elif group == VARIATION_END:
+                    skip -= 1
+                continue
 
-            elif group == VARIATION_START:
-                parenthesis += 1
-                if parenthesis == 1:
-                    v_last_board = last_board
-
-            if parenthesis == 0:
-                if group == FULL_MOVE:
-                    if not variation:
-                        if position != -1 and last_board.plyCount >= position:
-                            break
-
-                    mstr = m.group(MOVE)
-                    try:
-                        lmove = parseAny(last_board, mstr)
-                    except ParsingError as err:
-                        # TODO: save the rest as comment
-                        # last_board.children.append(string[m.start():])
-                        notation, reason, boardfen = err.args
-                        ply = last_board.plyCount
-                        if ply % 2 == 0:
-                            moveno = "%d." % (ply // 2 + 1)
-                        else:
-                            moveno = "%d..." % (ply // 2 + 1)
-                        errstr1 = _(
-                            "The game can't be read to end, because of an error parsing move %(moveno)s '%(notation)s'.") % {
-                                'moveno': moveno,
-                                'notation': notation}
-                        errstr2 = _("The move failed because %s.") % reason
-                        self.error = LoadingError(errstr1, errstr2)
-                        break
-                    except Exception:
-                        ply = last_board.plyCount
-                        if ply % 2 == 0:
-                            moveno = "%d." % (ply // 2 + 1)
-                        else:
-                            moveno = "%d..." % (ply // 2 + 1)
-                        errstr1 = _(
-                            "Error parsing move %(moveno)s %(mstr)s") % {
-                                "moveno": moveno,
-                                "mstr": mstr}
-                        self.error = LoadingError(errstr1, "")
+            if group == FULL_MOVE:
+                if not stack:
+                    if position != -1 and last_board.plyCount >= position:
                         break
 
+                mstr = m.group(MOVE)
+                try:
+                    lmove = parseAny(last_board, mstr)
+                except ParsingError as err:
+                    # TODO: save the rest as comment
+                    # last_board.children.append(string[m.start():])
+                    notation, reason, boardfen = err.args
+                    ply = last_board.plyCount
+                    if ply % 2 == 0:
+                        moveno = "%d." % (ply // 2 + 1)
+                    else:
+                        moveno = "%d..." % (ply // 2 + 1)
+                    errstr1 = _(
+                        "The game can't be read to end, because of an error parsing move %(moveno)s '%(notation)s'.") % {
+                            'moveno': moveno,
+                            'notation': notation}
+                    errstr2 = _("The move failed because %s.") % reason
+                    self.error = LoadingError(errstr1, errstr2)
+                    group = RESULT
+                except Exception:
+                    ply = last_board.plyCount
+                    if ply % 2 == 0:
+                        moveno = "%d." % (ply // 2 + 1)
+                    else:
+                        moveno = "%d..." % (ply // 2 + 1)
+                    errstr1 = _(
+                        "Error parsing move %(moveno)s %(mstr)s") % {
+                            "moveno": moveno,
+                            "mstr": mstr}
+                    self.error = LoadingError(errstr1, "")
+                    group = RESULT
+                else:
                     new_board = last_board.clone()
                     new_board.applyMove(lmove)
 
@@ -1022,46 +1165,93 @@ class PGNFile(ChessFile):
                     new_board.prev = last_board
 
                     # set last_board next, except starting a new variation
-                    if variation and last_board == board:
+                    if stack and last_board is board:
                         boards[0].next = new_board
                     else:
                         last_board.next = new_board
 
-                    boards_append(new_board)
+                    boards.append(new_board)
                     last_board = new_board
+                    continue
 
-                elif group == COMMENT_REST:
-                    last_board.children.append(text[1:])
-
-                elif group == COMMENT_BRACE:
-                    comm = text.replace('{\r\n', '{').replace('\r\n}', '}')
-                    # Preserve new lines of lichess study comments
-                    if self.path is not None and "lichess_study_" in self.path:
-                        comment = comm[1:-1]
-                    else:
-                        comm = comm[1:-1].splitlines()
-                        comment = ' '.join([line.strip() for line in comm])
-                    if variation and last_board == board:
-                        # initial variation comment
-                        boards[0].children.append(comment)
-                    else:
-                        last_board.children.append(comment)
+            elif group == VARIATION_START:
+                if last_board.prev is None:
+                    errstr1 = _("Error parsing %(mstr)s") % {"mstr": string}
+                    self.error = LoadingError(errstr1, "")
+                    # Skip the variation and the rest of the current line
+                    skip = 1
+                    group = RESULT
+                else:
+                    stack.append((boards, board, last_board, parent))
+                    parent = last_board
+                    board = last_board.prev
+                    # this board used only to hold initial variation comments
+                    boards = [LBoard(board.variant)]
+                    last_board = board
+                    continue
 
-                elif group == COMMENT_NAG:
-                    last_board.nags.append(text)
+            elif group == VARIATION_END:
+                if stack:
+                    parent.children.append(boards)
+                    boards, board, last_board, parent = stack.pop()
+                continue
 
-                # TODO
-                elif group == RESULT:
-                    # if text == "1/2":
-                    #    status = reprResult.index("1/2-1/2")
-                    # else:
-                    #    status = reprResult.index(text)
-                    break
+            elif group == COMMENT_REST:
+                last_board.children.append(m.group(group)[1:])
+                continue
 
+            elif group == COMMENT_BRACE:
+                comm = m.group(group).replace('{\r\n', '{').replace('\r\n}', '}')
+                # Preserve new lines of lichess study comments
+                if self.path is not None and "lichess_study_" in self.path:
+                    comment = comm[1:-1]
+                else:
+                    comm = comm[1:-1].splitlines()
+                    comment = ' '.join([line.strip() for line in comm])
+                if stack and last_board is board:
+                    # initial variation comment
+                    boards[0].children.append(comment)
                 else:
-                    print("Unknown:", text)
+                    last_board.children.append(comment)
+                continue
+
+            elif group == COMMENT_NAG:
+                last_board.nags.append(m.group(group))
+                continue
+
+            # The result, or an error, ends the current line
+            if not stack:
+                break
+            parent.children.append(boards)
+            boards, board, last_board, parent = stack.pop()
+            skip += 1
 
-        return boards  # , status
+        # Lines of unclosed variations are dropped
+        if stack:
+            boards = stack[0][0]
+        return boards
+
+    def iter_games(self, fields=None):
+        """ Yield the iter_mainlines() (tags, moves, hashes) of all the games
+            of the file in file order. The file is read sequentially, without
+            the tag database and game models, for batch tools. """
+
+        if self.pgn_is_string:
+            yield from iter_mainlines(self.handle.getvalue().encode("utf-8"), pgn_encoding="utf-8", fields=fields)
+        elif is_compressed(self.path):
+            handle = protoopen(self.path)
+            try:
+                for data, end, base_offset, line_end_fix in read_stream_parts(handle.buffer):
+                    yield from iter_mainlines(data, 0, end, handle.pgn_encoding, base_offset, line_end_fix, fields)
+            finally:
+                handle.close()
+        elif os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    yield from iter_mainlines(data, pgn_encoding=self.handle.pgn_encoding, fields=fields)
+                finally:
+                    data.close()
 
     def get_movetext(self, rec):
         self.handle.seek(rec["Offset"])
@@ -1163,6 +1353,12 @@ for k, v in nag2symbolDict.items():
         symbol2nagDict[v] = k
 
 
+def fen_hash(fen):
+    board = LBoard(NORMALCHESS)
+    board.applyFen(fen)
+    return board.hash
+
+
 def nag2symbol(nag):
     return nag2symbolDict.get(nag, nag)
 
@@ -0,0 +1,198 @@
+""" Seekable reading of compressed files, so that big .pgn archives can be
+    used without decompressing them to disk """
+
+import bisect
+import bz2
+import collections
+import io
+import lzma
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from pychess.System.Log import log
+
+
+def new_zstd_decompressor():
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+# extension: (magic bytes of a stream, function making a stream decompressor)
+DECOMPRESSORS = {
+    ".gz": (b"\x1f\x8b", lambda: zlib.decompressobj(wbits=31)),
+    ".bz2": (b"BZh", bz2.BZ2Decompressor),
+    ".xz": (b"\xfd7zXZ\x00", lzma.LZMADecompressor),
+    ".zst": (b"\x28\xb5\x2f\xfd", new_zstd_decompressor if zstandard is not None else None),
+}
+
+# Compressed bytes decompressed at once
+INPUT_BLOCK = 64 * 1024
+
+# Decompressed bytes between the restart points made by copying the
+# decompressor state. Every point costs about 40 kB of memory.
+CHECKPOINT = 8 * 1024 * 1024
+
+# Files whose restart points are kept
+MAX_INDEXES = 8
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in DECOMPRESSORS
+
+
+class DecompressedFile(io.RawIOBase):
+    """ Read only binary file of the decompressed contents of the file at path.
+
+        Seeking goes back to the last restart point before the new position,
+        and decompresses forward from there. There are restart points at the
+        start of every stream in the file (gzip members, bzip2 and xz streams,
+        zstd frames), and for gzip files every CHECKPOINT bytes, where the
+        decompressor state is copied. bzip2, xz and zstd decompressors can't
+        be copied, and their streams can't be entered in the middle, so
+        seeking back in a single stream file of those, like the single frame
+        .zst dumps of lichess, starts over from the beginning. Such files are
+        only cheap to read in order, and a warning is logged the first time
+        it happens for a file.
+
+        The points are found while reading, and are shared by all files opened
+        on the same path, so reading a whole file once, like importing its
+        game headers does, makes later seeks in it cheap. The points of the
+        last MAX_INDEXES files opened are kept. """
+
+    # path -> [(mtime, size), restart positions, restart points, warned]
+    indexes = collections.OrderedDict()
+    indexes_lock = threading.Lock()
+
+    def __init__(self, path):
+        io.RawIOBase.__init__(self)
+        self.magic, self.new_decompressor = DECOMPRESSORS[os.path.splitext(path)[1].lower()]
+        if self.new_decompressor is None:
+            raise IOError("Reading %s needs the zstandard module" % path)
+        self.copyable = hasattr(self.new_decompressor(), "copy")
+
+        self.name = path
+        self.file = open(path, "rb")
+
+        stat = os.fstat(self.file.fileno())
+        key = (stat.st_mtime, stat.st_size)
+        indexes = DecompressedFile.indexes
+        with DecompressedFile.indexes_lock:
+            index = indexes.get(path)
+            if index is None or index[0] != key:
+                # A point is (decompressed position, compressed position,
+                # decompressor state or None at the start of a stream)
+                index = [key, [0], [(0, 0, None)], False]
+                indexes[path] = index
+                while len(indexes) > MAX_INDEXES:
+                    indexes.popitem(last=False)
+            else:
+                indexes.move_to_end(path)
+        self.index = index
+        self.starts, self.points = index[1], index[2]
+
+        self.restart(self.points[0])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        io.RawIOBase.close(self)
+
+    def restart(self, point):
+        self.pos, self.cpos, state = point
+        self.decompressor = None if state is None else state.copy()
+        self.pending = b""
+        self.pending_pos = 0
+
+    def add_point(self, pos, state):
+        # Points are found in file order, past the last known one
+        if pos > self.starts[-1]:
+            self.starts.append(pos)
+            self.points.append((pos, self.cpos, state))
+
+    def decompress(self):
+        """ Replace the pending bytes with the next decompressed ones, and
+            return False at the end of the file """
+
+        if self.decompressor is None:
+            self.file.seek(self.cpos)
+            if self.file.read(len(self.magic)) != self.magic:
+                # Whatever follows the last stream, gzip pads with zeros
+                if self.cpos == 0:
+                    raise IOError("%s is not a compressed file" % self.name)
+                return False
+            self.decompressor = self.new_decompressor()
+            self.add_point(self.pos, None)
+
+        self.file.seek(self.cpos)
+        data = self.file.read(INPUT_BLOCK)
+        if not data:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        self.pending = self.decompressor.decompress(data)
+        self.pending_pos = 0
+        self.cpos += len(data)
+
+        unused_data = self.decompressor.unused_data
+        if getattr(self.decompressor, "eof", bool(unused_data)):
+            self.cpos -= len(unused_data)
+            self.decompressor = None
+        elif self.copyable and self.pos + len(self.pending) - self.starts[-1] >= CHECKPOINT:
+            self.add_point(self.pos + len(self.pending), self.decompressor.copy())
+        return True
+
+    def readinto(self, b):
+        while self.pending_pos >= len(self.pending):
+            if not self.decompress():
+                return 0
+        size = min(len(b), len(self.pending) - self.pending_pos)
+        b[:size] = self.pending[self.pending_pos:self.pending_pos + size]
+        self.pending_pos += size
+        self.pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            self.skip(-1)
+            offset += self.pos
+        elif whence != io.SEEK_SET:
+            raise ValueError("Invalid whence (%s)" % whence)
+        if offset < 0:
+            raise ValueError("Negative seek position %s" % offset)
+
+        point = self.points[bisect.bisect_right(self.starts, offset) - 1]
+        if offset < self.pos or point[0] > self.pos + len(self.pending) - self.pending_pos:
+            if point[0] == 0 and offset > 0 and not self.copyable and not self.index[3]:
+                self.index[3] = True
+                log.warning("Seeking back in %s decompresses it from the start, it is only fast to read in order" %
+                            self.name)
+            self.restart(point)
+        self.skip(offset - self.pos)
+        return self.pos
+
+    def skip(self, size):
+        """ Move size bytes forward, or to the end with a negative size """
+
+        while size != 0:
+            if self.pending_pos >= len(self.pending) and not self.decompress():
+                break
+            step = len(self.pending) - self.pending_pos
+            if size > 0:
+                step = min(step, size)
+                size -= step
+            self.pending_pos += step
+            self.pos += step
+
+    def tell(self):
+        return self.pos
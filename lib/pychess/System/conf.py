@@ -127,6 +127,8 @@ DEFAULTS = {
         "opening_check": False,
         "opening_file_entry": default_book_path,
         "book_depth_max": 13,
+        "book_min_games": 1,
+        "book_min_score": 0,
         "book_exact_match": True,
         "endgame_check": False,
         "egtb_path": os.path.join(getDataPrefix()),
@@ -210,6 +212,10 @@ DEFAULTS = {
         "challenge1Radio": 0,
         "challenge2Radio": 0,
         "challenge3Radio": 0,
+        # SQLite page cache of a .sqlite database connection in KiB, and the
+        # bytes of it read through a memory map
+        "sqlite_cache_size": 65536,
+        "sqlite_mmap_size": 268435456,
     },
     "FICS": {
         "timesealCheck": True,
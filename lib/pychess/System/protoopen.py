@@ -1,8 +1,11 @@
+import io
 import os
 import sys
 from urllib.request import urlopen
 from urllib.parse import unquote
 
+from pychess.System.compressed import DecompressedFile, is_compressed
+
 
 PGN_ENCODING = "latin_1"
 
@@ -24,8 +27,10 @@ def protoopen(uri, encoding=PGN_ENCODING):
         uri = splitted[1]
 
     try:
+        if is_compressed(uri):
+            return textopen(io.BufferedReader(DecompressedFile(unquote(uri))), uri, encoding)
         handle = open(unquote(uri), "r", encoding=encoding, newline="")
-        handle.pgn_encoding = "utf-8" if os.path.basename(uri).startswith("lichess_") else encoding
+        handle.pgn_encoding = get_pgn_encoding(uri, encoding)
         return handle
     except (IOError, OSError):
         pass
@@ -38,6 +43,19 @@ def protoopen(uri, encoding=PGN_ENCODING):
     raise IOError("Protocol isn't supported by pychess")
 
 
+def get_pgn_encoding(name, encoding=PGN_ENCODING):
+    """ Encoding of the game texts in the file name, lichess exports are utf-8 """
+    return "utf-8" if os.path.basename(name).startswith("lichess_") else encoding
+
+
+def textopen(binary, name, encoding=PGN_ENCODING):
+    """ Text handle like protoopen() gives, of the binary file object of the
+        file name """
+    handle = io.TextIOWrapper(binary, encoding=encoding, newline="")
+    handle.pgn_encoding = get_pgn_encoding(name, encoding)
+    return handle
+
+
 def protosave(uri, append=False):
     """ Function for saving many things """
 
@@ -60,6 +78,10 @@ def isWriteable(uri):
 
     splitted = splitUri(uri)
 
+    # Compressed files are only read
+    if is_compressed(splitted[-1]):
+        return False
+
     if splitted[0] == "file":
         return os.access(splitted[1], os.W_OK)
     elif len(splitted) == 1:
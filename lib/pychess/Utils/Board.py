@@ -25,6 +25,8 @@ class Board:
         Caveat: As the only objects, the Piece objects in the self.data lists
         will not be cloned, to make animation state preserve between moves """
 
+    __slots__ = ("data", "board", "played")
+
     variant = NORMALCHESS
     RANKS = 8
     FILES = 8
@@ -469,15 +471,15 @@ class Board:
 
         if self.variant != NORMALCHESS:
             from pychess.Variants import variants
-            newBoard = variants[self.variant]()
+            cls = variants[self.variant]
         else:
-            newBoard = Board()
+            cls = Board
+        # __init__ would only make an LBoard and rows we throw away
+        newBoard = cls.__new__(cls)
         newBoard.board = lboard
         newBoard.board.pieceBoard = newBoard
-
-        for y, row in enumerate(self.data):
-            for x, piece in row.items():
-                newBoard.data[y][x] = piece
+        newBoard.played = False
+        newBoard.data = [row.copy() for row in self.data]
 
         return newBoard
 
@@ -16,7 +16,7 @@ from pychess.System.protoopen import protoopen, protosave
 from pychess.System.Log import log
 from pychess.Utils.book import getOpenings
 from pychess.Utils.Move import Move
-from pychess.Utils.eco import get_eco
+from pychess.Utils.eco import get_eco, classify
 from pychess.Utils.Offer import Offer
 from pychess.Utils.TimeModel import TimeModel
 from pychess.Savers import html, txt
@@ -359,13 +359,12 @@ class GameModel(GObject.GObject):
         if ply is None:
             ply = self.ply
 
-        opening = None
-        while ply >= self.lowply:
+        if redetermine:
+            opening = classify(self.getBoardAtPly(p).board.hash for p in range(self.lowply, ply + 1))
+        elif ply >= self.lowply:
             opening = get_eco(self.getBoardAtPly(ply).board.hash, exactPosition=True)
-            if opening is None and redetermine:
-                ply = ply - 1
-            else:
-                break
+        else:
+            opening = None
 
         if opening is not None:
             self.tags["ECO"] = opening[0]
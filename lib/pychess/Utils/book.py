@@ -1,7 +1,9 @@
 
+import collections
+import mmap
 import os
+import threading
 from struct import Struct
-from collections import namedtuple
 
 from pychess.System import conf
 from pychess.Utils.lutils.lmove import parsePolyglot
@@ -9,66 +11,165 @@ from pychess.System.Log import log
 
 path = conf.get("opening_file_entry")
 
-if os.path.isfile(path):
-    bookfile = True
-else:
-    bookfile = False
-    log.warning("Could not find %s" % path)
-
 # The book probing code is based on that of PolyGlot by Fabien Letouzey.
 # PolyGlot is available under the GNU GPL from http://wbec-ridderkerk.nl
 
-BookEntry = namedtuple('BookEntry', 'key move weight learn')
-# 'key' c_uint64      the position's hash
-# 'move' c_uint16     the candidate move
-# 'weight' c_uint16   proportional to prob. we should play it
+# An entry is
+# key c_uint64      the position's hash
+# move c_uint16     the candidate move
+# weight c_uint16   proportional to prob. we should play it
 # The following terms are not always available:
-# 'learn' c_uint32    we use this NOT the polyglot way but as in
-#                     https://github.com/mcostalba/chess_db
+# learn c_uint32    we use this NOT the polyglot way but as in
+#                   https://github.com/mcostalba/chess_db
 
 entrystruct = Struct(">QHHI")
 entrysize = entrystruct.size
+keystruct = Struct(">Q")
 
+# Positions whose entries are kept by OpeningBooks
+CACHE_SIZE = 256
 
-def getOpenings(board):
-    """ Return a tuple (move, weight, learn) for each opening move
-        in the given position. The weight is proportional to the probability
-        that a move should be played. By convention, games is the number of
-        times a move has been tried, and score the number of points it has
-        scored (with 2 per victory and 1 per draw). However, opening books
-        aren't required to keep this information. """
 
-    openings = []
-    if not bookfile:
-        return openings
+class PolyglotBook:
+    """ Polyglot book file, mapped in memory once """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        # To find out when the file is replaced or changed
+        self.stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.count = stat.st_size // entrysize
+        if self.count > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.count > 0:
+            self.data.close()
+        self.file.close()
 
-    with open(path, "rb") as bookFile:
-        key = board.hash
+    def get_entries(self, key):
+        """ Return the (move, weight, learn) of the entries of the position
+            with hash key """
+
+        data = self.data if self.count > 0 else None
+        key_from = keystruct.unpack_from
         # Find the first entry whose key is >= the position's hash
-        bookFile.seek(0, os.SEEK_END)
-        low, high = 0, bookFile.tell() // 16 - 1
-        if high < 0:
-            return openings
+        low, high = 0, self.count
         while low < high:
             mid = (low + high) // 2
-            bookFile.seek(mid * 16)
-            entry = bookFile.read(entrysize)
-            if len(entry) != entrysize:
-                return openings
-            entry = BookEntry._make(entrystruct.unpack(entry))
-            if entry.key < key:
+            if key_from(data, mid * entrysize)[0] < key:
                 low = mid + 1
             else:
                 high = mid
 
-        bookFile.seek(low * 16)
-        while True:
-            entry = bookFile.read(entrysize)
-            if len(entry) != entrysize:
-                return openings
-            entry = BookEntry._make(entrystruct.unpack(entry))
-            if entry.key != key:
+        entries = []
+        unpack_from = entrystruct.unpack_from
+        for i in range(low, self.count):
+            entry_key, move, weight, learn = unpack_from(data, i * entrysize)
+            if entry_key != key:
                 break
-            move = parsePolyglot(board, entry.move)
-            openings.append((move, entry.weight, entry.learn))
-    return openings
+            entries.append((move, weight, learn))
+        return entries
+
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class OpeningBooks:
+    """ Several polyglot books probed as one. The weights of a move in the
+        books are added up. The books are opened again when their files
+        change, and the entries of the last CACHE_SIZE probed positions are
+        kept. """
+
+    def __init__(self, paths, cache_size=CACHE_SIZE):
+        self.paths = list(paths)
+        self.books = [None] * len(self.paths)
+        # Whether the books were looked for yet
+        self.updated = False
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            for book in self.books:
+                if book is not None:
+                    book.close()
+            self.books = [None] * len(self.paths)
+            self.cache.clear()
+
+    def update(self):
+        """ Open the books whose files were created or changed since the
+            last probe """
+
+        for i, path in enumerate(self.paths):
+            stamp = file_stamp(path)
+            book = self.books[i]
+            if stamp is None and (book is not None or not self.updated):
+                log.warning("Could not find %s" % path)
+            if stamp != (book.stamp if book is not None else None):
+                if book is not None:
+                    book.close()
+                try:
+                    self.books[i] = PolyglotBook(path) if stamp is not None else None
+                except OSError as err:
+                    log.warning("Could not open %s: %s" % (path, err))
+                    self.books[i] = None
+                self.cache.clear()
+        self.updated = True
+
+    def get_entries(self, key):
+        """ Return the (move, weight, learn) of the moves of the position with
+            hash key in the books. The learn value is the one of the first
+            book with the move. """
+
+        with self.lock:
+            self.update()
+            entries = self.cache.get(key)
+            if entries is not None:
+                self.cache.move_to_end(key)
+                return entries
+
+            books = [book for book in self.books if book is not None]
+            if len(books) == 1:
+                entries = books[0].get_entries(key)
+            else:
+                merged = collections.OrderedDict()
+                for book in books:
+                    for move, weight, learn in book.get_entries(key):
+                        if move in merged:
+                            merged[move][1] += weight
+                        else:
+                            merged[move] = [move, weight, learn]
+                entries = [tuple(entry) for entry in merged.values()]
+
+            self.cache[key] = entries
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return entries
+
+
+# The books of getOpenings(), made again when path is changed
+books = None
+
+
+def getOpenings(board):
+    """ Return a tuple (move, weight, learn) for each opening move
+        in the given position. The weight is proportional to the probability
+        that a move should be played. By convention, games is the number of
+        times a move has been tried, and score the number of points it has
+        scored (with 2 per victory and 1 per draw). However, opening books
+        aren't required to keep this information. """
+
+    global books
+    if books is None or books.paths != [path]:
+        if books is not None:
+            books.close()
+        books = OpeningBooks([path])
+
+    return [(parsePolyglot(board, move), weight, learn) for move, weight, learn in books.get_entries(board.hash)]
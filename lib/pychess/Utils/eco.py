@@ -36,23 +36,70 @@ else:
     lang = mofile.split(os.sep)[-3]
 
 
+# The openings of the languages by position hash, read from eco.db the
+# first time a language is looked up:
+# {lang: {hash: (eco, opening, variation, endline)}}
+openings = {}
+
+
+def get_openings(qlang):
+    table = openings.get(qlang)
+    if table is None:
+        table = {}
+        if ECO_OK:
+            cur = conn.cursor()
+            # The Chess960 start positions have no hash
+            cur.execute("select hash, eco, opening, variation, endline from openings where lang=? and hash is not null",
+                        (qlang, ))
+            for qh, eco, opening, variation, endline in cur:
+                table.setdefault(int(qh, 16), (eco, opening, variation, int(endline)))
+        openings[qlang] = table
+    return table
+
+
+def get_lang():
+    """ The language of the openings, the main one when there are none in
+        the language of the user """
+    return ECO_MAIN_LANG if conf.no_gettext or lang not in ECO_LANGS else lang
+
+
 def get_eco(hash, exactPosition=True):
     if not ECO_OK:
         return None
-    cur = conn.cursor()
-    select = "select eco, opening, variation, endline from openings where hash=? and hkey=? and lang=? and endline like ?"
-    qh = hex(hash)[2:]
-    qhkey = int(qh[-2:], 16)
-    qlang = ECO_MAIN_LANG if conf.no_gettext or lang not in ECO_LANGS else lang
-    qpos = 1 if exactPosition else '%'
-    cur.execute(select, (qh, qhkey, qlang, qpos))
-    result = cur.fetchone()
+    qlang = get_lang()
+    result = get_openings(qlang).get(hash)
+    if result is not None and exactPosition and result[3] != 1:
+        result = None
     if result is None and qlang != ECO_MAIN_LANG:
-        cur.execute(select, (qh, qhkey, ECO_MAIN_LANG, qpos))
-        result = cur.fetchone()
+        result = get_openings(ECO_MAIN_LANG).get(hash)
+        if result is not None and exactPosition and result[3] != 1:
+            result = None
     return result
 
 
+def classify(hashes, within_lines=False):
+    """ Return the get_eco() opening of the deepest of the positions with
+        hashes, the ones of a game in order, that ends an ECO line in the
+        language of the user or the main one, or None. With within_lines,
+        the positions after the first one out of the ECO lines of both
+        aren't looked at, so games can be replayed only that far. """
+
+    if not ECO_OK:
+        return None
+    qlang = get_lang()
+    tables = [get_openings(qlang)]
+    if qlang != ECO_MAIN_LANG:
+        tables.append(get_openings(ECO_MAIN_LANG))
+    deepest = None
+    for hash in hashes:
+        opening = get_eco(hash)
+        if opening is not None:
+            deepest = opening
+        elif within_lines and not any(hash in table for table in tables):
+            break
+    return deepest
+
+
 def find_opening_fen(keyword):
     # Checks
     if not ECO_OK:
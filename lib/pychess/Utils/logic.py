@@ -26,10 +26,9 @@ from pychess.Variants.racingkings import testKingInEightRow, test2KingInEightRow
 
 def getDestinationCords(board, cord):
     tcords = []
-    for move in lmovegen.genAllMoves(board.board):
+    for move in lmovegen.genLegalMoves(board.board):
         if FCORD(move) == cord.cord:
-            if not board.board.willLeaveInCheck(move):
-                tcords.append(Cord(TCORD(move)))
+            tcords.append(Cord(TCORD(move)))
     return tcords
 
 
@@ -96,8 +95,8 @@ def getStatus(board):
             return DRAW, DRAW_KINGSINEIGHTROW
         elif testKingInEightRow(lboard):
             can_save = False
-            for move in lmovegen.genAllMoves(lboard):
-                if lboard.willGiveCheck(move) or lboard.willLeaveInCheck(move):
+            for move in lmovegen.genLegalMoves(lboard):
+                if lboard.willGiveCheck(move):
                     continue
 
                 lboard.applyMove(move)
@@ -117,21 +116,25 @@ def getStatus(board):
             return DRAW, DRAW_INSUFFICIENT
 
     hasMove = False
-    for move in lmovegen.genAllMoves(lboard):
-        if board.variant == ATOMICCHESS:
+    if board.variant == ATOMICCHESS:
+        for move in lmovegen.genAllMoves(lboard):
             if kingExplode(lboard, move, 1 - board.color) and not kingExplode(
                     lboard, move, board.color):
                 hasMove = True
                 break
             elif kingExplode(lboard, move, board.color):
                 continue
-        lboard.applyMove(move)
-        if lboard.opIsChecked():
+            lboard.applyMove(move)
+            if lboard.opIsChecked():
+                lboard.popMove()
+                continue
+            hasMove = True
             lboard.popMove()
-            continue
-        hasMove = True
-        lboard.popMove()
-        break
+            break
+    else:
+        for move in lmovegen.genLegalMoves(lboard):
+            hasMove = True
+            break
 
     if not hasMove:
         if lboard.isChecked():
@@ -254,8 +257,4 @@ def genCastles(board):
 
 
 def legalMoveCount(board):
-    moves = 0
-    for move in lmovegen.genAllMoves(board.board):
-        if not board.board.willLeaveInCheck(move):
-            moves += 1
-    return moves
+    return sum(1 for move in lmovegen.genLegalMoves(board.board))
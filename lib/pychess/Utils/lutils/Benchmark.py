@@ -1,11 +1,32 @@
-from pychess.Utils.lutils.LBoard import LBoard
-from pychess.Utils.lutils.leval import clearPawnTable
-from pychess.Utils.lutils.lmove import listToSan
-from pychess.Utils.lutils import lsearch
-from pychess.Utils.const import NORMALCHESS
+""" Benchmarks of the lutils engine core.
+
+    benchmark() is the search benchmark of the engine's "benchmark" command.
+    runSuite() measures search, perft, move generation, evaluation, SAN and
+    FEN speed of every variant, and compare() checks its results against a
+    saved baseline. Run as a script, it does both:
+
+    python -m pychess.Utils.lutils.Benchmark --json --save baseline.json
+    python -m pychess.Utils.lutils.Benchmark --baseline baseline.json """
+
+import argparse
+import json
+import platform
+import random
 import sys
+from ctypes import create_string_buffer
 from time import time
 
+from pychess import VERSION
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils import leval
+from pychess.Utils.lutils.leval import clearPawnTable, evaluateComplete
+from pychess.Utils.lutils.lmove import listToSan, toSAN, parseSAN
+from pychess.Utils.lutils.lmovegen import genAllMoves, genLegalMoves
+from pychess.Utils.lutils.perft import do_perft, do_fast_perft, perftTable
+from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils.TranspositionTable import TranspositionTable
+from pychess.Utils.const import NORMALCHESS, UNSUPPORTED
+
 # For now, we use the benchmark positions from Stockfish.
 benchmarkPositions = [
     "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
@@ -54,3 +75,238 @@ def benchmark(maxdepth=6):
     print("Total:", suite_nodes, "nodes in", suite_time, "s: ", suite_nodes /
           suite_time, "n/s")
     lsearch.nodes = 0
+
+
+def _rate(func, items, mintime):
+    """ Call func on each of items, over and over for at least mintime
+        seconds. Returns the calls per second. """
+    calls = 0
+    start = time()
+    while True:
+        for item in items:
+            func(item)
+        calls += len(items)
+        elapsed = time() - start
+        if elapsed >= mintime:
+            return calls / elapsed if elapsed > 0 else float(calls)
+
+
+def _variantPositions(variant, boardClass, count, seed):
+    """ The start position of variant, followed by positions reached with
+        random legal moves. The same seed always gives the same positions. """
+    rnd = random.Random(seed)
+    # Shuffle variants draw their start position from the random module
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        board = boardClass(setup=True).board
+    finally:
+        random.setstate(state)
+    start = board.asFen()
+    fens = [start]
+    while len(fens) < count:
+        board = LBoard(variant)
+        board.applyFen(start)
+        for ply in range(rnd.randint(4, 40)):
+            moves = list(genLegalMoves(board))
+            if not moves:
+                break
+            board.applyMove(rnd.choice(moves))
+        fens.append(board.asFen())
+    return fens
+
+
+def benchmarkSearch(maxdepth, positions=benchmarkPositions):
+    """ Search positions to maxdepth, returning the nodes per second and the
+        time it took to complete each depth, summed over positions """
+    timeToDepth = [0.0] * maxdepth
+    nodes = 0
+    suite_time = time()
+    for fen in positions:
+        lsearch.table.clear()
+        clearPawnTable()
+        board = LBoard(NORMALCHESS)
+        board.applyFen(fen)
+        lsearch.nodes = 0
+        lsearch.endtime = sys.maxsize
+        lsearch.searching = True
+        pos_start_time = time()
+        for depth in range(1, maxdepth + 1):
+            lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
+            lsearch.alphaBeta(board, depth)
+            timeToDepth[depth - 1] += time() - pos_start_time
+        nodes += lsearch.nodes
+    suite_time = time() - suite_time
+    return {
+        "nodes": nodes,
+        "nps": nodes / suite_time if suite_time > 0 else float(nodes),
+        "time_to_depth": dict((str(depth + 1), secs)
+                              for depth, secs in enumerate(timeToDepth)),
+    }
+
+
+def benchmarkPerft(depth, positions=benchmarkPositions[:2]):
+    """ Perft speed in leaf nodes per second, plain and fast """
+    results = {}
+    for name, func in (("perft", lambda board: do_perft(board, depth, 0)),
+                       ("fastperft", lambda board: do_fast_perft(board, depth))):
+        perftTable.clear()
+        nodes = 0
+        start = time()
+        for fen in positions:
+            board = LBoard(NORMALCHESS)
+            board.applyFen(fen)
+            nodes += func(board)
+        elapsed = time() - start
+        results[name] = {
+            "nodes": nodes,
+            "nps": nodes / elapsed if elapsed > 0 else float(nodes),
+        }
+    return results
+
+
+def benchmarkVariant(variant, boardClass, positions=8, mintime=0.2, seed=0):
+    """ Throughput of the per position operations in one variant """
+    boards = []
+    for fen in _variantPositions(variant, boardClass, positions, seed):
+        board = LBoard(variant)
+        board.applyFen(fen)
+        boards.append(board)
+    moves = [(board, move) for board in boards
+             for move in genLegalMoves(board)]
+    sans = [(board, toSAN(board, move)) for board, move in moves]
+    fens = [board.asFen() for board in boards]
+    generated = sum(1 for board in boards for move in genAllMoves(board))
+
+    def applyFen(fen):
+        LBoard(variant).applyFen(fen)
+
+    return {
+        "movegen_per_s": generated * _rate(
+            lambda board: sum(1 for move in genAllMoves(board)),
+            boards, mintime) / len(boards),
+        "legal_movegen_per_s": len(moves) * _rate(
+            lambda board: sum(1 for move in genLegalMoves(board)),
+            boards, mintime) / len(boards),
+        "eval_per_s": _rate(lambda board: evaluateComplete(board, board.color),
+                            boards, mintime),
+        "toSAN_per_s": _rate(lambda bm: toSAN(*bm), moves, mintime),
+        "parseSAN_per_s": _rate(lambda bs: parseSAN(*bs), sans, mintime),
+        "applyFen_per_s": _rate(applyFen, fens, mintime),
+        "asFen_per_s": _rate(lambda board: board.asFen(), boards, mintime),
+    }
+
+
+def runSuite(maxdepth=4, perftdepth=3, variantList=None, mintime=0.2):
+    """ Run all benchmarks, returning their results as a dict which can be
+        saved as JSON. Search state in lsearch, with its transposition
+        table, and the pawn hash table are left as they were. """
+    from pychess.Variants import variants
+
+    saved = (lsearch.nodes, lsearch.searching, lsearch.endtime, lsearch.table, leval.pawntable)
+    # The benchmarks clear the tables, so they get their own of the same size
+    lsearch.table = TranspositionTable(lsearch.table.maxSize)
+    leval.pawntable = create_string_buffer(len(leval.pawntable))
+    try:
+        results = {
+            "pychess": VERSION,
+            "python": platform.python_version(),
+            "search": benchmarkSearch(maxdepth),
+            "perft": benchmarkPerft(perftdepth),
+            "variants": {},
+        }
+        for variant, boardClass in sorted(variants.items()):
+            if variant in UNSUPPORTED:
+                continue
+            if variantList is not None and boardClass.__name__ not in variantList:
+                continue
+            results["variants"][boardClass.__name__] = benchmarkVariant(
+                variant, boardClass, mintime=mintime)
+    finally:
+        lsearch.nodes, lsearch.searching, lsearch.endtime, lsearch.table, leval.pawntable = saved
+    return results
+
+
+def _flatten(results, prefix=""):
+    for key, value in sorted(results.items()):
+        if isinstance(value, dict):
+            for item in _flatten(value, prefix + key + "/"):
+                yield item
+        else:
+            yield prefix + key, value
+
+
+def compare(results, baseline, tolerance=0.1):
+    """ Compare results with those of an earlier runSuite(). Returns a list
+        of (metric, baseline value, value) for every speed which got worse
+        by more than tolerance (a fraction of the baseline value). """
+    old = dict(_flatten(baseline))
+    regressions = []
+    for metric, value in _flatten(results):
+        if metric not in old or not isinstance(value, float):
+            continue
+        if metric.endswith("nps") or metric.endswith("_per_s"):
+            worse = value < old[metric] * (1 - tolerance)
+        elif "/time_to_depth/" in metric:
+            worse = value > old[metric] * (1 + tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append((metric, old[metric], value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pychess.Utils.lutils.Benchmark",
+        description="Benchmark the PyChess engine core")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    parser.add_argument("--depth", type=int, default=4,
+                        help="search depth (default: %(default)s)")
+    parser.add_argument("--perft", type=int, default=3,
+                        help="perft depth (default: %(default)s)")
+    parser.add_argument("--variant", action="append",
+                        help="only measure this variant board, e.g. "
+                             "NormalBoard (may be repeated)")
+    parser.add_argument("--mintime", type=float, default=0.2,
+                        help="seconds to measure each rate for "
+                             "(default: %(default)s)")
+    parser.add_argument("--save", metavar="FILE",
+                        help="save the results as a JSON baseline")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed slowdown against the baseline "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = runSuite(args.depth, args.perft, args.variant, args.mintime)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for metric, value in _flatten(results):
+            if isinstance(value, float):
+                print("%-50s %14.2f" % (metric, value))
+            else:
+                print("%-50s %14s" % (metric, value))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for metric, old, new in regressions:
+            print("Regression: %s %.2f -> %.2f" % (metric, old, new),
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+from array import array
+
 from pychess.Utils.const import EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, \
     ATOMICCHESS, BUGHOUSECHESS, CRAZYHOUSECHESS, CAMBODIANCHESS, MAKRUKCHESS, \
     FISCHERRANDOMCHESS, SITTUYINCHESS, WILDCASTLECHESS, WILDCASTLESHUFFLECHESS, \
@@ -30,37 +32,70 @@ STRICT_FEN = False
 # LBoard                                                                       #
 ################################################################################
 
+# The history of a position is a chain of tuples, one for each move made on
+# the board, linked to the node of the move before it. Clones share the
+# chain, and popMove() simply steps back to the parent. A node holds:
+# parent      the node of the previous move, or None
+# move        the move that was applied to get the position
+# tpiece      the piece the move captured, == EMPTY for normal moves
+# enpassant, castling, hash, fifty, checked, opchecked
+#             the state of the board before the move
+# extra       variant data: capture_promoting in drop variants,
+#             is_first_move in Cambodian, virgin in S-chess and the pieces
+#             exploded by the move in atomic
+HIST_PARENT, HIST_MOVE, HIST_TPIECE, HIST_ENPASSANT, HIST_CASTLING, \
+    HIST_HASH, HIST_FIFTY, HIST_CHECKED, HIST_OPCHECKED, HIST_EXTRA = range(10)
+
+# Initial positions of castling kings and rooks
+INI_KINGS = (E1, E8)
+INI_ROOKS = ((A1, H1), (A8, H8))
+
+# Final positions of castled kings and rooks
+FIN_KINGS = ((C1, G1), (C8, G8))
+FIN_ROOKS = ((D1, F1), (D8, F8))
+
+NO_HOLDING = ({PAWN: 0,
+               KNIGHT: 0,
+               BISHOP: 0,
+               ROOK: 0,
+               QUEEN: 0,
+               HAWK: 0,
+               ELEPHANT: 0,
+               KING: 0},
+              {PAWN: 0,
+               KNIGHT: 0,
+               BISHOP: 0,
+               ROOK: 0,
+               QUEEN: 0,
+               HAWK: 0,
+               ELEPHANT: 0,
+               KING: 0})
+
 
 class LBoard:
     __hash__ = None
 
-    ini_kings = (E1, E8)
-    ini_rooks = ((A1, H1), (A8, H8))
-
-    # Final positions of castled kings and rooks
-    fin_kings = ((C1, G1), (C8, G8))
-    fin_rooks = ((D1, F1), (D8, F8))
-
-    holding = ({PAWN: 0,
-                KNIGHT: 0,
-                BISHOP: 0,
-                ROOK: 0,
-                QUEEN: 0,
-                HAWK: 0,
-                ELEPHANT: 0,
-                KING: 0},
-               {PAWN: 0,
-                KNIGHT: 0,
-                BISHOP: 0,
-                ROOK: 0,
-                QUEEN: 0,
-                HAWK: 0,
-                ELEPHANT: 0,
-                KING: 0})
+    # Databases and game previews keep thousands of boards around, so they
+    # have no __dict__ and keep the squares in byte arrays. The bitboards stay
+    # in lists, as reading them from an array('Q') slows down move generation.
+    __slots__ = ("variant", "nags", "children", "next", "prev", "pieceBoard",
+                 "fen_was_applied", "plyCount", "blocker", "friends", "kings",
+                 "boards", "enpassant", "color", "castling", "hasCastled",
+                 "fifty", "checked", "opchecked", "arBoard", "hash",
+                 "pawnhash", "history", "pieceCount", "ini_kings",
+                 "ini_rooks", "fin_kings", "fin_rooks", "holding",
+                 "promoted", "capture_promoting", "remaining_checks",
+                 "ini_queens", "is_first_move", "virgin")
 
     def __init__(self, variant=NORMALCHESS):
         self.variant = variant
 
+        self.ini_kings = INI_KINGS
+        self.ini_rooks = INI_ROOKS
+        self.fin_kings = FIN_KINGS
+        self.fin_rooks = FIN_ROOKS
+        self.holding = NO_HOLDING
+
         self.nags = []
         # children can contain comments and variations
         # variations are lists of lboard objects
@@ -81,25 +116,73 @@ class LBoard:
 
     @property
     def lastMove(self):
-        return self.hist_move[-1] if self.fen_was_applied and len(
-            self.hist_move) > 0 else None
+        return self.history[HIST_MOVE] if self.fen_was_applied and \
+            self.history is not None else None
 
     def repetitionCount(self, draw_threshold=3):
         rc = 1
-        for ply in range(4, 1 + min(len(self.hist_hash), self.fifty), 2):
-            if self.hist_hash[-ply] == self.hash:
+        ply = 1
+        node = self.history
+        while node is not None and ply <= self.fifty:
+            if ply >= 4 and ply % 2 == 0 and node[HIST_HASH] == self.hash:
                 rc += 1
                 if rc >= draw_threshold:
                     break
+            node = node[HIST_PARENT]
+            ply += 1
         return rc
 
+    def iterHistory(self):
+        """ The history nodes of the position, latest first """
+        node = self.history
+        while node is not None:
+            yield node
+            node = node[HIST_PARENT]
+
+    def _histList(self, field):
+        return [node[field] for node in reversed(list(self.iterHistory()))]
+
+    # The history as lists, oldest first
+    hist_move = property(lambda self: self._histList(HIST_MOVE))
+    hist_tpiece = property(lambda self: self._histList(HIST_TPIECE))
+    hist_enpassant = property(lambda self: self._histList(HIST_ENPASSANT))
+    hist_castling = property(lambda self: self._histList(HIST_CASTLING))
+    hist_hash = property(lambda self: self._histList(HIST_HASH))
+    hist_fifty = property(lambda self: self._histList(HIST_FIFTY))
+    hist_checked = property(lambda self: self._histList(HIST_CHECKED))
+    hist_opchecked = property(lambda self: self._histList(HIST_OPCHECKED))
+    hist_capture_promoting = property(lambda self: self._histList(HIST_EXTRA))
+    hist_is_first_move = property(lambda self: self._histList(HIST_EXTRA))
+    hist_virgin = property(lambda self: self._histList(HIST_EXTRA))
+
+    @property
+    def hist_exploding_around(self):
+        return [apieces for apieces in self._histList(HIST_EXTRA) if apieces]
+
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__
+                 if hasattr(self, name)}
+        # Long histories nest too deep for pickle, so store them flat
+        if "history" in state:
+            state["history"] = [node[1:] for node in
+                                reversed(list(self.iterHistory()))]
+        return state
+
+    def __setstate__(self, state):
+        if "history" in state:
+            history = None
+            for node in state["history"]:
+                history = (history, ) + node
+            state["history"] = history
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def iniAtomic(self):
-        self.hist_exploding_around = []
+        pass
 
     def iniHouse(self):
-        self.promoted = [0] * 64
+        self.promoted = array('b', bytes(64))
         self.capture_promoting = False
-        self.hist_capture_promoting = []
         self.holding = ({PAWN: 0,
                          KNIGHT: 0,
                          BISHOP: 0,
@@ -121,11 +204,9 @@ class LBoard:
         self.ini_kings = (D1, E8)
         self.ini_queens = (E1, D8)
         self.is_first_move = {KING: [True, True], QUEEN: [True, True]}
-        self.hist_is_first_move = []
 
     def iniSchess(self):
         self.virgin = [0, 0]
-        self.hist_virgin = []
 
     def applyFen(self, fenstr):
         """ Applies the fenstring to the board.
@@ -157,24 +238,16 @@ class LBoard:
         self.checked = None
         self.opchecked = None
 
-        self.arBoard = [0] * 64
+        self.arBoard = array('b', bytes(64))
 
         self.hash = 0
         self.pawnhash = 0
 
-        #  Data from the position's history:
-        self.hist_move = []  # The move that was applied to get the position
-        self.hist_tpiece = []
-        # The piece the move captured, == EMPTY for normal moves
-        self.hist_enpassant = []
-        self.hist_castling = []
-        self.hist_hash = []
-        self.hist_fifty = []
-        self.hist_checked = []
-        self.hist_opchecked = []
+        #  Data from the position's history, see HIST_PARENT
+        self.history = None
 
         # piece counts
-        self.pieceCount = ([0] * 9, [0] * 9)
+        self.pieceCount = (array('b', bytes(9)), array('b', bytes(9)))
 
         # initial cords of rooks and kings for castling in Chess960
         if self.variant == FISCHERRANDOMCHESS:
@@ -560,20 +633,22 @@ class LBoard:
         qcastle = flag == QUEEN_CASTLE or (
             self.variant == SCHESS and ((fpiece == KING and fcord - tcord == 2) or (flag in (HAWK_GATE_AT_ROOK, ELEPHANT_GATE_AT_ROOK) and fcord - tcord < 0)))
 
-        self.hist_move.append(move)
-        self.hist_enpassant.append(self.enpassant)
-        self.hist_castling.append(self.castling)
-        self.hist_hash.append(self.hash)
-        self.hist_fifty.append(self.fifty)
-        self.hist_checked.append(self.checked)
-        self.hist_opchecked.append(self.opchecked)
         if self.variant in DROP_VARIANTS and self.variant != SCHESS:
-            self.hist_capture_promoting.append(self.capture_promoting)
-        if self.variant == CAMBODIANCHESS:
-            self.hist_is_first_move.append({KING: self.is_first_move[KING][:],
-                                            QUEEN: self.is_first_move[QUEEN][:]})
+            extra = self.capture_promoting
+        elif self.variant == CAMBODIANCHESS:
+            extra = {KING: self.is_first_move[KING][:],
+                     QUEEN: self.is_first_move[QUEEN][:]}
         elif self.variant == SCHESS:
-            self.hist_virgin.append(self.virgin[:])
+            extra = self.virgin[:]
+        elif self.variant == ATOMICCHESS:
+            # Filled with the exploded pieces below
+            extra = []
+        else:
+            extra = None
+        self.history = (self.history, move,
+                        EMPTY if kcastle or qcastle else tpiece,
+                        self.enpassant, self.castling, self.hash, self.fifty,
+                        self.checked, self.opchecked, extra)
 
         self.opchecked = None
         self.checked = None
@@ -641,8 +716,7 @@ class LBoard:
                             castling &= ~CAS_FLAGS[opcolor][0]
                         elif acord == self.ini_rooks[opcolor][1]:
                             castling &= ~CAS_FLAGS[opcolor][1]
-                self.hist_exploding_around.append(apieces)
-        self.hist_tpiece.append(tpiece)
+                extra.extend(apieces)
 
         # Remove moving piece(s), then add them at their destination.
         if flag == DROP:
@@ -674,7 +748,7 @@ class LBoard:
                         self._removePiece(acord, apiece, acolor)
                         self.pieceCount[acolor][apiece] -= 1
                         apieces.append((acord, apiece, acolor))
-                self.hist_exploding_around.append(apieces)
+                extra.extend(apieces)
         elif flag in PROMOTIONS:
             # Pretend the pawn changes into a piece before reaching its destination.
             fpiece = flag - 2
@@ -761,8 +835,8 @@ class LBoard:
         color = 1 - self.color
         opcolor = self.color
 
-        move = self.hist_move.pop()
-        cpiece = self.hist_tpiece.pop()
+        self.history, move, cpiece, enpassant, castling, hash, fifty, \
+            checked, opchecked, extra = self.history
 
         flag = move >> 12
 
@@ -818,8 +892,7 @@ class LBoard:
                     self.holding[color][cpiece] -= 1
                     self.hash ^= holdingHash[color][cpiece][self.holding[color][cpiece]]
             elif self.variant == ATOMICCHESS:
-                apieces = self.hist_exploding_around.pop()
-                for acord, apiece, acolor in apieces:
+                for acord, apiece, acolor in extra:
                     self._addPiece(acord, apiece, acolor)
                     self.pieceCount[acolor][apiece] += 1
 
@@ -833,8 +906,7 @@ class LBoard:
                 self.holding[color][PAWN] -= 1
                 self.hash ^= holdingHash[color][PAWN][self.holding[color][PAWN]]
             elif self.variant == ATOMICCHESS:
-                apieces = self.hist_exploding_around.pop()
-                for acord, apiece, acolor in apieces:
+                for acord, apiece, acolor in extra:
                     self._addPiece(acord, apiece, acolor)
                     self.pieceCount[acolor][apiece] += 1
 
@@ -866,21 +938,23 @@ class LBoard:
                     self.promoted[tcord] = 1
                 else:
                     self.promoted[tcord] = 0
-            self.capture_promoting = self.hist_capture_promoting.pop()
+            self.capture_promoting = extra
 
+        # History nodes are shared by clones, so never change their contents
         if self.variant == CAMBODIANCHESS:
-            self.is_first_move = self.hist_is_first_move.pop()
+            self.is_first_move = {KING: extra[KING][:],
+                                  QUEEN: extra[QUEEN][:]}
         elif self.variant == SCHESS:
-            self.virgin = self.hist_virgin.pop()
+            self.virgin = extra[:]
 
         self.setColor(color)
 
-        self.checked = self.hist_checked.pop()
-        self.opchecked = self.hist_opchecked.pop()
-        self.enpassant = self.hist_enpassant.pop()
-        self.castling = self.hist_castling.pop()
-        self.hash = self.hist_hash.pop()
-        self.fifty = self.hist_fifty.pop()
+        self.checked = checked
+        self.opchecked = opchecked
+        self.enpassant = enpassant
+        self.castling = castling
+        self.hash = hash
+        self.fifty = fifty
         self.plyCount -= 1
 
     def __eq__(self, other):
@@ -1096,14 +1170,8 @@ class LBoard:
         copy.checked = self.checked
         copy.opchecked = self.opchecked
 
-        copy.hist_move = self.hist_move[:]
-        copy.hist_tpiece = self.hist_tpiece[:]
-        copy.hist_enpassant = self.hist_enpassant[:]
-        copy.hist_castling = self.hist_castling[:]
-        copy.hist_hash = self.hist_hash[:]
-        copy.hist_fifty = self.hist_fifty[:]
-        copy.hist_checked = self.hist_checked[:]
-        copy.hist_opchecked = self.hist_opchecked[:]
+        # The history is never changed in place, so it can be shared
+        copy.history = self.history
 
         if self.variant == FISCHERRANDOMCHESS:
             copy.ini_kings = self.ini_kings[:]
@@ -1116,12 +1184,8 @@ class LBoard:
             copy.promoted = self.promoted[:]
             copy.holding = (self.holding[0].copy(), self.holding[1].copy())
             copy.capture_promoting = self.capture_promoting
-            copy.hist_capture_promoting = self.hist_capture_promoting[:]
             if self.variant == SCHESS:
                 copy.virgin = self.virgin[:]
-                copy.hist_virgin = self.hist_virgin[:]
-        elif self.variant == ATOMICCHESS:
-            copy.hist_exploding_around = [a[:] for a in self.hist_exploding_around]
         elif self.variant == THREECHECKCHESS:
             copy.remaining_checks = self.remaining_checks[:]
         elif self.variant == CAMBODIANCHESS:
@@ -1129,7 +1193,6 @@ class LBoard:
             copy.ini_queens = self.ini_queens
             copy.is_first_move = {KING: self.is_first_move[KING][:],
                                   QUEEN: self.is_first_move[QUEEN][:]}
-            copy.hist_is_first_move = self.hist_is_first_move[:]
 
         copy.fen_was_applied = self.fen_was_applied
         return copy
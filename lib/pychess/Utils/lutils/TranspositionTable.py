@@ -1,6 +1,23 @@
+import mmap
+import multiprocessing
+import os
+import weakref
 from ctypes import create_string_buffer, memset
+from multiprocessing.sharedctypes import RawArray
 from struct import Struct
 
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python < 3.8
+    SharedMemory = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where a mapped file can't be truncated anyway
+    fcntl = None
+
 from pychess.Utils.const import hashfALPHA, hashfBETA, hashfEXACT, hashfBAD
 from pychess.Utils.lutils.ldata import MATE_VALUE, MAXPLY
 
@@ -13,13 +30,32 @@ from pychess.Utils.lutils.ldata import MATE_VALUE, MAXPLY
 # move        best move (or cutoff move)
 entryType = Struct('=I B B H h H')
 
+# Tables shared between processes see the same entry as a 32 bit check word
+# followed by the other fields packed into one 64 bit word (see
+# SharedTranspositionTable)
+sharedEntryType = Struct('=I Q')
+assert sharedEntryType.size == entryType.size
+
+# Files holding a persistent table start with a header of:
+# magic       identifies the file format and its version
+# buckets     number of buckets, as entries are placed by hash % buckets
+# search_id   search_id of the last search using the table
+headerType = Struct('=8s Q B')
+HEADER_MAGIC = b"PyChsTT1"
+HEADER_SIZE = 64
+
+# Shared tables keep the search_id of the main search after their entries
+searchIdType = Struct('=B')
+SEARCH_ID_SIZE = 8
+
 
 class TranspositionTable:
     def __init__(self, maxSize):
         assert maxSize > 0
+        self.maxSize = maxSize
         self.buckets = maxSize // (4 * entryType.size)
-        self.data = create_string_buffer(self.buckets * 4 * entryType.size)
         self.search_id = 0
+        self.data = self.allocate(self.buckets * 4 * entryType.size)
 
         self.killer1 = [-1] * 80
         self.killer2 = [-1] * 80
@@ -27,8 +63,19 @@ class TranspositionTable:
 
         self.butterfly = [0] * (64 * 64)
 
-    def clear(self):
+    def allocate(self, size):
+        return create_string_buffer(size)
+
+    def close(self):
+        """ Give the table's memory back. The table can't be used anymore
+            afterwards. """
+        self.data = None
+
+    def clearEntries(self):
         memset(self.data, 0, self.buckets * 4 * entryType.size)
+
+    def clear(self):
+        self.clearEntries()
         self.killer1 = [-1] * 80
         self.killer2 = [-1] * 80
         self.hashmove = [-1] * 80
@@ -38,6 +85,10 @@ class TranspositionTable:
         self.search_id = (self.search_id + 1) & 0xff
         # TODO: consider clearing butterfly table
 
+    def loadSearch(self):
+        """ Take the search_id of the process owning the search. Only
+            tables shared with other processes have one. """
+
     def probe(self, board, depth, alpha, beta):
         baseIndex = (board.hash % self.buckets) * 4
         key = (board.hash // self.buckets) & 0xffffffff
@@ -104,3 +155,223 @@ class TranspositionTable:
 
     def getButterfly(self, move):
         return self.butterfly[move & 0xfff]
+
+
+# Names of the segments created by this process or the one it was forked
+# from, which are known to the resource tracker of this process
+_createdSegments = set()
+
+
+def _releaseSharedMemory(shm, owner):
+    shm.close()
+    if owner:
+        shm.unlink()
+        _createdSegments.discard(shm._name)
+
+
+def _fold(word):
+    return (word ^ (word >> 32)) & 0xffffffff
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """ A transposition table living in shared memory, so that several
+        processes (the helpers of a parallel search, or an analysis service
+        and its clients) probe and record into one table.
+
+        The table is a named multiprocessing.shared_memory segment. Another
+        process attaches to it by passing its name, or simply by unpickling
+        the table. On Pythons without shared_memory an anonymous RawArray is
+        used instead, which only processes started by us can inherit.
+
+        Entries are written without any locking. To detect entries torn by
+        concurrent writers, the key is stored xor'ed with the rest of the
+        entry, so a probe only matches if key and data come from the same
+        write. Killers, hash moves and the butterfly table stay process
+        local.
+
+        Only the process running the main search calls newSearch(), which
+        stores the new search_id after the entries. The others take it with
+        loadSearch(), so all of them age the entries alike. """
+
+    def __init__(self, maxSize, name=None, data=None):
+        self.name = name
+        self.shared = data
+        self.shm = None
+        self.release = None
+        TranspositionTable.__init__(self, maxSize)
+
+    def allocate(self, size):
+        self.searchIdOffset = size
+        size += SEARCH_ID_SIZE
+        if self.shared is not None:
+            assert len(self.shared) == size
+            return self.shared
+
+        if SharedMemory is None:
+            assert self.name is None, "Named tables need Python 3.8"
+            self.shared = RawArray('c', size)
+            return self.shared
+
+        owner = self.name is None
+        self.shm = SharedMemory(name=self.name, create=owner, size=size)
+        inheriting = getattr(multiprocessing.current_process(), "_inheriting", False)
+        if owner:
+            _createdSegments.add(self.shm._name)
+        elif not inheriting and self.shm._name not in _createdSegments:
+            # Our own resource tracker would destroy the segment when we
+            # exit, even though we didn't create it. Processes started by
+            # multiprocessing, and the owner itself, share the tracker
+            # knowing it, so let them be.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = self.shm.name
+        self.release = weakref.finalize(self, _releaseSharedMemory, self.shm,
+                                        owner)
+        return self.shm.buf
+
+    def __reduce__(self):
+        return (self.__class__, (self.maxSize, self.name, self.shared))
+
+    def close(self):
+        TranspositionTable.close(self)
+        if self.release is not None:
+            self.release()
+
+    def clearEntries(self):
+        size = self.buckets * 4 * entryType.size
+        self.data[:size] = bytes(size)
+
+    def newSearch(self):
+        TranspositionTable.newSearch(self)
+        searchIdType.pack_into(self.data, self.searchIdOffset, self.search_id)
+
+    def loadSearch(self):
+        self.search_id = searchIdType.unpack_from(self.data, self.searchIdOffset)[0]
+
+    def probe(self, board, depth, alpha, beta):
+        baseIndex = (board.hash % self.buckets) * 4
+        key = (board.hash // self.buckets) & 0xffffffff
+        for i in range(baseIndex, baseIndex + 4):
+            check, word = sharedEntryType.unpack_from(self.data,
+                                                      i * entryType.size)
+            if check ^ _fold(word) == key and (check or word):
+                tdepth = (word >> 16) & 0xffff
+                hashf = (word >> 8) & 0xff
+                score = (word >> 32) & 0xffff
+                if score >= 0x8000:
+                    score -= 0x10000
+                move = word >> 48
+                # Mate score bounds are guaranteed to be accurate at any depth.
+                if tdepth < depth and abs(score) < MATE_VALUE - MAXPLY:
+                    return move, score, hashfBAD
+                if hashf == hashfEXACT:
+                    return move, score, hashf
+                if hashf == hashfALPHA and score <= alpha:
+                    return move, alpha, hashf
+                if hashf == hashfBETA and score >= beta:
+                    return move, beta, hashf
+
+    def record(self, board, move, score, hashf, depth):
+        baseIndex = (board.hash % self.buckets) * 4
+        key = (board.hash // self.buckets) & 0xffffffff
+        # We always overwrite *something*: an empty slot, this position's last
+        # entry, or else the least relevant. A torn entry can't be told from
+        # the entry of another position, so it is weighed by its depth and
+        # search_id fields like any other.
+        staleIndex = baseIndex
+        staleRelevance = 0xffff
+        for i in range(baseIndex, baseIndex + 4):
+            check, word = sharedEntryType.unpack_from(self.data,
+                                                      i * entryType.size)
+            tkey = check ^ _fold(word)
+            if not (check or word) or tkey == key:
+                staleIndex = i
+                break
+            search_id = word & 0xff
+            thashf = (word >> 8) & 0xff
+            tdepth = (word >> 16) & 0xffff
+            relevance = (0x8000 if search_id != self.search_id and thashf == hashfEXACT else 0) + \
+                        (0x4000 if ((self.search_id - search_id) & 0xff) > 1 else 0) + tdepth
+            if relevance < staleRelevance:
+                staleIndex = i
+                staleRelevance = relevance
+        word = self.search_id | hashf << 8 | depth << 16 | \
+            (score & 0xffff) << 32 | move << 48
+        sharedEntryType.pack_into(self.data, staleIndex * entryType.size,
+                                  key ^ _fold(word), word)
+
+
+def _releaseMapping(view, mapping, lockFile):
+    view.release()
+    mapping.flush()
+    mapping.close()
+    # Closing the file drops our lock on it
+    lockFile.close()
+
+
+class FileTranspositionTable(SharedTranspositionTable):
+    """ A transposition table mmap'ed from a file, so its entries survive
+        engine restarts and can be shared by several engines at once.
+
+        The file header remembers the search_id, so entries from earlier runs
+        simply look old and get replaced first, as entries from earlier
+        searches do. A file made for another table size is cleared, but only
+        when no other engine has it open: every table holds a shared lock on
+        its file, and clearing it needs an exclusive one. Otherwise OSError
+        is raised, so the caller can use a table of its own instead. """
+
+    def __init__(self, maxSize, path):
+        self.path = path
+        SharedTranspositionTable.__init__(self, maxSize)
+
+    def allocate(self, size):
+        if not os.path.isfile(self.path):
+            open(self.path, "wb").close()
+        f = open(self.path, "r+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_SH)
+            header = f.read(headerType.size)
+            f.seek(0, os.SEEK_END)
+            if f.tell() == HEADER_SIZE + size and len(header) == headerType.size:
+                magic, buckets, search_id = headerType.unpack(header)
+                if magic == HEADER_MAGIC and buckets == self.buckets:
+                    self.search_id = search_id
+                else:
+                    header = None
+            else:
+                header = None
+            if header is None:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        raise OSError("%s is used by another engine with another hash size" % self.path)
+                f.truncate(0)
+                f.truncate(HEADER_SIZE + size)
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_SH)
+            self.mapping = mmap.mmap(f.fileno(), HEADER_SIZE + size)
+        except BaseException:
+            f.close()
+            raise
+
+        self.storeHeader()
+        view = memoryview(self.mapping)[HEADER_SIZE:]
+        self.release = weakref.finalize(self, _releaseMapping, view,
+                                        self.mapping, f)
+        return view
+
+    def __reduce__(self):
+        return (self.__class__, (self.maxSize, self.path))
+
+    def storeHeader(self):
+        headerType.pack_into(self.mapping, 0, HEADER_MAGIC, self.buckets,
+                             self.search_id)
+
+    def newSearch(self):
+        TranspositionTable.newSearch(self)
+        self.storeHeader()
+
+    def loadSearch(self):
+        self.search_id = headerType.unpack_from(self.mapping, 0)[2]
@@ -1,6 +1,8 @@
 
-from .bitboard import bitPosArray, notBitPosArray, lastBit, firstBit, clearBit, lsb
-from .ldata import moveArray, rays, directions, fromToRay, PIECE_VALUES, PAWN_VALUE
+from .bitboard import bitPosArray, notBitPosArray, lastBit, firstBit, clearBit
+from .ldata import moveArray, rays, directions, fromToRay, PIECE_VALUES, PAWN_VALUE, \
+    MAXBITBOARD, rookAttack, rookOffset, rookMask, rookMagic, rookShift, \
+    bishopAttack, bishopOffset, bishopMask, bishopMagic, bishopShift
 from pychess.Utils.const import ASEAN_VARIANTS, ASEAN_BBISHOP, ASEAN_WBISHOP, ASEAN_QUEEN, SCHESS, \
     BLACK, WHITE, PAWN, BPAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, ENPASSANT, ATOMICCHESS, HAWK, ELEPHANT
 
@@ -21,7 +23,6 @@ def isAttacked(board, cord, color, ischecked=False):
     if (pboards[KNIGHT] | pboards[HAWK] | pboards[ELEPHANT]) & _moveArray[KNIGHT][cord]:
         return True
 
-    rayto = fromToRay[cord]
     blocker = board.blocker
 
     # Bishops & Queens
@@ -33,38 +34,26 @@ def isAttacked(board, cord, color, ischecked=False):
         if pboards[QUEEN] & _moveArray[ASEAN_QUEEN][cord]:
             return True
     else:
-        bitboard = (pboards[BISHOP] | pboards[HAWK] |
-                    pboards[QUEEN]) & _moveArray[BISHOP][cord]
-        if bitboard:
-            others = ~bitboard & blocker
-            # inlined iterBits()
-            while bitboard:
-                bit = bitboard & -bitboard
-                ray = rayto[lsb[bit]]
-                # If there is a path and no other piece stand in our way
-                if ray and not ray & others:
-                    return True
-                bitboard -= bit
+        if (pboards[BISHOP] | pboards[HAWK] | pboards[QUEEN]) & bishopAttack[
+                bishopOffset[cord] +
+                (((blocker & bishopMask[cord]) * bishopMagic[cord] &
+                  MAXBITBOARD) >> bishopShift[cord])]:
+            return True
 
     # Rooks & Queens
     if board.variant in ASEAN_VARIANTS:
-        bitboard = pboards[ROOK] & _moveArray[ROOK][cord]
+        bitboard = pboards[ROOK]
     else:
-        bitboard = (pboards[ROOK] | pboards[QUEEN] | pboards[ELEPHANT]) & _moveArray[ROOK][cord]
-    if bitboard:
-        others = ~bitboard & blocker
-        # inlined iterBits()
-        while bitboard:
-            bit = bitboard & -bitboard
-            ray = rayto[lsb[bit]]
-            # If there is a path and no other piece stand in our way
-            if ray and not ray & others:
-                return True
-            bitboard -= bit
-
-            # Pawns
-            # Would a pawn of the opposite color, standing at out kings cord, be able
-            # to attack any of our pawns?
+        bitboard = pboards[ROOK] | pboards[QUEEN] | pboards[ELEPHANT]
+    if bitboard & rookAttack[
+            rookOffset[cord] +
+            (((blocker & rookMask[cord]) * rookMagic[cord] &
+              MAXBITBOARD) >> rookShift[cord])]:
+        return True
+
+    # Pawns
+    # Would a pawn of the opposite color, standing at out kings cord, be able
+    # to attack any of our pawns?
     ptype = color == WHITE and BPAWN or PAWN
     if pboards[PAWN] & _moveArray[ptype][cord]:
         return True
@@ -96,7 +85,6 @@ def getAttacks(board, cord, color):
     # Pawns, to test , bug possible with BPAWN
     bits |= pieces[PAWN] & _moveArray[color == WHITE and BPAWN or PAWN][cord]
 
-    rayto = fromToRay[cord]
     blocker = board.blocker
 
     # Bishops and Queens
@@ -107,32 +95,20 @@ def getAttacks(board, cord, color):
 
         bits |= pieces[QUEEN] & _moveArray[ASEAN_QUEEN][cord]
     else:
-        bitboard = (pieces[BISHOP] | pieces[QUEEN] | pieces[HAWK]) & _moveArray[BISHOP][cord]
-        # inlined iterBits()
-        # check whether or not there is a piece blocking the path in diagonal
-        while bitboard:
-            bit = bitboard & -bitboard
-            c = lsb[bit]
-            ray = rayto[c]
-            if ray and not clearBit(ray & blocker, c):
-                bits |= bitPosArray[c]
-            bitboard -= bit
+        bits |= (pieces[BISHOP] | pieces[QUEEN] | pieces[HAWK]) & bishopAttack[
+            bishopOffset[cord] +
+            (((blocker & bishopMask[cord]) * bishopMagic[cord] &
+              MAXBITBOARD) >> bishopShift[cord])]
 
     # Rooks and queens
     if board.variant in ASEAN_VARIANTS:
-        bitboard = pieces[ROOK] & _moveArray[ROOK][cord]
+        bitboard = pieces[ROOK]
     else:
-        bitboard = (pieces[ROOK] | pieces[QUEEN] | pieces[ELEPHANT]) & _moveArray[ROOK][cord]
-    # inlined iterBits()
-
-    # check whether or not there is a piece blocking the path in straight line
-    while bitboard:
-        bit = bitboard & -bitboard
-        c = lsb[bit]
-        ray = rayto[c]
-        if ray and not clearBit(ray & blocker, c):
-            bits |= bitPosArray[c]
-        bitboard -= bit
+        bitboard = pieces[ROOK] | pieces[QUEEN] | pieces[ELEPHANT]
+    bits |= bitboard & rookAttack[
+        rookOffset[cord] +
+        (((blocker & rookMask[cord]) * rookMagic[cord] &
+          MAXBITBOARD) >> rookShift[cord])]
 
     return bits
 
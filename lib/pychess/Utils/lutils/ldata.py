@@ -584,3 +584,96 @@ for r in reversed(range(A1, H1)):
     for cord in iterBits(ray135[r]):
         attack135[cord] = dict((map << 8 & MAXBITBOARD, ray << 8 & MAXBITBOARD)
                                for map, ray in attack135[cord + 8].items())
+
+################################################################################
+#  Magic bitboards                                                             #
+################################################################################
+
+# Sliding attacks are looked up in one flat list per piece type. For a cord,
+# the blockers on its relevant squares (its rays, less the board edge) are
+# multiplied by a magic number, so that the top bits of the product index the
+# attacks of every blocker set without collisions.
+# E.g. rookAttack[rookOffset[c] +
+#          (((blocker & rookMask[c]) * rookMagic[c] & MAXBITBOARD) >>
+#           rookShift[c])]
+# The magics were found by trying sparse random numbers, for our bit order
+# where A1 is the most significant bit.
+
+rookMagic = (
+    0x44400c2400804102, 0x0110421918009004, 0x0002001008048102, 0x4412000820041002,
+    0x8000200410000901, 0x010300404c302001, 0x0201020010802042, 0x0005104080012901,
+    0x0801a2c104208600, 0xe185000200040100, 0x0002040002008080, 0x4028008004000880,
+    0x1400810801100280, 0x10002000110a4100, 0x0000201001400140, 0x4040344000800280,
+    0x0000008400420001, 0x8104010002008080, 0x1060100420080140, 0x0020080004008080,
+    0x221800100080800c, 0x0010048120048012, 0x6000200050004001, 0x4480002000424000,
+    0x0500008042003104, 0x4417000401008200, 0x0060102008010440, 0x8040800400800800,
+    0x4801001001002008, 0x0cc0100084802000, 0x0020100040400020, 0x0840008050800028,
+    0x1609442200004081, 0x0104020080800100, 0xc042000280800400, 0xa840040080080080,
+    0x00002042000a0010, 0x802000a180100880, 0x2140400080201080, 0x0040005480002080,
+    0x0002020004008d61, 0x0040040088104102, 0x0010080140042010, 0x4080250011002800,
+    0x08a2020014200840, 0x22404200108a0020, 0x8008454000201001, 0x0080808000400028,
+    0x4001000100004cb2, 0x00a1004100020004, 0x8000800400800200, 0x0011000801001005,
+    0x8100808010000800, 0x0000801000200088, 0x1121002900400080, 0x5180800080400020,
+    0x0500004980220300, 0x0080008002000100, 0x0100020801000400, 0x0600201600045810,
+    0x1280100080060800, 0x2100200100084010, 0x0140400010002000, 0x0180022040001080,
+)
+
+bishopMagic = (
+    0x00c0680084808100, 0x8400888208821401, 0x0040400410720204, 0x0102100004104402,
+    0x1008020018840400, 0x0240044025080810, 0x0032402c01041080, 0x8041004042201000,
+    0x001021080d004600, 0x0804449004010020, 0x0000082008009198, 0x0010002202440208,
+    0x0000082222880200, 0x0014020201048000, 0x0012110108220100, 0x0004209c04201002,
+    0x0444080042560900, 0x0002840810908202, 0x0001104102004241, 0x0001010202004420,
+    0x002c004200800800, 0x022202060a000900, 0x00010c100d100200, 0x200a082404004108,
+    0x0030808105008c02, 0x0c41014c00071404, 0x0122080200104040, 0x0142008400420020,
+    0x002e010040040040, 0x0280180402020404, 0x000110028010040c, 0x1402021200409040,
+    0x008428820a228400, 0x0062240002009200, 0x2000404082011000, 0x0400488014002000,
+    0x8000808008020003, 0x0400208004010400, 0x0008600088020080, 0x0108092040100100,
+    0x0106100142021511, 0x0b08801048080802, 0x2000800108200210, 0x1004001280a00860,
+    0x0088000082004280, 0x0804018888020008, 0x4202040430040121, 0x4004102120145500,
+    0x0002221207240201, 0x0440040082082044, 0x0280060194200000, 0x2120040421100081,
+    0x9140244140800000, 0x0000298404048000, 0x0000201a22024100, 0xa00008181004c208,
+    0x0002028044108408, 0x0002010108400008, 0x2008229010201010, 0x004404200010200a,
+    0x0114042281081100, 0x03d02404a0220802, 0x0410040840802488, 0x0310021808042040,
+)
+
+
+def sliderMask(cord, raylist):
+    """ The squares of the rays in raylist, which may hold a blocker changing
+        the attacks from cord. The last square of a ray never does. """
+    mask = 0
+    for ray in raylist:
+        for c in iterBits(ray):
+            if fromToRay[cord][c] == ray:
+                mask |= ray & ~bitPosArray[c]
+    return mask
+
+
+rookMask = [sliderMask(cord, rays[cord][4:]) for cord in range(64)]
+bishopMask = [sliderMask(cord, rays[cord][:4]) for cord in range(64)]
+rookShift = [64 - bin(mask).count("1") for mask in rookMask]
+bishopShift = [64 - bin(mask).count("1") for mask in bishopMask]
+rookOffset = [0] * 64
+bishopOffset = [0] * 64
+rookAttack = []
+bishopAttack = []
+
+for cord in range(64):
+    for offset, attack, mask, magic, shift, attacks in (
+            (rookOffset, rookAttack, rookMask, rookMagic, rookShift,
+             ((attack00, ray00), (attack90, ray90))),
+            (bishopOffset, bishopAttack, bishopMask, bishopMagic, bishopShift,
+             ((attack45, ray45), (attack135, ray135)))):
+        offset[cord] = len(attack)
+        attack.extend([0] * (1 << 64 - shift[cord]))
+        # Walk all subsets of the mask
+        blocker = 0
+        while True:
+            index = offset[cord] + \
+                ((blocker * magic[cord] & MAXBITBOARD) >> shift[cord])
+            line = blocker | bitPosArray[cord]
+            attack[index] = reduce(or_, (a[cord][r[cord] & line]
+                                         for a, r in attacks))
+            blocker = (blocker - mask[cord]) & mask[cord]
+            if not blocker:
+                break
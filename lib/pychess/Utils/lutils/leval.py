@@ -205,7 +205,7 @@ def evalKingTropism(board, color, phase):
 # passed      bitboard of passed pawns
 # weaked      bitboard of weak pawns
 pawnEntryType = Struct('=H h Q Q')
-PAWN_HASH_SIZE = 16384
+PAWN_HASH_SIZE = 16384  # Number of entries, always a power of two
 PAWN_PHASE_KEY = (0x343d, 0x055d, 0x3d3c, 0x1a1c, 0x28aa, 0x19ee, 0x1538,
                   0x2a99)
 pawntable = create_string_buffer(PAWN_HASH_SIZE * pawnEntryType.size)
@@ -215,8 +215,17 @@ def clearPawnTable():
     memset(pawntable, 0, PAWN_HASH_SIZE * pawnEntryType.size)
 
 
+def setPawnHashSize(size):
+    """ Reallocate the (empty) pawn hash with room for size entries. size
+        must be a power of two. """
+    global PAWN_HASH_SIZE, pawntable
+    assert size > 0 and size & (size - 1) == 0
+    PAWN_HASH_SIZE = size
+    pawntable = create_string_buffer(PAWN_HASH_SIZE * pawnEntryType.size)
+
+
 def probePawns(board, phase):
-    index = (board.pawnhash % PAWN_HASH_SIZE) ^ PAWN_PHASE_KEY[phase - 1]
+    index = (board.pawnhash ^ PAWN_PHASE_KEY[phase - 1]) & (PAWN_HASH_SIZE - 1)
     key, score, passed, weaked = pawnEntryType.unpack_from(pawntable, index *
                                                            pawnEntryType.size)
     if key == (board.pawnhash >> 14) & 0xffff:
@@ -225,7 +234,7 @@ def probePawns(board, phase):
 
 
 def recordPawns(board, phase, score, passed, weaked):
-    index = (board.pawnhash % PAWN_HASH_SIZE) ^ PAWN_PHASE_KEY[phase - 1]
+    index = (board.pawnhash ^ PAWN_PHASE_KEY[phase - 1]) & (PAWN_HASH_SIZE - 1)
     key = (board.pawnhash >> 14) & 0xffff
     pawnEntryType.pack_into(pawntable, index * pawnEntryType.size, key, score,
                             passed, weaked)
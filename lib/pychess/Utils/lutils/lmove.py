@@ -12,7 +12,8 @@ from pychess.Utils.const import SAN, AN, LAN, ENPASSANT, EMPTY, PAWN, KING_CASTL
     LIGHTBRIGADECHESS, chrU2Sign, CASTLE_KR, CASTLE_SAN, QUEEN_PROMOTION, KNIGHT_PROMOTION, FAN, ASEAN_QUEEN, \
     HAWK_PROMOTION, HAWK_GATE, ELEPHANT_GATE, HAWK_GATE_AT_ROOK, ELEPHANT_GATE_AT_ROOK, GATINGS
 from pychess.Utils.repr import reprPiece, localReprSign
-from pychess.Utils.lutils.lmovegen import genAllMoves, genPieceMoves, newMove, gen_sittuyin_promotions
+from pychess.Utils.lutils.lmovegen import genAllMoves, genLegalMoves, genPieceMoves, newMove, \
+    gen_sittuyin_promotions
 
 
 def RANK(cord):
@@ -168,16 +169,20 @@ def toSAN(board, move, localRepr=False):
         board_clone = board.clone()
         board_clone.applyMove(move)
         sign = ""
-        if board_clone.isChecked():
+        if board_clone.isChecked() and board.variant != ATOMICCHESS:
+            sign = "#"
+            for altmove in genLegalMoves(board_clone):
+                sign = "+"
+                break
+        elif board_clone.isChecked():
             for altmove in genAllMoves(board_clone):
-                if board.variant == ATOMICCHESS:
-                    from pychess.Variants.atomic import kingExplode
-                    if kingExplode(board_clone, altmove, 1 - board_clone.color) and \
-                            not kingExplode(board_clone, altmove, board_clone.color):
-                        sign = "+"
-                        break
-                    elif kingExplode(board_clone, altmove, board_clone.color):
-                        continue
+                from pychess.Variants.atomic import kingExplode
+                if kingExplode(board_clone, altmove, 1 - board_clone.color) and \
+                        not kingExplode(board_clone, altmove, board_clone.color):
+                    sign = "+"
+                    break
+                elif kingExplode(board_clone, altmove, board_clone.color):
+                    continue
                 board_clone.applyMove(altmove)
                 if board_clone.opIsChecked():
                     board_clone.popMove()
@@ -236,17 +241,13 @@ def toSAN(board, move, localRepr=False):
         xs = []
         ys = []
 
-        board_clone = board.clone()
-        for altmove in genAllMoves(board_clone, drops=False):
+        for altmove in genLegalMoves(board, drops=False):
             mfcord = FCORD(altmove)
-            if board_clone.arBoard[mfcord] == fpiece and \
+            if board.arBoard[mfcord] == fpiece and \
                     mfcord != fcord and \
                     TCORD(altmove) == tcord:
-                board_clone.applyMove(altmove)
-                if not board_clone.opIsChecked():
-                    xs.append(FILE(mfcord))
-                    ys.append(RANK(mfcord))
-                board_clone.popMove()
+                xs.append(FILE(mfcord))
+                ys.append(RANK(mfcord))
 
         x = FILE(fcord)
         y = RANK(fcord)
@@ -1,7 +1,8 @@
 from .bitboard import bitPosArray, iterBits, clearBit, firstBit
 from .attack import isAttacked, pinnedOnKing, getAttacks
 from .ldata import fromToRay, moveArray, directions, fileBits, rankBits,\
-    ray45, attack45, ray135, attack135, ray90, attack90, ray00, attack00, FILE, rays
+    FILE, rays, MAXBITBOARD, rookAttack, rookOffset, rookMask, rookMagic, rookShift, \
+    bishopAttack, bishopOffset, bishopMask, bishopMagic, bishopShift
 from pychess.Utils.const import EMPTY, PAWN,\
     QUEEN, KNIGHT, BISHOP, ROOK, KING, HAWK, ELEPHANT, WHITE, BLACK,\
     SITTUYINCHESS, FISCHERRANDOMCHESS, SUICIDECHESS, GIVEAWAYCHESS, CAMBODIANCHESS,\
@@ -11,7 +12,7 @@ from pychess.Utils.const import EMPTY, PAWN,\
     ASEAN_QUEEN, ASEAN_BBISHOP, ASEAN_WBISHOP, NORMAL_MOVE, QUEEN_CASTLE, KING_CASTLE, ENPASSANT,\
     KNIGHT_PROMOTION, BISHOP_PROMOTION, ROOK_PROMOTION, QUEEN_PROMOTION, KING_PROMOTION, \
     DROP_VARIANTS, DROP, B_OOO, B_OO, W_OOO, W_OO, HAWK_PROMOTION, ELEPHANT_PROMOTION, \
-    HAWK_GATE, ELEPHANT_GATE, HAWK_GATE_AT_ROOK, ELEPHANT_GATE_AT_ROOK
+    HAWK_GATE, ELEPHANT_GATE, HAWK_GATE_AT_ROOK, ELEPHANT_GATE_AT_ROOK, GATINGS
 
 # The format of a move is as follows - from left:
 # 4 bits:  Descriping the type of the move
@@ -126,11 +127,9 @@ def genPieceMoves(board, piece, tcord):
         else:
             blocker = board.blocker
             for fcord in iterBits(bishops):
-                try:
-                    attackBoard = attack45[fcord][ray45[fcord] & blocker] | \
-                        attack135[fcord][ray135[fcord] & blocker]
-                except KeyError:
-                    attackBoard = 0
+                attackBoard = bishopAttack[bishopOffset[fcord] + (
+                    ((blocker & bishopMask[fcord]) * bishopMagic[fcord] & MAXBITBOARD) >>
+                    bishopShift[fcord])]
                 if tcord in iterBits(attackBoard & notfriends):
                     moves.add(newMove(fcord, tcord))
             return moves
@@ -139,11 +138,9 @@ def genPieceMoves(board, piece, tcord):
         blocker = board.blocker
         rooks = board.boards[board.color][ROOK]
         for fcord in iterBits(rooks):
-            try:
-                attackBoard = attack00[fcord][ray00[fcord] & blocker] | \
-                    attack90[fcord][ray90[fcord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = rookAttack[rookOffset[fcord] + (
+                ((blocker & rookMask[fcord]) * rookMagic[fcord] & MAXBITBOARD) >>
+                rookShift[fcord])]
             if tcord in iterBits(attackBoard & notfriends):
                 moves.add(newMove(fcord, tcord))
         return moves
@@ -168,19 +165,15 @@ def genPieceMoves(board, piece, tcord):
         else:
             blocker = board.blocker
             for fcord in iterBits(queens):
-                try:
-                    attackBoard = attack45[fcord][ray45[fcord] & blocker] | \
-                        attack135[fcord][ray135[fcord] & blocker]
-                except KeyError:
-                    attackBoard = 0
+                attackBoard = bishopAttack[bishopOffset[fcord] + (
+                    ((blocker & bishopMask[fcord]) * bishopMagic[fcord] & MAXBITBOARD) >>
+                    bishopShift[fcord])]
                 if tcord in iterBits(attackBoard & notfriends):
                     moves.add(newMove(fcord, tcord))
 
-                try:
-                    attackBoard = attack00[fcord][ray00[fcord] & blocker] | \
-                        attack90[fcord][ray90[fcord] & blocker]
-                except KeyError:
-                    attackBoard = 0
+                attackBoard = rookAttack[rookOffset[fcord] + (
+                    ((blocker & rookMask[fcord]) * rookMagic[fcord] & MAXBITBOARD) >>
+                    rookShift[fcord])]
                 if tcord in iterBits(attackBoard & notfriends):
                     moves.add(newMove(fcord, tcord))
             return moves
@@ -299,11 +292,9 @@ def genAllMoves(board, drops=True):
     if board.variant in ASEAN_VARIANTS:
         # Rooks
         for cord in iterBits(rooks):
-            try:
-                attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                    attack90[cord][ray90[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = rookAttack[rookOffset[cord] + (
+                ((blocker & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                rookShift[cord])]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
 
@@ -323,21 +314,17 @@ def genAllMoves(board, drops=True):
     else:
         # Rooks and Queens and Elephants
         for cord in iterBits(rooks | queens | elephants):
-            try:
-                attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                    attack90[cord][ray90[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = rookAttack[rookOffset[cord] + (
+                ((blocker & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                rookShift[cord])]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
 
         if board.variant == SCHESS and (holding[HAWK] > 0 or holding[ELEPHANT] > 0):
             for cord in iterBits((rooks | queens) & board.virgin[board.color]):
-                try:
-                    attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                        attack90[cord][ray90[cord] & blocker]
-                except KeyError:
-                    attackBoard = 0
+                attackBoard = rookAttack[rookOffset[cord] + (
+                    ((blocker & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                    rookShift[cord])]
                 for c in iterBits(attackBoard & notfriends):
                     if holding[HAWK] > 0:
                         yield newMove(cord, c, HAWK_GATE)
@@ -346,21 +333,17 @@ def genAllMoves(board, drops=True):
 
     # Bishops and Queens, Hawks
         for cord in iterBits(bishops | queens | hawks):
-            try:
-                attackBoard = attack45[cord][ray45[cord] & blocker] | \
-                    attack135[cord][ray135[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = bishopAttack[bishopOffset[cord] + (
+                ((blocker & bishopMask[cord]) * bishopMagic[cord] & MAXBITBOARD) >>
+                bishopShift[cord])]
             for c in iterBits(attackBoard & notfriends):
                 yield newMove(cord, c)
 
         if board.variant == SCHESS and (holding[HAWK] > 0 or holding[ELEPHANT] > 0):
             for cord in iterBits((bishops | queens) & board.virgin[board.color]):
-                try:
-                    attackBoard = attack45[cord][ray45[cord] & blocker] | \
-                        attack135[cord][ray135[cord] & blocker]
-                except KeyError:
-                    attackBoard = 0
+                attackBoard = bishopAttack[bishopOffset[cord] + (
+                    ((blocker & bishopMask[cord]) * bishopMagic[cord] & MAXBITBOARD) >>
+                    bishopShift[cord])]
                 for c in iterBits(attackBoard & notfriends):
                     if holding[HAWK] > 0:
                         yield newMove(cord, c, HAWK_GATE)
@@ -565,20 +548,16 @@ def genCaptures(board):
     # Rooks and Queens
     if board.variant in ASEAN_VARIANTS:
         for cord in iterBits(rooks):
-            try:
-                attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                    attack90[cord][ray90[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = rookAttack[rookOffset[cord] + (
+                ((blocker & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                rookShift[cord])]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
     else:
         for cord in iterBits(rooks | queens | elephants):
-            try:
-                attackBoard = attack00[cord][ray00[cord] & blocker] | \
-                    attack90[cord][ray90[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = rookAttack[rookOffset[cord] + (
+                ((blocker & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                rookShift[cord])]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
 
@@ -595,11 +574,9 @@ def genCaptures(board):
                 yield newMove(cord, c)
     else:
         for cord in iterBits(bishops | queens | hawks):
-            try:
-                attackBoard = attack45[cord][ray45[cord] & blocker] | \
-                    attack135[cord][ray135[cord] & blocker]
-            except KeyError:
-                attackBoard = 0
+            attackBoard = bishopAttack[bishopOffset[cord] + (
+                ((blocker & bishopMask[cord]) * bishopMagic[cord] & MAXBITBOARD) >>
+                bishopShift[cord])]
             for c in iterBits(attackBoard & enemies):
                 yield newMove(cord, c)
 
@@ -779,6 +756,88 @@ def genCheckEvasions(board):
         if not isAttacked(board, cord, opcolor):
             yield newMove(kcord, cord)
 
+    # The piece gated on the from square may block the check too
+    if board.variant == SCHESS and checkers:
+        for move in genAllMoves(board):
+            if move >> 12 in GATINGS:
+                yield move
+
+
+def genLegalMoves(board, drops=True):
+    """ Like genAllMoves(), but only yields the moves which don't leave our
+        king in check. Rather than making every move, moves are compared
+        with the rays of pieces pinned on our king and with the squares
+        which stop a check. """
+
+    if board.variant == SUICIDECHESS or board.variant == GIVEAWAYCHESS:
+        for move in genAllMoves(board, drops):
+            yield move
+        return
+
+    color = board.color
+    opcolor = 1 - color
+    kcord = board.kings[color]
+
+    if board.variant == ATOMICCHESS or kcord == -1:
+        # Explosions, or placing the king, are only seen by making the move
+        for move in genAllMoves(board, drops):
+            board.applyMove(move)
+            legal = not board.opIsChecked()
+            board.popMove()
+            if legal:
+                yield move
+        return
+
+    # The squares where other pieces than the king must move to
+    if board.isChecked():
+        checkers = getAttacks(board, kcord, opcolor)
+        if bin(checkers).count("1") == 1:
+            checkMask = checkers | fromToRay[kcord][firstBit(checkers)]
+        else:
+            checkMask = 0
+    else:
+        checkMask = MAXBITBOARD
+
+    # The squares each of our pieces may move to without exposing the king
+    pinMasks = {}
+    blocker = board.blocker
+
+    for move in genAllMoves(board, drops):
+        flag = move >> 12
+        fcord = (move >> 6) & 63
+        tcord = move & 63
+
+        if flag == DROP:
+            if bitPosArray[tcord] & checkMask:
+                yield move
+
+        elif fcord == kcord and flag == NORMAL_MOVE:
+            # The king mustn't hide behind itself from sliders
+            board.blocker = blocker & ~bitPosArray[kcord]
+            attacked = isAttacked(board, tcord, opcolor)
+            board.blocker = blocker
+            if not attacked:
+                yield move
+
+        elif fcord == kcord or flag == ENPASSANT or flag in GATINGS:
+            # Castling, gating and en passant change too much at once
+            board.applyMove(move)
+            legal = not board.opIsChecked()
+            board.popMove()
+            if legal:
+                yield move
+
+        elif bitPosArray[tcord] & checkMask:
+            pinMask = pinMasks.get(fcord)
+            if pinMask is None:
+                if pinnedOnKing(board, fcord, color):
+                    pinMask = rays[kcord][directions[kcord][fcord]]
+                else:
+                    pinMask = MAXBITBOARD
+                pinMasks[fcord] = pinMask
+            if bitPosArray[tcord] & pinMask:
+                yield move
+
 
 def genDrops(board):
     color = board.color
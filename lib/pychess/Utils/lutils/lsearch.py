@@ -26,6 +26,9 @@ nodes = 0
 endtime = 0
 timecheck_counter = TIMECHECK_FREQ
 egtb = None
+# Set by the helper processes of a parallel search (see lsmp.py), so the main
+# process can interrupt them without knowing their endtime
+stopEvent = None
 
 
 def alphaBeta(board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
@@ -112,9 +115,6 @@ def alphaBeta(board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
     ############################################################################
     # Look up transposition table                                              #
     ############################################################################
-    if ply == 0:
-        table.newSearch()
-
     table.setHashMove(depth, -1)
     probe = table.probe(board, depth, alpha, beta)
     if probe:
@@ -138,7 +138,7 @@ def alphaBeta(board, depth, alpha=-MATE_VALUE, beta=MATE_VALUE, ply=0):
 
     timecheck_counter -= 1
     if timecheck_counter == 0:
-        if time() > endtime:
+        if time() > endtime or (stopEvent is not None and stopEvent.is_set()):
             searching = False
         timecheck_counter = TIMECHECK_FREQ
 
@@ -294,7 +294,7 @@ def quiescent(board, alpha, beta, ply):
 
     timecheck_counter -= 1
     if timecheck_counter == 0:
-        if time() > endtime:
+        if time() > endtime or (stopEvent is not None and stopEvent.is_set()):
             searching = False
         timecheck_counter = TIMECHECK_FREQ
 
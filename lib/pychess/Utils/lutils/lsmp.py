@@ -0,0 +1,140 @@
+""" Lazy SMP parallel search.
+
+    Helper processes search the same root position as the main search, each
+    one at a staggered depth, and communicate only through a transposition
+    table in shared memory. The main process keeps doing its usual iterative
+    deepening and alone decides which move to play; it simply finds the table
+    filled with the helpers' results, which lets it reach deeper in the same
+    time. """
+
+import queue
+import sys
+import time
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils.ldata import MAXPLY
+from pychess.Utils.lutils.TranspositionTable import SharedTranspositionTable
+from pychess.System.Log import log
+
+# Seconds halt() waits for the helpers to stop, before terminating the ones
+# which didn't
+HALT_TIMEOUT = 5
+
+
+def shareTable():
+    """ Make sure lsearch uses a transposition table which helper processes
+        can attach to, keeping its size """
+    if not isinstance(lsearch.table, SharedTranspositionTable):
+        lsearch.table = SharedTranspositionTable(lsearch.table.maxSize)
+    return lsearch.table
+
+
+def _helper(index, jobs, done, stopEvent, nodes, table):
+    lsearch.table = table
+    lsearch.stopEvent = stopEvent
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        board, skipPruneChance = job
+        lsearch.skipPruneChance = skipPruneChance
+        lsearch.endtime = sys.maxsize
+        lsearch.searching = True
+        lsearch.nodes = 0
+        try:
+            # Half of the helpers start one ply deeper than the main search,
+            # so they don't all walk through the tree in lockstep with it
+            depth = 1 + (index + 1) % 2
+            while lsearch.searching and depth <= MAXPLY:
+                # Only the main search ages the table
+                table.loadSearch()
+                lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
+                lsearch.alphaBeta(board, depth)
+                nodes[index] = lsearch.nodes
+                depth += 1
+        finally:
+            # The nodes of the whole search, with the ones of the depth
+            # which was stopped
+            nodes[index] = lsearch.nodes
+            lsearch.searching = False
+            done.put(index)
+
+
+class HelperPool:
+    """ A set of helper processes sharing lsearch.table with the calling
+        process. start() makes them search a position until halt() is
+        called. """
+
+    def __init__(self, count):
+        self.table = shareTable()
+        self.count = count
+        self.stopEvent = multiprocessing.Event()
+        self.done = multiprocessing.Queue()
+        self.nodes = RawArray('Q', count)
+        self.jobs = [None] * count
+        self.processes = [None] * count
+        self.running = False
+        for index in range(count):
+            self.spawn(index)
+
+    def spawn(self, index):
+        jobs = multiprocessing.SimpleQueue()
+        process = multiprocessing.Process(
+            target=_helper,
+            name="PyChess helper %s" % index,
+            args=(index, jobs, self.done, self.stopEvent, self.nodes,
+                  self.table))
+        process.daemon = True
+        process.start()
+        self.jobs[index] = jobs
+        self.processes[index] = process
+
+    def start(self, board):
+        if self.running:
+            self.halt()
+        for index in range(self.count):
+            self.nodes[index] = 0
+        for jobs in self.jobs:
+            jobs.put((board, lsearch.skipPruneChance))
+        self.running = True
+
+    def halt(self):
+        """ Stop the helpers and wait until they are all idle again. The
+            helpers which died, or didn't stop within HALT_TIMEOUT seconds,
+            are terminated and replaced. """
+        if not self.running:
+            return
+        self.stopEvent.set()
+        searching = set(range(self.count))
+        deadline = time.monotonic() + HALT_TIMEOUT
+        while searching and time.monotonic() < deadline:
+            try:
+                searching.discard(self.done.get(timeout=0.1))
+            except queue.Empty:
+                if not any(self.processes[index].is_alive() for index in searching):
+                    break
+        for index in searching:
+            log.warning("Replacing helper %s which didn't stop" % index)
+            self.terminate(index)
+            self.spawn(index)
+        self.stopEvent.clear()
+        self.running = False
+
+    def terminate(self, index):
+        process = self.processes[index]
+        process.terminate()
+        process.join(HALT_TIMEOUT)
+
+    def getNodes(self):
+        return sum(self.nodes)
+
+    def close(self):
+        self.halt()
+        for jobs in self.jobs:
+            jobs.put(None)
+        for index, process in enumerate(self.processes):
+            process.join(HALT_TIMEOUT)
+            if process.is_alive():
+                self.terminate(index)
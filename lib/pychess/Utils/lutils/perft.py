@@ -1,9 +1,20 @@
-
+import multiprocessing
 from time import time
 
-from pychess.Utils.lutils.lmovegen import genAllMoves
+from pychess.Utils.const import CAMBODIANCHESS, DROP_VARIANTS
+from pychess.Utils.lutils.lmovegen import genAllMoves, genLegalMoves
 from pychess.Utils.lutils.lmove import toLAN
 
+# Subtree node counts of the fast perft, keyed by (board.hash, variant,
+# depth), as the variants share their start positions. Each process has its
+# own table, which is simply emptied when it gets full.
+perftTable = {}
+PERFT_TABLE_SIZE = 1 << 20
+
+# In these variants the moves also depend on state the board hash doesn't
+# cover (promoted pieces, first moves, gating squares or the ply count)
+UNHASHED_VARIANTS = DROP_VARIANTS + (CAMBODIANCHESS, )
+
 
 def do_perft(board, depth, root):
     nodes = 0
@@ -32,3 +43,77 @@ def perft(board, depth, root):
         ttime = time() - start_time
         print("%2d %10d %5.2f %12.2fnps" %
               (i + 1, nodes, ttime, nodes / ttime if ttime > 0 else nodes))
+
+
+def do_fast_perft(board, depth):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return sum(1 for move in genLegalMoves(board))
+
+    hashed = board.variant not in UNHASHED_VARIANTS
+    if hashed:
+        nodes = perftTable.get((board.hash, board.variant, depth))
+        if nodes is not None:
+            return nodes
+
+    nodes = 0
+    for move in genLegalMoves(board):
+        board.applyMove(move)
+        nodes += do_fast_perft(board, depth - 1)
+        board.popMove()
+
+    if hashed:
+        if len(perftTable) >= PERFT_TABLE_SIZE:
+            perftTable.clear()
+        perftTable[(board.hash, board.variant, depth)] = nodes
+    return nodes
+
+
+def _perftMove(args):
+    # Tasks sent together share one unpickled board, so leave it as we got it
+    board, move, depth = args
+    board.applyMove(move)
+    nodes = do_fast_perft(board, depth - 1)
+    board.popMove()
+    return nodes
+
+
+def divide(board, depth, pool=None):
+    """ Return the legal moves of board, each with its number of leaf nodes
+        at depth. The root moves are searched by pool, if given. """
+
+    moves = list(genLegalMoves(board))
+    if pool is not None:
+        counts = pool.map(_perftMove, [(board, move, depth) for move in moves])
+    else:
+        counts = [_perftMove((board, move, depth)) for move in moves]
+    return list(zip(moves, counts))
+
+
+def fast_perft(board, depth, root, processes=None):
+    """ Like perft(), but generating legal moves only, counting the last ply
+        without making its moves, caching subtree counts in perftTable and
+        splitting the root moves across processes. With root > 0 the counts
+        of the root moves are printed. """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        for i in range(depth):
+            start_time = time()
+            # Shallow depths are not worth sending to the pool
+            counts = divide(board, i + 1, pool if i >= 2 else None)
+            nodes = 0
+            for move, count in counts:
+                nodes += count
+                if root > 0:
+                    print("%8s %10d %10d" % (toLAN(board, move), count, nodes))
+            ttime = time() - start_time
+            print("%2d %10d %5.2f %12.2fnps" %
+                  (i + 1, nodes, ttime, nodes / ttime if ttime > 0 else nodes))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
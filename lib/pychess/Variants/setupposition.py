@@ -18,6 +18,9 @@ class SetupBoard(Board):
     PROMOTION_ZONE = ((), ())
     PROMOTIONS = ()
 
+    # Clones skip __init__
+    _ply = 0
+
     def __init__(self, setup=True, lboard=None):
         if setup is True:
             fenstr = SETUPSTART
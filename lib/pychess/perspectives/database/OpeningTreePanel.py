@@ -24,7 +24,7 @@ class OpeningTreePanel(Gtk.TreeView):
 
         self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 
-        self.liststore = Gtk.ListStore(int, str, int, int)
+        self.liststore = Gtk.ListStore(int, str, int, int, int)
         self.modelsort = Gtk.TreeModelSort(self.liststore)
 
         self.modelsort.set_sort_column_id(2, Gtk.SortType.DESCENDING)
@@ -48,6 +48,11 @@ class OpeningTreePanel(Gtk.TreeView):
         column.connect("clicked", self.column_clicked, 3)
         self.append_column(column)
 
+        column = Gtk.TreeViewColumn(_("Avg Elo"), Gtk.CellRendererText(), text=4)
+        column.set_sort_column_id(4)
+        column.connect("clicked", self.column_clicked, 4)
+        self.append_column(column)
+
         self.conid = self.connect_after("row-activated", self.row_activated)
 
         self.board = LBoard()
@@ -88,12 +93,12 @@ class OpeningTreePanel(Gtk.TreeView):
         self.update_tree()
 
     def on_first_clicked(self, widget):
-        while self.board.hist_move:
+        while self.board.history is not None:
             self.board.popMove()
         self.update_tree()
 
     def on_prev_clicked(self, widget):
-        if self.board.hist_move:
+        if self.board.history is not None:
             self.board.popMove()
         self.update_tree()
 
@@ -102,7 +107,7 @@ class OpeningTreePanel(Gtk.TreeView):
         if not self.filtered:
             self.persp.filter_panel.filterButton.set_sensitive(True)
             self.filtered = True
-            while self.board.hist_move:
+            while self.board.history is not None:
                 self.board.popMove()
             self.update_tree()
             self.filtered = False
@@ -126,10 +131,10 @@ class OpeningTreePanel(Gtk.TreeView):
 
         result = self.persp.chessfile.get_book_moves(self.board.asFen())
         self.clear_tree()
-        for move, count, white_won, blackwon, draw in result:
+        for move, count, white_won, blackwon, draw, elo in result:
             lmove = parseAN(self.board, move)
             perf = 0 if not count else round((white_won * 100. + draw * 50.) / count)
-            self.liststore.append([lmove, toSAN(self.board, lmove), count, perf])
+            self.liststore.append([lmove, toSAN(self.board, lmove), count, perf, elo])
 
     def clear_tree(self):
         selection = self.get_selection()
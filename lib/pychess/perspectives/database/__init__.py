@@ -1,16 +1,11 @@
 import asyncio
 import os
 import threading
-from struct import pack
 
 from gi.repository import Gtk, GObject, GLib
 
-from pychess.Utils.const import FIRST_PAGE, NEXT_PAGE, FEN_START, DRAW, WHITEWON, BLACKWON  # , reprCord
+from pychess.Utils.const import FIRST_PAGE, NEXT_PAGE
 from pychess.Utils.IconLoader import load_icon
-from pychess.Utils.lutils.LBoard import LBoard
-from pychess.Utils.lutils.lmove import toPolyglot  # , FCORD, TCORD
-from pychess.Utils.GameModel import GameModel
-from pychess.Variants import name2variant, NormalBoard
 from pychess.perspectives import Perspective, perspective_manager, panel_name
 from pychess.perspectives.database.gamelist import GameList
 from pychess.perspectives.database.OpeningTreePanel import OpeningTreePanel
@@ -24,9 +19,11 @@ from pychess.widgets import gamewidget
 from pychess.Database.model import create_indexes, drop_indexes
 from pychess.Database.PgnImport import PgnImport, download_file
 from pychess.Database.JvR import JvR
+from pychess.Database.BookBuilder import build_book
 from pychess.Savers import fen, epd, olv
 from pychess.Savers.pgn import PGNFile
 from pychess.System import conf
+from pychess.System.compressed import DECOMPRESSORS, is_compressed
 from pychess.System.protoopen import protoopen
 
 pgn_icon = load_icon(24, "application-x-chess-pgn", "pychess")
@@ -214,7 +211,8 @@ class Database(GObject.GObject, Perspective):
                     filename = filename[:len(filename) - len(ext)] + ".pgn"
 
             # Processing by file extension
-            if filename.endswith(".pgn"):
+            if filename.endswith(".pgn") or is_compressed(filename) and \
+                    os.path.splitext(filename)[0].endswith(".pgn"):
                 GLib.idle_add(self.progressbar.show)
                 GLib.idle_add(self.progressbar.set_text, _("Opening chessfile..."))
                 chessfile = PGNFile(protoopen(filename), self.progressbar)
@@ -227,6 +225,7 @@ class Database(GObject.GObject, Perspective):
                 else:
                     chessfile.init_scoutfish()
                     chessfile.init_chess_db()
+                    chessfile.init_position_index()
             elif filename.endswith(".epd"):
                 self.importer = None
                 chessfile = epd.load(protoopen(filename))
@@ -418,6 +417,12 @@ class Database(GObject.GObject, Perspective):
         filter_text.add_mime_type("application/x-chess-pgn")
         dialog.add_filter(filter_text)
 
+        filter_text = Gtk.FileFilter()
+        filter_text.set_name(".pgn.gz .pgn.bz2 .pgn.xz .pgn.zst")
+        for ext in DECOMPRESSORS:
+            filter_text.add_pattern("*.pgn%s" % ext)
+        dialog.add_filter(filter_text)
+
         filter_text = Gtk.FileFilter()
         filter_text.set_name(".zip")
         filter_text.add_pattern("*.zip")
@@ -444,6 +449,9 @@ class Database(GObject.GObject, Perspective):
     def importing(self, filenames):
         drop_indexes(self.chessfile.engine)
 
+        # Games are appended, so only the ones from here on need indexing
+        start = self.chessfile.size
+
         self.importer = PgnImport(self.chessfile, append_pgn=True)
         self.importer.initialize()
         for i, filename in enumerate(filenames):
@@ -461,6 +469,8 @@ class Database(GObject.GObject, Perspective):
 
         # .sqlite
         create_indexes(self.chessfile.engine)
+        self.chessfile.classify_openings(start)
+        self.chessfile.set_indexed_size(".sqlite", start)
 
         # .scout
         self.chessfile.init_scoutfish()
@@ -468,6 +478,9 @@ class Database(GObject.GObject, Perspective):
         # .bin
         self.chessfile.init_chess_db()
 
+        # .pos .tree
+        self.chessfile.init_position_index()
+
         self.chessfile.set_tag_filter(None)
         self.chessfile.set_fen_filter(None)
         self.chessfile.set_scout_filter(None)
@@ -525,18 +538,26 @@ class Database(GObject.GObject, Perspective):
         self.progress_dialog.set_title(_("Create Polyglot Book"))
 
         def creating_book(cancel_event):
-            positions = {}
-            self.process_records(self.feed_book, cancel_event, positions)
-
-            if cancel_event.is_set():
+            offsets = None
+            chessfile = self.chessfile
+            if chessfile.tag_query or chessfile.fen or chessfile.scout_query:
+                # Only the games of the filtered game list
+                offsets = []
+                self.process_records(lambda records: offsets.extend(rec["Offset"] for rec in records),
+                                     cancel_event)
+                if cancel_event.is_set():
+                    return
+
+            # Variant games can't be in polyglot books
+            GLib.idle_add(self.progressbar.set_text, _("Counting the moves of the normal chess games"))
+            done = build_book(
+                chessfile.path, new_bin, conf.get("book_depth_max"),
+                min_games=conf.get("book_min_games"), min_score=conf.get("book_min_score"),
+                cancel_event=cancel_event, offsets=offsets,
+                progress=lambda fraction: GLib.idle_add(self.progressbar.set_fraction, fraction))
+            if not done:
                 return
 
-            with open(new_bin, "wb") as to_file:
-                GLib.idle_add(self.progressbar.set_text, _("Save"))
-                for key, moves in sorted(positions.items(), key=lambda item: item[0]):
-                    # print(key, moves)
-                    for move in moves:
-                        to_file.write(pack(">QHHI", key, move, moves[move], 0))
             GLib.idle_add(self.emit, "bookfile_created")
             GLib.idle_add(self.progress_dialog.hide)
 
@@ -549,61 +570,6 @@ class Database(GObject.GObject, Perspective):
             cancel_event.set()
         self.progress_dialog.hide()
 
-    def feed_book(self, records, positions):
-        BOOK_DEPTH_MAX = conf.get("book_depth_max")
-
-        for rec in records:
-            model = GameModel()
-
-            if rec["Result"] == DRAW:
-                score = (1, 1)
-            elif rec["Result"] == WHITEWON:
-                score = (2, 0)
-            elif rec["Result"] == BLACKWON:
-                score = (0, 2)
-            else:
-                score = (0, 0)
-
-            fenstr = rec["FEN"]
-            variant = self.chessfile.get_variant(rec)
-
-            if variant:
-                model.variant = name2variant[variant]
-                board = LBoard(model.variant.variant)
-            else:
-                model.variant = NormalBoard
-                board = LBoard()
-
-            if fenstr:
-                try:
-                    board.applyFen(fenstr)
-                except SyntaxError:
-                    continue
-            else:
-                board.applyFen(FEN_START)
-
-            boards = [board]
-
-            movetext = self.chessfile.get_movetext(rec)
-            boards = self.chessfile.parse_movetext(movetext, boards[0], -1)
-
-            for board in boards:
-                if board.plyCount > BOOK_DEPTH_MAX:
-                    break
-                move = board.lastMove
-                if move is not None:
-                    poly_move = toPolyglot(board.prev, move)
-                    # move_str = "%s%s" % (reprCord[FCORD(move)], reprCord[TCORD(move)])
-                    # print("%0.16x" % board.prev.hash, poly_move, board.prev.asFen(), move_str)
-                    if board.prev.hash in positions:
-                        if poly_move in positions[board.prev.hash]:
-                            positions[board.prev.hash][poly_move] += score[board.prev.color]
-                        else:
-                            positions[board.prev.hash][poly_move] = score[board.prev.color]
-                    else:
-                        # board.prev.asFen(), move_str,
-                        positions[board.prev.hash] = {poly_move: score[board.prev.color]}
-
     def create_database(self):
         dialog = Gtk.FileChooserDialog(
             _("Create New Pgn Database"), mainwindow(), Gtk.FileChooserAction.SAVE,
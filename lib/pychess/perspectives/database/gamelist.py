@@ -16,7 +16,7 @@ from pychess.Savers import pgn
 
 
 cols = (game.c.id, pl1.c.name, game.c.white_elo, pl2.c.name, game.c.black_elo,
-        game.c.result, game.c.date, event.c.name, site.c.name, game.c.round,
+        game.c.result, game.c.date_key, event.c.name, site.c.name, game.c.round,
         game.c.ply_count, game.c.eco, game.c.time_control, game.c.variant, game.c.fen)
 
 
@@ -145,8 +145,8 @@ class GameList(Gtk.TreeView):
             offs = rec["Offset"]
             wname = rec["White"]
             bname = rec["Black"]
-            welo = rec["WhiteElo"]
-            belo = rec["BlackElo"]
+            welo = str(rec["WhiteElo"]) if rec["WhiteElo"] else ""
+            belo = str(rec["BlackElo"]) if rec["BlackElo"] else ""
             result = rec["Result"]
             result = "½-½" if result == DRAW else reprResult[result] if result else "*"
             event = "" if rec["Event"] is None else rec["Event"].replace("?", "")
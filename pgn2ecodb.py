@@ -25,7 +25,9 @@ import sqlite3
 from pychess.Savers.pgn import load
 from pychess.System.protoopen import protoopen
 from pychess.System.prefix import addDataPrefix
+from pychess.Utils.const import FEN_START
 from pychess.Utils.eco import ECO_MAIN_LANG, ECO_LANGS
+from pychess.Utils.lutils.LBoard import LBoard
 from pychess.Variants.fischerandom import FischerandomBoard
 
 
@@ -47,25 +49,21 @@ if __name__ == '__main__':
         # Load the ECO file first
         print('  - Parsing')
         cf = load(protoopen(pgnfile))
-        cf.limit = 5000
-        cf.init_tag_database()
-        records, plys = cf.get_records()
 
         # Cache the content
         entries = []
         plyMax = 0
         old_eco = ""
-        for rec in records:
-            model = cf.loadToModel(rec)
-            eco = '' if rec['ECO'] is None else rec['ECO']
+        for tags, moves, hashes in cf.iter_games(fields=("ECO", "Opening", "Variation", "FEN")):
+            eco = tags['ECO'][:3]
             entry = {'h': [],                                               # Hashes
                      'f': '',                                               # Final hash of the line
                      'n': [],                                               # FENs
                      'm': old_eco != eco,                                   # Main line = shortest sequence of moves for the ECO code. The 'EN' ECO file is specially crafted
                      'e': eco,                                              # ECO
-                     'o': '' if rec['White'] is None else rec['White'],     # Opening
-                     'v': '' if rec['Black'] is None else rec['Black'],     # Variation
-                     'p': len(model.moves)}                                 # Number of plies
+                     'o': tags['Opening'],                                  # Opening
+                     'v': tags['Variation'],                                # Variation
+                     'p': len(moves)}                                       # Number of plies
             plyMax = max(plyMax, entry['p'])
 
             # No move means that we are translating the name of the ECO code, so we need to find all the related positions from another language
@@ -81,12 +79,14 @@ if __name__ == '__main__':
                     entry['n'].append(row[2])
             else:
                 # Find the Polyglot hash for each position of the opening
-                for i in range(entry['p']):
-                    nextboard = model.getBoardAtPly(i, 0).board.next
-                    h = hex(nextboard.hash)[2:]
+                board = LBoard()
+                board.applyFen(tags['FEN'] or FEN_START)
+                for move, key in zip(moves, hashes[1:]):
+                    board.applyMove(move)
+                    h = hex(key)[2:]
                     entry['h'].append(h)
                     entry['f'] = h
-                    entry['n'].append(nextboard.asFen())
+                    entry['n'].append(board.asFen())
             entries.append(entry)
             old_eco = entry['e']
         print('  - Max ply : %d' % plyMax)
@@ -110,6 +110,7 @@ if __name__ == '__main__':
                     c.execute("insert into openings (hash, hkey, mainline, endline, eco, lang, opening, variation, fen) values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
                               (h, hkey, int(entry['m']), int(h == entry['f']), entry['e'], lang, entry['o'], entry['v'], entry['n'][i]))
         conn.commit()
+        cf.close()
         print('\n  - Processed %d openings' % len(entries))
 
     # Several eco lists contain only eco+name pairs
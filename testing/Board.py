@@ -25,6 +25,21 @@ class BoardTestCase(unittest.TestCase):
         self.assertEqual(board[Cord(G8)].piece, Piece(BLACK, KING).piece)
         self.assertEqual(board[Cord(F8)].piece, Piece(BLACK, ROOK).piece)
 
+    def test2(self):
+        """ Testing Board.clone() sharing Piece objects but not squares """
+        board = Board(setup=True)
+        clone = board.clone()
+
+        self.assertIs(clone.board.pieceBoard, clone)
+        self.assertIsNot(clone.board, board.board)
+        self.assertIs(clone[Cord(D2)], board[Cord(D2)])
+        self.assertEqual(clone.asFen(), board.asFen())
+
+        clone[Cord(D4)] = clone[Cord(D2)]
+        clone[Cord(D2)] = None
+        self.assertIsNone(board[Cord(D4)])
+        self.assertIsNotNone(board[Cord(D2)])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from pychess.Utils.const import FEN_START, hashfEXACT
+from pychess.Utils.lutils import leval, lsearch
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.Benchmark import runSuite, compare
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test1(self):
+        """Testing benchmark suite results"""
+
+        nodes = lsearch.nodes
+        table, pawntable = lsearch.table, leval.pawntable
+        board = LBoard()
+        board.applyFen(FEN_START)
+        table.record(board, 1234, 56, hashfEXACT, 4)
+        results = runSuite(maxdepth=2, perftdepth=2, variantList=["NormalBoard", "CrazyhouseBoard"],
+                           mintime=0)
+        self.assertEqual(lsearch.nodes, nodes)
+        # The tables of the engine are kept, with their entries
+        self.assertIs(lsearch.table, table)
+        self.assertIs(leval.pawntable, pawntable)
+        self.assertEqual(table.probe(board, 4, -100, 100), (1234, 56, hashfEXACT))
+
+        # Results must survive saving as a JSON baseline
+        results = json.loads(json.dumps(results))
+        self.assertEqual(sorted(results["variants"]), ["CrazyhouseBoard", "NormalBoard"])
+        self.assertEqual(sorted(results["search"]["time_to_depth"]), ["1", "2"])
+        self.assertEqual(results["perft"]["perft"]["nodes"], 400 + 2039)
+        self.assertEqual(results["perft"]["fastperft"]["nodes"], 400 + 2039)
+        self.assertEqual(compare(results, results), [])
+
+    def test2(self):
+        """Testing benchmark comparison against a baseline"""
+
+        baseline = {"search": {"nps": 1000.0, "nodes": 500, "time_to_depth": {"1": 1.0}},
+                    "variants": {"NormalBoard": {"eval_per_s": 100.0}}}
+        results = {"search": {"nps": 950.0, "nodes": 10, "time_to_depth": {"1": 1.5}},
+                   "variants": {"NormalBoard": {"eval_per_s": 50.0}}}
+        self.assertEqual(compare(results, baseline),
+                         [("search/time_to_depth/1", 1.0, 1.5),
+                          ("variants/NormalBoard/eval_per_s", 100.0, 50.0)])
+        self.assertEqual(len(compare(results, baseline, tolerance=0.01)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
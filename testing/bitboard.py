@@ -5,6 +5,19 @@ import operator
 from functools import reduce
 
 from pychess.Utils.lutils.bitboard import setBit, clearBit, firstBit, lastBit, iterBits
+from pychess.Utils.lutils.ldata import rays, fromToRay, MAXBITBOARD, \
+    rookAttack, rookOffset, rookMask, rookMagic, rookShift, \
+    bishopAttack, bishopOffset, bishopMask, bishopMagic, bishopShift
+
+
+def slowAttacks(cord, blocker, raylist):
+    attacks = 0
+    for ray in raylist:
+        # The nearest blocker has the shortest way from cord
+        blockers = sorted(iterBits(ray & blocker),
+                          key=lambda c: bin(fromToRay[cord][c]).count("1"))
+        attacks |= fromToRay[cord][blockers[0]] if blockers else ray
+    return attacks
 
 
 class BitboardTestCase(unittest.TestCase):
@@ -52,6 +65,23 @@ class BitboardTestCase(unittest.TestCase):
             itered = sorted(iterBits(board))
             self.assertEqual(positions, itered)
 
+    def test4(self):
+        """Testing magic bitboard sliding attacks"""
+
+        for positions, board in self.positionSets:
+            for cord in range(64):
+                attacks = rookAttack[rookOffset[cord] + (
+                    ((board & rookMask[cord]) * rookMagic[cord] & MAXBITBOARD) >>
+                    rookShift[cord])]
+                self.assertEqual(attacks,
+                                 slowAttacks(cord, board, rays[cord][4:]))
+
+                attacks = bishopAttack[bishopOffset[cord] + (
+                    ((board & bishopMask[cord]) * bishopMagic[cord] & MAXBITBOARD) >>
+                    bishopShift[cord])]
+                self.assertEqual(attacks,
+                                 slowAttacks(cord, board, rays[cord][:4]))
+
 
 if __name__ == '__main__':
     unittest.main()
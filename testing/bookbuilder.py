@@ -0,0 +1,144 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from io import StringIO
+
+from pychess.Database import BookBuilder as book_builder
+from pychess.Database.BookBuilder import build_book, book_entries, BOOK_ENTRY, MOVE_ENTRY
+from pychess.Database.PgnImport import pgn2Const, parse_variant, scan_games
+from pychess.Database.PositionIndex import read_run
+from pychess.Savers.pgn import load
+from pychess.Utils.const import FEN_START, WHITE, WHITEWON, BLACKWON, DRAW
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import toPolyglot
+
+from pgnfiles import join_gamefiles
+
+DEPTH = 13
+
+
+class BookBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join_gamefiles(self.tmpdir)
+        self.book_path = os.path.join(self.tmpdir, "games.bin")
+
+        # (offset, result, FEN, moves) of the normal chess games
+        self.games = []
+        with open(self.path, "rb") as f:
+            data = f.read()
+        pgnfile = load(StringIO(data.decode("latin_1")))
+        # The offsets of the games in the file, like the tag database has
+        offsets = [tags["offset"] for tags in scan_games(data)]
+        for offset, (tags, moves, hashes) in zip(offsets, pgnfile.iter_games()):
+            if parse_variant(tags)[0] == 0:
+                self.games.append((offset, pgn2Const.get(tags["Result"]), tags["FEN"], moves))
+        self.moves = self.count_moves(self.games)
+
+    def count_moves(self, games):
+        """ (hash, polyglot move): [games, points] of the moves of games """
+
+        counts = {}
+        for offset, result, fen, moves in games:
+            board = LBoard()
+            board.applyFen(fen or FEN_START)
+            for move in moves:
+                if board.plyCount >= DEPTH:
+                    break
+                entry = counts.setdefault((board.hash, toPolyglot(board, move)), [0, 0])
+                entry[0] += 1
+                if result == DRAW:
+                    entry[1] += 1
+                elif result == (WHITEWON if board.color == WHITE else BLACKWON):
+                    entry[1] += 2
+                board.applyMove(move)
+        return counts
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_book(self):
+        return list(read_run(self.book_path, BOOK_ENTRY))
+
+    def test1(self):
+        """Testing building polyglot books in parts and of compressed files"""
+
+        expected = [(key, move, points, 0) for (key, move), (games, points) in self.moves.items()]
+        expected.sort(key=lambda entry: (entry[0], -entry[2], -entry[1]))
+
+        part_size, run_size = book_builder.PART_SIZE, book_builder.RUN_SIZE
+        book_builder.PART_SIZE, book_builder.RUN_SIZE = 4096, 100
+        try:
+            progress = []
+            self.assertTrue(build_book(self.path, self.book_path, DEPTH, processes=2, progress=progress.append))
+            self.assertEqual(self.read_book(), expected)
+            self.assertGreater(len(progress), 2)
+            self.assertEqual(progress[-1], 1)
+
+            gz_path = self.path + ".gz"
+            with open(self.path, "rb") as f, open(gz_path, "wb") as gz_file:
+                gz_file.write(gzip.compress(f.read()))
+            os.remove(self.book_path)
+            self.assertTrue(build_book(gz_path, self.book_path, DEPTH))
+            self.assertEqual(self.read_book(), expected)
+
+            cancel_event = threading.Event()
+            cancel_event.set()
+            self.assertFalse(build_book(self.path, self.book_path + "2", DEPTH, cancel_event=cancel_event))
+            self.assertFalse(os.path.exists(self.book_path + "2"))
+            self.assertEqual(sorted(os.listdir(self.tmpdir)), ["games.bin", "games.pgn", "games.pgn.gz"])
+        finally:
+            book_builder.PART_SIZE, book_builder.RUN_SIZE = part_size, run_size
+
+    def test2(self):
+        """Testing filtering and weighting the moves of polyglot books"""
+
+        build_book(self.path, self.book_path, DEPTH, min_games=2, min_score=50)
+        book = self.read_book()
+        self.assertGreater(len(book), 0)
+        for key, move, weight, learn in book:
+            games, points = self.moves[(key, move)]
+            self.assertGreaterEqual(games, 2)
+            self.assertGreaterEqual(points, games)
+            self.assertEqual(weight, points)
+        self.assertEqual(len(book), len([1 for games, points in self.moves.values() if games >= 2 and points >= games]))
+
+        moves = [(1, 10, 50000, 100000), (1, 20, 40000, 30000), (1, 30, 1, 0), (2, 10, 3, 4)]
+        self.assertEqual(list(book_entries(iter(moves))),
+                         [(1, 10, 0xffff, 0), (1, 20, 30000 * 0xffff // 100000, 0), (1, 30, 0, 0), (2, 10, 4, 0)])
+        self.assertEqual(list(book_entries(iter(moves), min_games=2, min_score=40)),
+                         [(1, 10, 0xffff, 0), (2, 10, 4, 0)])
+        self.assertEqual(MOVE_ENTRY.size, 18)
+
+    def test3(self):
+        """Testing polyglot books of some games of the file"""
+
+        games = self.games[::2]
+        expected = [(key, move, points, 0) for (key, move), (count, points) in self.count_moves(games).items()]
+        expected.sort(key=lambda entry: (entry[0], -entry[2], -entry[1]))
+        # Variant games at the offsets are left out anyway
+        offsets = [offset for offset, result, fen, moves in games] + [0]
+
+        part_size = book_builder.PART_SIZE
+        book_builder.PART_SIZE = 4096
+        try:
+            self.assertTrue(build_book(self.path, self.book_path, DEPTH, processes=2, offsets=offsets))
+            self.assertEqual(self.read_book(), expected)
+        finally:
+            book_builder.PART_SIZE = part_size
+
+        gz_path = self.path + ".gz"
+        with open(self.path, "rb") as f, open(gz_path, "wb") as gz_file:
+            gz_file.write(gzip.compress(f.read()))
+        self.assertTrue(build_book(gz_path, self.book_path, DEPTH, offsets=offsets))
+        self.assertEqual(self.read_book(), expected)
+
+        self.assertTrue(build_book(self.path, self.book_path, DEPTH, offsets=[]))
+        self.assertEqual(self.read_book(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
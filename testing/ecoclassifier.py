@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import select
+
+from pychess.Database.EcoClassifier import classify_game, classify_file
+from pychess.Database.model import game
+from pychess.Savers.pgn import load
+from pychess.System.protoopen import protoopen
+from pychess.Utils import eco
+from pychess.Utils.const import FEN_START
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parseSAN
+
+# (moves, ECO code, ends an ECO line)
+LINES = (
+    ("e4", "B00", 1),
+    ("e4 e5", "C20", 1),
+    ("e4 e5 Nf3", "C40", 0),
+    ("e4 e5 Nf3 Nc6", "C44", 1),
+    ("e4 e5 Nf3 Nc6 Bb5", "C60", 1),
+)
+
+GAMES = (
+    # (ECO tag, movetext, stored ECO code)
+    ("", "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Ba4 *", "C60"),
+    ("", "1. e4 e5 2. Nf3 Nf6 3. Nxe5 *", "C20"),
+    ("C50", "1. e4 e5 *", "C50"),
+    ("", "1. d4 d5 *", ""),
+    ("", "1. Nf3 Nc6 2. e4 e5 *", ""),
+    ("", "1. e4 {comment} (1. d4) 1... e5 2. Nf3 *", "C20"),
+)
+
+
+def hashes_of(moves):
+    board = LBoard()
+    board.applyFen(FEN_START)
+    hashes = []
+    for san in moves.split():
+        board.applyMove(parseSAN(board, san))
+        hashes.append(board.hash)
+    return hashes
+
+
+class EcoClassifierTestCase(unittest.TestCase):
+    def setUp(self):
+        # eco.db may be missing, so the openings are the ones of LINES
+        self.saved = (eco.ECO_OK, eco.openings, eco.lang)
+        table = {}
+        for moves, code, endline in LINES:
+            table[hashes_of(moves)[-1]] = (code, "Opening %s" % code, "", endline)
+        eco.ECO_OK = True
+        eco.openings = {eco.ECO_MAIN_LANG: table}
+        eco.lang = eco.ECO_MAIN_LANG
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "games.pgn")
+        with open(self.path, "w") as f:
+            for i, (code, movetext, stored) in enumerate(GAMES):
+                f.write('[Event "Game %d"]\n[Result "*"]\n' % i)
+                if code:
+                    f.write('[ECO "%s"]\n' % code)
+                f.write("\n%s\n\n" % movetext)
+
+    def tearDown(self):
+        eco.ECO_OK, eco.openings, eco.lang = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_eco(self):
+        """Testing the lookup of positions in the openings"""
+
+        e4e5, e4e5nf3 = hashes_of("e4 e5 Nf3")[1:]
+        self.assertEqual(eco.get_eco(e4e5)[0], "C20")
+        self.assertIsNone(eco.get_eco(e4e5nf3))
+        self.assertEqual(eco.get_eco(e4e5nf3, exactPosition=False)[0], "C40")
+        self.assertIsNone(eco.get_eco(hashes_of("d4")[0]))
+
+    def test_classify(self):
+        """Testing the deepest opening of games"""
+
+        self.assertEqual(eco.classify(hashes_of("e4 e5 Nf3 Nc6 Bb5 a6"))[0], "C60")
+        self.assertEqual(eco.classify(hashes_of("e4 e5 Nf3"))[0], "C20")
+        self.assertIsNone(eco.classify(hashes_of("d4 d5")))
+        self.assertIsNone(eco.classify([]))
+
+        # Transpositions are found unless the search stops out of the lines
+        transposition = hashes_of("Nf3 Nc6 e4 e5")
+        self.assertEqual(eco.classify(transposition)[0], "C44")
+        self.assertIsNone(eco.classify(transposition, within_lines=True))
+
+        for code, movetext, stored in GAMES[:2]:
+            self.assertEqual(classify_game(movetext)[0][0], stored)
+        self.assertEqual(classify_game("1. e4 e5 2. Qh5 Kxe1 *")[0][0], "C20")
+
+    def test_classify_lang(self):
+        """Testing the openings ending lines only in the language of the user"""
+
+        # The German lines go deeper than the English ones
+        table = {}
+        for moves, code, endline in (("e4 e5 Nf3", "C40", 1), ("e4 e5 Nf3 d6", "C41", 0),
+                                     ("e4 e5 Nf3 d6 d4", "C41", 1)):
+            table[hashes_of(moves)[-1]] = (code, "Eröffnung %s" % code, "", endline)
+        eco.openings["de"] = table
+        eco.lang = "de"
+
+        self.assertEqual(eco.classify(hashes_of("e4 e5 Nf3 d6"))[1], "Eröffnung C40")
+        self.assertEqual(eco.classify(hashes_of("e4 e5 Nf3 d6 d4 exd4"), within_lines=True)[1], "Eröffnung C41")
+        self.assertEqual(eco.classify(hashes_of("e4 e5 Nf3 Nc6 Bb5"))[1], "Opening C60")
+
+    def test_classify_file(self):
+        """Testing the ECO codes found for the games of a .pgn file"""
+
+        openings = classify_file(self.path, processes=1)
+        expected = [stored for code, movetext, stored in GAMES if stored and not code]
+        self.assertEqual([code for offset, code in openings], expected)
+
+        # Only the games from start on
+        self.assertEqual(classify_file(self.path, start=openings[1][0], processes=1), openings[1:])
+
+    def test_store(self):
+        """Testing the ECO codes stored in the tag database"""
+
+        pgnfile = load(protoopen(self.path))
+        pgnfile.init_tag_database()
+        codes = [row[0] for row in pgnfile.engine.execute(select([game.c.eco]).order_by(game.c.offset))]
+        self.assertEqual(codes, [stored for code, movetext, stored in GAMES])
+        pgnfile.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
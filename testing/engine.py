@@ -39,5 +39,16 @@ class EngineTests(unittest.TestCase):
 
         self.assertTrue(output.endswith("n/s\n"))
 
+    @patch('sys.stdout', new_callable=StringIO)
+    @patch('pychess.Players.PyChessCECP.get_input', new=MagicMock(side_effect=["fastperft 3 1", "stop_unittest"]))
+    def test4(self, mock_stdout):
+        """ Send 'fastperft 3 1' to PyChess engine """
+
+        self.engine.run()
+        output = mock_stdout.getvalue()
+
+        self.assertTrue(output.endswith("nps\n"))
+        self.assertIn(" 3       8902 ", output)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from pychess.Utils.const import NORMALCHESS, ATOMICCHESS, UNSUPPORTED
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.perft import do_perft, do_fast_perft, divide, \
+    perftTable
+from pychess.Variants import variants
+
+
+class FastPerftTestCase(unittest.TestCase):
+    def setUp(self):
+        perftTable.clear()
+
+    def test1(self):
+        """Testing fast perft with perftsuite.epd"""
+
+        with open('gamefiles/perftsuite.epd') as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                parts = line.split(";")
+                board = LBoard(NORMALCHESS)
+                board.applyFen(parts[0])
+                for s in parts[1:4]:
+                    depth, nodes = int(s[1]), int(s[3:].rstrip())
+                    self.assertEqual(do_fast_perft(board, depth), nodes)
+
+    def test2(self):
+        """Testing fast perft against plain perft in every variant"""
+
+        for variant, boardClass in variants.items():
+            if variant in UNSUPPORTED:
+                continue
+            board = boardClass(setup=True).board
+            self.assertEqual(do_fast_perft(board, 3), do_perft(board, 3, 0),
+                             boardClass.__name__)
+
+    def test3(self):
+        """Testing fast perft split at the root across processes"""
+
+        import multiprocessing
+        board = LBoard(NORMALCHESS)
+        board.applyFen("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        pool = multiprocessing.Pool(2)
+        try:
+            counts = divide(board, 3, pool)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(counts, divide(board, 3))
+        self.assertEqual(sum(count for move, count in counts), 97862)
+
+    def test4(self):
+        """Testing fast perft of variants with the same start position in sequence"""
+
+        # The counts of a variant must not be reused by the next one
+        for variant, nodes in ((NORMALCHESS, 197281), (ATOMICCHESS, 197326), (NORMALCHESS, 197281)):
+            board = variants[variant](setup=True).board
+            self.assertEqual(do_fast_perft(board, 4), nodes, variants[variant].__name__)
+
+
+if __name__ == '__main__':
+    unittest.main()
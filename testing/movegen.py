@@ -1,13 +1,13 @@
 import unittest
 
 from pychess import MSYS2
-from pychess.Utils.lutils.lmovegen import genAllMoves, genCheckEvasions
+from pychess.Utils.lutils.lmovegen import genAllMoves, genCheckEvasions, genLegalMoves
 from pychess.Utils.lutils.LBoard import LBoard
 # from pychess.Utils.lutils.ldata import *
 from pychess.Utils.lutils.validator import validateMove
 
 from pychess.Utils.lutils.lmove import toSAN, parseSAN, ParsingError
-from pychess.Utils.const import NORMALCHESS, SITTUYINCHESS, CAMBODIANCHESS, MAKRUKCHESS
+from pychess.Utils.const import NORMALCHESS, SITTUYINCHESS, CAMBODIANCHESS, MAKRUKCHESS, SCHESS
 
 
 class FindMovesTestCase(unittest.TestCase):
@@ -21,6 +21,15 @@ class FindMovesTestCase(unittest.TestCase):
             self.count += 1
             return
 
+        # The legal move generator must agree with making every move
+        legal = []
+        for move in genAllMoves(board):
+            board.applyMove(move)
+            if not board.opIsChecked():
+                legal.append(move)
+            board.popMove()
+        self.assertEqual(sorted(genLegalMoves(board)), sorted(legal))
+
         if board.isChecked():
             # If we are checked we can use the genCheckEvasions function as well
             # as genAllMoves. Here we try both functions to ensure they return
@@ -173,6 +182,16 @@ class FindMovesTestCase(unittest.TestCase):
         self.MAXDEPTH = 3
         self.movegen(positions, MAKRUKCHESS)
 
+    def testMovegen6(self):
+        """Testing SCHESS variant move generator"""
+        # The queen pinned on d1 may leave the pin line when a hawk is gated
+        positions = [("r3kbhr/ppp1pp1p/B1bpq3/5Pp1/3En1n1/P7/R1PP2PP/2eQ1KNR[H] w HGDCkq - 0 21",
+                      [(1, 43), (2, 2125), (3, 78767)])]
+        print()
+        # return
+        self.MAXDEPTH = 3
+        self.movegen(positions, SCHESS)
+
 
 if __name__ == '__main__':
     unittest.main()
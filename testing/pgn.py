@@ -1,8 +1,20 @@
 
+import gzip
+import os
+import shutil
+import tempfile
 import unittest
+import zlib
+from io import StringIO
+
+from sqlalchemy import select, func, or_
 
 from pychess.Savers.pgn import load, walk, pattern, MOVE
 from pychess.System.protoopen import protoopen
+from pychess.Utils.const import FEN_START
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import toSAN
+from pychess.Database.model import game as game_table, get_indexed_file, pl1, pl2, event, site
 
 
 def normalize(text):
@@ -70,5 +82,221 @@ class PgnTestCase(unittest.TestCase):
         self.pgn_test("schess")
 
 
+class PgnIterGamesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_games(self):
+        """Testing streaming the main lines of the games of .pgn files"""
+
+        for name in ("world_matches", "chess960rwch", "atomic", "zh"):
+            path = os.path.join(self.tmpdir, "%s.pgn" % name)
+            shutil.copy("gamefiles/%s.pgn" % name, path)
+            pgnfile = load(protoopen(path))
+            pgnfile.limit = 1000
+            pgnfile.init_tag_database()
+            records, plys = pgnfile.get_records()
+            games = list(pgnfile.iter_games())
+            self.assertEqual(len(games), len(records))
+
+            for rec, (tags, moves, hashes) in zip(records, games):
+                self.assertEqual(tags["offset"], rec["Offset"])
+                self.assertEqual(tags["White"], rec["White"])
+                model = pgnfile.loadToModel(rec)
+                self.assertEqual(moves, [move.move for move in model.moves])
+                self.assertEqual(hashes, [board.board.hash for board in model.boards])
+            pgnfile.close()
+
+            with open(path, "rb") as f, open(path + ".gz", "wb") as gz_file:
+                gz_file.write(gzip.compress(f.read()))
+            pgnfile = load(protoopen(path + ".gz"))
+            fields = ("Event", "ECO")
+            self.assertEqual(list(pgnfile.iter_games(fields)),
+                             [({field: tags[field] for field in fields}, moves, hashes)
+                              for tags, moves, hashes in games])
+            pgnfile.close()
+
+        pgnfile = load(StringIO('[Event "?"]\n[FEN "8/8/8/8/8/8/4k3/K7 b - - 0 1"]\n\n1... Kd2 2. Ka2 *\n'))
+        (tags, moves, hashes), = pgnfile.iter_games()
+        self.assertEqual(len(moves), 2)
+        self.assertEqual(len(hashes), 3)
+
+
+class PgnMovetextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pgnfile = load(StringIO('[Event "?"]\n\n*\n'))
+
+    def parse(self, text):
+        board = LBoard()
+        board.applyFen(FEN_START)
+        self.pgnfile.error = None
+        return self.pgnfile.parse_movetext(text, board, -1)
+
+    def test_variations(self):
+        """Testing parsing variations and comments of movetext"""
+
+        text = "1. e4 {best} e5 (1... c5 {Sicilian} 2. Nf3 (2. Nc3 d6) (2. c3) d6) " \
+            "({Or} 1... e6 $2 2. d4) 2. Nf3 ; rest of line\n Nc6 1-0"
+        boards = self.parse(text)
+        self.assertIsNone(self.pgnfile.error)
+        self.assertEqual([toSAN(board.prev, board.lastMove) for board in boards[1:]], ["e4", "e5", "Nf3", "Nc6"])
+        self.assertEqual(boards[1].children, ["best"])
+        self.assertEqual(boards[3].children, [" rest of line\n"])
+
+        sicilian, french = boards[2].children
+        self.assertEqual([toSAN(board.prev, board.lastMove) for board in sicilian[1:]], ["c5", "Nf3", "d6"])
+        self.assertIs(sicilian[1].prev, boards[1])
+        self.assertIs(sicilian[0].next, sicilian[1])
+        self.assertEqual(sicilian[1].children, ["Sicilian"])
+        self.assertEqual([[toSAN(board.prev, board.lastMove) for board in line[1:]] for line in sicilian[2].children],
+                         [["Nc3", "d6"], ["c3"]])
+        self.assertEqual(french[0].children, ["Or"])
+        self.assertEqual(french[1].nags, ["$2"])
+
+    def test_errors(self):
+        """Testing parsing movetext with illegal moves"""
+
+        # An illegal move ends its variation, and the main line goes on
+        boards = self.parse("1. e4 e5 (1... Nd4 2. d4) (1... c5 2. Nh5 Nc6) 2. d4 *")
+        self.assertEqual(len(boards), 4)
+        self.assertEqual([len(line) for line in boards[2].children], [1, 2])
+        self.assertIsNotNone(self.pgnfile.error)
+
+        boards = self.parse("1. e4 e5 2. Nh5 Nc6 (2... d6) *")
+        self.assertEqual(len(boards), 3)
+        self.assertIsNotNone(self.pgnfile.error)
+
+    def test_nested(self):
+        """Testing parsing deeply nested variations"""
+
+        depth = 2000
+        alts = ("Nf3", "Nc3", "Bc4", "d4")
+        text = "1. e4 e5 " + "".join("2. %s (" % alts[i % 4] for i in range(depth)) + "2. g3" + ") d6" * depth
+        boards = self.parse(text)
+        self.assertIsNone(self.pgnfile.error)
+        self.assertEqual(len(boards), 5)
+        board = boards[3]
+        for i in range(1, depth):
+            line = board.children[0]
+            self.assertEqual([toSAN(board.prev, board.lastMove) for board in line[1:]], [alts[i % 4], "d6"])
+            board = line[1]
+        self.assertEqual([toSAN(board.prev, board.lastMove) for board in board.children[0][1:]], ["g3"])
+
+
+class PgnTagFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "games.pgn")
+        shutil.copy("gamefiles/world_matches.pgn", self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_names(self):
+        """Testing filtering games by parts of names"""
+
+        pgnfile = load(protoopen(self.path))
+        pgnfile.init_tag_database()
+        pgnfile.limit = 10000
+        tag_database = pgnfile.tag_database
+        queries = (
+            ({"white": "kasp"}, pl1.c.name.like("%kasp%")),
+            ({"white": "a", "ignore_tag_colors": True}, or_(pl1.c.name.like("%a%"), pl2.c.name.like("%a%"))),
+            ({"black": "Karpov"}, pl2.c.name.like("%Karpov%")),
+            ({"event": "world"}, event.c.name.like("%world%")),
+            ({"site": "mo"}, site.c.name.like("%mo%")),
+        )
+        for has_name_index in (tag_database.has_name_index, False):
+            tag_database.has_name_index = has_name_index
+            for tag_query, where in queries:
+                pgnfile.set_tag_filter(tag_query)
+                games, plys = pgnfile.get_records()
+                count = pgnfile.engine.execute(
+                    select([func.count()], from_obj=tag_database.from_obj).where(where)).scalar()
+                self.assertGreater(count, 0)
+                self.assertEqual(len(games), count)
+        pgnfile.close()
+
+    def test_ranges(self):
+        """Testing filtering games by Elo and date ranges"""
+
+        pgnfile = load(protoopen(self.path))
+        pgnfile.init_tag_database()
+        pgnfile.limit = 10000
+        pgnfile.set_tag_filter(None)
+        all_games, plys = pgnfile.get_records()
+
+        # Unknown parts of dates count as 0
+        queries = (
+            ({"elo_from": 2700}, lambda rec: rec["WhiteElo"] >= 2700 and rec["BlackElo"] >= 2700),
+            ({"elo_to": 2600}, lambda rec: rec["WhiteElo"] <= 2600 and rec["BlackElo"] <= 2600),
+            ({"date_from": "1990"}, lambda rec: rec["Date"] >= "1990"),
+            ({"date_to": "1985.10"}, lambda rec: "1000" <= rec["Date"][:7].replace("?", "0") <= "1985.10"),
+            ({"date_from": "1950.01.01", "date_to": "1960"},
+             lambda rec: "1950.01.01" <= rec["Date"].replace("?", "0") and rec["Date"][:4] <= "1960"),
+        )
+        for tag_query, match in queries:
+            pgnfile.set_tag_filter(tag_query)
+            games, plys = pgnfile.get_records()
+            expected = [rec["Id"] for rec in all_games if match(rec)]
+            self.assertGreater(len(expected), 0)
+            self.assertEqual(sorted(rec["Id"] for rec in games), sorted(expected))
+        pgnfile.close()
+
+
+class PgnAppendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "games.pgn")
+        with open("gamefiles/world_matches.pgn", "rb") as f:
+            self.text = f.read()
+        self.start = self.text.index(b"[Event ", len(self.text) // 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def open_pgn(self, text):
+        with open(self.path, "wb") as f:
+            f.write(text)
+        # Make sure the .pgn file looks newer than its indexes
+        mtime = os.path.getmtime(self.path) + 10
+        os.utime(self.path, (mtime, mtime))
+
+        pgnfile = load(protoopen(self.path))
+        pgnfile.init_tag_database()
+        pgnfile.init_position_index()
+        offsets = [row[0] for row in pgnfile.engine.execute(select([game_table.c.offset]).order_by(game_table.c.id))]
+        indexed = (get_indexed_file(pgnfile.engine, ".sqlite"), get_indexed_file(pgnfile.engine, ".pos"))
+        with open(os.path.splitext(self.path)[0] + ".pos", "rb") as f:
+            positions = f.read()
+        pgnfile.close()
+        return offsets, indexed, positions
+
+    def test_append(self):
+        """Testing indexing games appended to a .pgn file"""
+
+        offsets, indexed, positions = self.open_pgn(self.text[:self.start])
+        checksum = zlib.crc32(self.text[:self.start])
+        self.assertEqual(indexed, ((self.start, checksum), (self.start, checksum)))
+
+        appended = self.open_pgn(self.text)
+        self.assertEqual(appended[0][:len(offsets)], offsets)
+        self.assertGreater(len(appended[0]), len(offsets))
+
+        # A changed file is indexed again from scratch
+        os.remove(os.path.splitext(self.path)[0] + ".sqlite")
+        full = self.open_pgn(self.text)
+        self.assertEqual(appended, full)
+
+        text = self.text[self.start:] + self.text[:self.start]
+        changed = self.open_pgn(text)
+        self.assertEqual(len(changed[0]), len(full[0]))
+        self.assertNotEqual(changed[0], full[0])
+        self.assertEqual(changed[1][1], (len(text), zlib.crc32(text)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,18 @@
+""" .pgn files joining the games of several files of gamefiles/ """
+
+import os
+
+# Normal chess games, with and without FEN, and variant games
+GAMEFILES = ("annotated", "bilbao", "dortmund", "chess960rwch", "atomic", "fenSetup", "world_matches")
+
+
+def join_gamefiles(directory, names=GAMEFILES):
+    """ Write the games of the gamefiles/<name>.pgn files of names one after
+        the other to games.pgn in directory, and return its path """
+
+    path = os.path.join(directory, "games.pgn")
+    with open(path, "wb") as f:
+        for name in names:
+            with open("gamefiles/%s.pgn" % name, "rb") as game_file:
+                f.write(game_file.read().rstrip(b"\r\n") + b"\n\n")
+    return path
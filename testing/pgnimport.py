@@ -0,0 +1,306 @@
+import bz2
+import collections
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+
+from pychess.Database import model, profiling
+from pychess.Database.PgnImport import TAG_REGEX, tags2record, split_games, \
+    read_range, read_records_parallel, read_file_games, read_stream_games
+from pychess.Savers.database import TagDatabase
+from pychess.System import compressed
+from pychess.System.compressed import DecompressedFile
+from pychess.System.protoopen import protoopen, PGN_ENCODING
+
+from pgnfiles import join_gamefiles
+
+GAMEFILES = ("annotated", "bilbao", "dortmund", "chess960rwch", "atomic")
+
+
+def read_games(handle):
+    """ The line by line header scanner the byte scanners replaced, based on
+        chess.pgn.scan_headers() from Niklas Fiekas python-chess, to compare
+        them with """
+
+    in_comment = False
+
+    game_headers = None
+    game_pos = None
+
+    last_pos = 0
+    line = handle.readline()
+
+    # scoutfish creates game offsets at previous game end
+    line_end_fix = 2 if line.endswith("\r\n") else 1
+
+    while line:
+        # Skip single line comments.
+        if line.startswith("%"):
+            last_pos += len(line)
+            line = handle.readline()
+            continue
+
+        # Reading a header tag. Parse it and add it to the current headers.
+        if not in_comment and line.startswith("["):
+            tag_match = TAG_REGEX.match(line)
+            if tag_match:
+                if game_pos is None:
+                    game_headers = collections.defaultdict(str)
+                    game_pos = last_pos
+
+                tag_value = tag_match.group(2)
+                tag_value = tag_value.replace("\\\"", "\"")
+                tag_value = tag_value.replace("\\\\", "\\")
+
+                if handle.pgn_encoding != PGN_ENCODING:
+                    tag_value = tag_value.encode(PGN_ENCODING).decode(handle.pgn_encoding)
+                game_headers[tag_match.group(1)] = tag_value
+
+                last_pos += len(line)
+                line = handle.readline()
+                continue
+
+        # Reading movetext. Update parser state in_comment in order to skip
+        # comments that look like header tags.
+        if (not in_comment and "{" in line) or (in_comment and "}" in line):
+            in_comment = line.rfind("{") > line.rfind("}")
+
+        # Reading movetext. If there were headers, previously, those are now
+        # complete and can be yielded.
+        if game_pos is not None:
+            game_headers["offset"] = max(0, game_pos - line_end_fix)
+            yield game_headers
+            game_pos = None
+
+        last_pos += len(line)
+        line = handle.readline()
+
+    # Yield the headers of the last game.
+    if game_pos is not None:
+        game_headers["offset"] = max(0, game_pos - line_end_fix)
+        yield game_headers
+
+
+class PgnImportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join_gamefiles(self.tmpdir, GAMEFILES)
+
+        handle = protoopen(self.path)
+        self.records = [tags2record(tags, "games.pgn") for tags in read_games(handle)]
+        handle.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test1(self):
+        """Testing splitting .pgn files at game boundaries"""
+
+        ranges = split_games(self.path, 4096)
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+
+        with open(self.path, "rb") as f:
+            for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, next_start)
+                f.seek(start)
+                self.assertTrue(f.readline().startswith(b"["))
+
+        records = []
+        for start, end in ranges:
+            records += read_range(self.path, start, end, "latin_1", "games.pgn")
+        self.assertEqual(records, self.records)
+
+    def test2(self):
+        """Testing reading game headers in a process pool"""
+
+        records = list(read_records_parallel(self.path, "latin_1", "games.pgn", 2, 4096))
+        self.assertEqual(records, self.records)
+
+    def test3(self):
+        """Testing scanning game headers in the bytes of .pgn files"""
+
+        for name in os.listdir("gamefiles"):
+            if name.endswith(".pgn"):
+                path = os.path.join("gamefiles", name)
+                handle = protoopen(path)
+                games = list(read_games(handle))
+                handle.close()
+                self.assertEqual(list(read_file_games(path)), games)
+
+    def test4(self):
+        """Testing reading game headers and games of compressed .pgn files"""
+
+        with open(self.path, "rb") as f:
+            text = f.read()
+        half = len(text) // 2
+        archives = {
+            # Two gzip members
+            "games.pgn.gz": gzip.compress(text[:half]) + gzip.compress(text[half:]),
+            "games.pgn.bz2": bz2.compress(text),
+            "games.pgn.xz": lzma.compress(text),
+        }
+
+        checkpoint, max_indexes = compressed.CHECKPOINT, compressed.MAX_INDEXES
+        compressed.CHECKPOINT = 4096
+        compressed.MAX_INDEXES = 2
+        try:
+            for name, data in archives.items():
+                path = os.path.join(self.tmpdir, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                handle = protoopen(path)
+                records = [tags2record(tags, "games.pgn") for tags in
+                           read_stream_games(handle.buffer, handle.pgn_encoding, 4096)]
+                self.assertEqual(records, self.records)
+
+                if name.endswith(".gz"):
+                    self.assertGreater(len(DecompressedFile.indexes[path][1]), 2)
+
+                for record in reversed(records):
+                    offset = record["offset"]
+                    handle.seek(offset)
+                    self.assertEqual(handle.read(100), text[offset:offset + 100].decode("latin_1"))
+                handle.close()
+
+                # Only seeking back in single stream bzip2, xz and zstd files
+                # restarts from the beginning
+                self.assertEqual(DecompressedFile.indexes[path][3], not name.endswith(".gz"))
+
+            # The restart points of the first file were dropped
+            self.assertLessEqual(len(DecompressedFile.indexes), 2)
+            self.assertNotIn(os.path.join(self.tmpdir, "games.pgn.gz"), DecompressedFile.indexes)
+        finally:
+            compressed.CHECKPOINT, compressed.MAX_INDEXES = checkpoint, max_indexes
+
+    def test5(self):
+        """Testing migrating databases with text Elo, ply count and date columns"""
+
+        for version in ("20180221", "20261019"):
+            path = os.path.join(self.tmpdir, "old%s.sqlite" % version)
+            engine = model.get_engine(path)
+            conn = engine.connect()
+            conn.execute("DROP TABLE game")
+            conn.execute(
+                "CREATE TABLE game (id INTEGER PRIMARY KEY, offset INTEGER, offset8 INTEGER, "
+                "event_id INTEGER, site_id INTEGER, date VARCHAR(10), round VARCHAR(8), "
+                "white_id INTEGER, black_id INTEGER, result SMALLINT, white_elo VARCHAR(4), "
+                "black_elo VARCHAR(4), ply_count VARCHAR(3), eco VARCHAR(3), time_control VARCHAR(7), "
+                "board SMALLINT, fen VARCHAR(128), variant SMALLINT, annotator_id INTEGER, source_id INTEGER)")
+            conn.execute("CREATE INDEX ix_game_offset ON game (offset)")
+            if version == "20180221":
+                # Before the indexed_file and the FTS5 tables of the names
+                conn.execute("DROP TABLE indexed_file")
+                for table in model.name_tables:
+                    conn.execute("DROP TRIGGER IF EXISTS %s_fts_insert" % table.name)
+                    conn.execute("DROP TABLE IF EXISTS %s_fts" % table.name)
+            conn.execute("INSERT INTO player (id, name) VALUES (1, 'Kasparov, Garry')")
+            conn.execute(
+                "INSERT INTO game (id, offset, date, white_id, white_elo, black_elo, ply_count, eco) VALUES "
+                "(1, 0, '2018.02.21', 1, '2700', '', '85', 'B90'), (2, 900, '1972.??.??', 1, '?', '999', '', '')")
+            conn.execute("UPDATE schema_version SET version = '%s'" % version)
+            conn.close()
+            engine.dispose()
+            del model.engines["sqlite:///%s" % path]
+
+            engine = model.get_engine(path)
+            self.assertEqual(model.get_schema_version(engine), model.SCHEMA_VERSION)
+            rows = engine.execute(model.select([model.game]).order_by(model.game.c.id)).fetchall()
+            self.assertEqual([(row["offset"], row["date"], row["date_key"], row["white_elo"],
+                               row["black_elo"], row["ply_count"], row["eco"]) for row in rows],
+                             [(0, "2018.02.21", 20180221, 2700, 0, 85, "B90"),
+                              (900, "1972.??.??", 19720000, 0, 999, 0, "")])
+            self.assertIsNone(model.get_indexed_file(engine, ".sqlite"))
+            model.set_indexed_file(engine, ".sqlite", 100, 1)
+            self.assertEqual(model.get_indexed_file(engine, ".sqlite"), (100, 1))
+            if model.FTS5_TRIGRAM:
+                # The names already there and the new ones are in the trigram index
+                engine.execute("INSERT INTO player (id, name) VALUES (2, 'Karpov, Anatoly')")
+                ids = [row[0] for row in engine.execute(
+                    "SELECT rowid FROM player_fts WHERE name LIKE '%ov,%' ORDER BY rowid")]
+                self.assertEqual(ids, [1, 2])
+            engine.dispose()
+
+    def test6(self):
+        """Testing reading a database while an import writes to it"""
+
+        path = os.path.join(self.tmpdir, "games.sqlite")
+        engine = model.get_engine(path)
+        tag_database = TagDatabase(model.get_read_engine(engine))
+        self.assertEqual(engine.execute("PRAGMA journal_mode").scalar(), "wal")
+
+        conn = engine.connect()
+        trans = conn.begin()
+        conn.execute(model.game.insert(), [{"offset": i * 100} for i in range(5000)])
+        # The import transaction is still open
+        self.assertEqual(tag_database.count, 0)
+        self.assertEqual(len(tag_database.get_records((-1, -1), 10)), 0)
+        trans.commit()
+        conn.close()
+        self.assertEqual(tag_database.count, 5000)
+        self.assertEqual(len(tag_database.get_records((-1, -1), 10)), 10)
+
+        with self.assertRaises(model.OperationalError):
+            tag_database.engine.execute(model.game.delete())
+        tag_database.close()
+        engine.dispose()
+
+    def test7(self):
+        """Testing profiling the database queries"""
+
+        engine = model.get_engine(None)
+        profiler = profiling.enable()
+        try:
+            engine.execute(model.game.insert(), [{"offset": i * 100} for i in range(50)])
+            for offsets in ((0, 100), (200, 300, 400), (500,)):
+                engine.execute(model.select([model.game.c.id]).where(model.game.c.offset.in_(offsets))).fetchall()
+
+            stats = {stat[0]: stat for stat in profiler.get_stats()}
+            in_shapes = [shape for shape in stats if shape.startswith("SELECT game.id")]
+            # The IN lists of two and three offsets have the same shape
+            self.assertEqual(len(in_shapes), 2)
+            self.assertEqual(sorted(stats[shape][1] for shape in in_shapes), [1, 2])
+            insert_shape = [shape for shape in stats if shape.startswith("INSERT INTO game")][0]
+            self.assertEqual(stats[insert_shape][2], 50)
+            for shape, runs, rows, total, median, p95, longest in stats.values():
+                self.assertTrue(0 <= median <= p95 <= longest <= total)
+            self.assertEqual(len(profiler.get_slowest()), 4)
+            self.assertIn("Slowest:", profiler.report())
+        finally:
+            profiling.disable()
+
+        engine.execute(model.select([model.game.c.id])).fetchall()
+        self.assertEqual(sum(stat[1] for stat in profiler.get_stats()), 4)
+
+    def test8(self):
+        """Testing profiling equal run times and failing queries"""
+
+        engine = create_engine("sqlite://")
+        profiler = profiling.enable(slowest=2)
+        try:
+            # The same statement and time, and parameters that can't be compared
+            with mock.patch("pychess.Database.profiling.time") as clock:
+                clock.perf_counter.return_value = 1.0
+                for value in (1, None, "x"):
+                    engine.execute("SELECT ?", (value, )).fetchall()
+            self.assertEqual(len(profiler.get_slowest()), 2)
+
+            conn = engine.connect()
+            with self.assertRaises(model.OperationalError):
+                conn.execute("SELECT * FROM no_table")
+            self.assertEqual(conn.info["query_start_time"], [])
+            conn.close()
+        finally:
+            profiling.disable()
+
+
+if __name__ == '__main__':
+    unittest.main()
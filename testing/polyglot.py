@@ -56,7 +56,6 @@ class PolyglotTestCase(unittest.TestCase):
 
         cls.saved_book_path = book.path
         book.path = BIN
-        book.bookfile = True
 
     @classmethod
     def tearDownClass(cls):
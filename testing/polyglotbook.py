@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pychess.Database.BookBuilder import build_book, BOOK_ENTRY
+from pychess.Database.PositionIndex import read_run
+from pychess.Utils import book
+from pychess.Utils.book import OpeningBooks
+from pychess.Utils.const import FEN_START
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parsePolyglot
+
+from pgnfiles import join_gamefiles
+
+GAMEFILES = ("annotated", "bilbao", "dortmund", "world_matches")
+
+
+class PolyglotBookTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        path = join_gamefiles(self.tmpdir, GAMEFILES)
+        self.book_path = os.path.join(self.tmpdir, "games.bin")
+        build_book(path, self.book_path, 13)
+        self.winners_path = os.path.join(self.tmpdir, "winners.bin")
+        build_book(path, self.winners_path, 13, min_score=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_entries(self, path):
+        entries = {}
+        for key, move, weight, learn in read_run(path, BOOK_ENTRY):
+            entries.setdefault(key, []).append((move, weight, learn))
+        return entries
+
+    def test1(self):
+        """Testing probing polyglot books"""
+
+        entries = self.read_entries(self.book_path)
+        books = OpeningBooks([self.book_path], cache_size=10)
+        for key in entries:
+            self.assertEqual(books.get_entries(key), entries[key])
+            self.assertLessEqual(len(books.cache), 10)
+        self.assertEqual(books.get_entries(12345), [])
+        self.assertEqual(books.get_entries(0xffffffffffffffff), [])
+
+        # The weights of the moves in both books are added up
+        winners = self.read_entries(self.winners_path)
+        books = OpeningBooks([self.book_path, self.winners_path])
+        for key in entries:
+            merged = dict((move, weight) for move, weight, learn in entries[key])
+            for move, weight, learn in winners.get(key, []):
+                merged[move] += weight
+            self.assertEqual([entry[:2] for entry in books.get_entries(key)], list(merged.items()))
+        books.close()
+
+    def test2(self):
+        """Testing probing polyglot books whose files change"""
+
+        board = LBoard()
+        board.applyFen(FEN_START)
+        entries = self.read_entries(self.book_path)[board.hash]
+        winners = self.read_entries(self.winners_path).get(board.hash, [])
+        self.assertNotEqual(entries, winners)
+
+        path = os.path.join(self.tmpdir, "book.bin")
+        books = OpeningBooks([path])
+        with mock.patch.object(book.log, "warning") as warning:
+            self.assertEqual(books.get_entries(board.hash), [])
+            self.assertEqual(books.get_entries(board.hash), [])
+            # A missing book is told about once
+            warning.assert_called_once_with("Could not find %s" % path)
+        shutil.copy(self.book_path, path)
+        self.assertEqual(books.get_entries(board.hash), entries)
+        os.replace(self.winners_path, path)
+        self.assertEqual(books.get_entries(board.hash), winners)
+        books.close()
+
+        saved_path = book.path
+        book.path = path
+        try:
+            self.assertEqual(book.getOpenings(board),
+                             [(parsePolyglot(board, move), weight, learn) for move, weight, learn in winners])
+            book.path = self.book_path
+            self.assertEqual(len(book.getOpenings(board)), len(entries))
+        finally:
+            book.path = saved_path
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import gzip
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+from pychess.Database import PositionIndex as position_index
+from pychess.Database.PgnImport import read_file_games, tags2record
+from pychess.Database.PositionIndex import PositionIndex, OpeningTree, RunWriter, \
+    build_position_index, iter_games, replay_game, read_run
+from pychess.Utils.const import NORMALCHESS, FEN_START, WHITEWON, BLACKWON, DRAW
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.lmove import parseSAN
+
+from pgnfiles import join_gamefiles
+
+
+class PositionIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = join_gamefiles(self.tmpdir)
+
+        self.index_path = os.path.join(self.tmpdir, "games.pos")
+        self.tree_path = os.path.join(self.tmpdir, "games.tree")
+
+        # Serial postings and tree entries to compare the built files with
+        writer = RunWriter(self.tmpdir)
+        with open(self.path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for game in iter_games(data):
+                writer.add_game(*game)
+            data.close()
+        self.keys = sorted(writer.postings)
+        self.tree = sorted((key >> 16, key & 0xffff) + tuple(entry) for key, entry in writer.tree.items())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_keys(self):
+        return [posting[0] << 64 | posting[1] for posting in read_run(self.index_path, position_index.POSTING)]
+
+    def read_tree(self):
+        return list(read_run(self.tree_path, position_index.TREE_ENTRY))
+
+    def test1(self):
+        """Testing building position indexes in parts and of compressed files"""
+
+        part_size, run_size = position_index.PART_SIZE, position_index.RUN_SIZE
+        position_index.PART_SIZE, position_index.RUN_SIZE = 4096, 1000
+        try:
+            build_position_index(self.path, self.index_path, self.tree_path, processes=2)
+            self.assertEqual(self.read_keys(), self.keys)
+            self.assertEqual(self.read_tree(), self.tree)
+
+            gz_path = self.path + ".gz"
+            with open(self.path, "rb") as f, open(gz_path, "wb") as gz_file:
+                gz_file.write(gzip.compress(f.read()))
+            build_position_index(gz_path, self.index_path, self.tree_path, processes=2)
+            self.assertEqual(self.read_keys(), self.keys)
+            self.assertEqual(self.read_tree(), self.tree)
+        finally:
+            position_index.PART_SIZE, position_index.RUN_SIZE = part_size, run_size
+
+    def test2(self):
+        """Testing finding games by position"""
+
+        build_position_index(self.path, self.index_path, self.tree_path)
+        index = PositionIndex(self.index_path)
+
+        with open(self.path, "rb") as f:
+            text = f.read().decode("latin_1")
+        games = list(read_file_games(self.path))
+        normal_games = 0
+        for tags, next_tags in zip(games, games[1:]):
+            record = tags2record(tags, "")
+            if record is None or record["variant"] != 0:
+                continue
+            normal_games += 1
+            hashes, moves = replay_game(text[tags["offset"]:next_tags["offset"]], record["fen"])
+            if tags["PlyCount"]:
+                self.assertEqual(len(hashes) - 1, int(tags["PlyCount"]))
+            for ply in range(1, len(hashes), 7):
+                self.assertTrue(index.has_position(hashes[ply]))
+                found = dict(index.iter_games(hashes[ply]))
+                self.assertLessEqual(found[tags["offset"]], ply)
+                self.assertEqual(list(found), sorted(found))
+        self.assertGreater(normal_games, 10)
+        self.assertFalse(index.has_position(12345))
+        index.close()
+
+    def test3(self):
+        """Testing adding appended games to position indexes"""
+
+        with open(self.path, "rb") as f:
+            text = f.read()
+        games = list(read_file_games(self.path))
+        start = games[len(games) // 2]["offset"]
+        with open(self.path, "wb") as f:
+            f.write(text[:start])
+        build_position_index(self.path, self.index_path, self.tree_path)
+        with open(self.path, "wb") as f:
+            f.write(text)
+        build_position_index(self.path, self.index_path, self.tree_path, start)
+
+        self.assertEqual(self.read_keys(), self.keys)
+        self.assertEqual(self.read_tree(), self.tree)
+
+    def test4(self):
+        """Testing the opening tree statistics"""
+
+        build_position_index(self.path, self.index_path, self.tree_path)
+        tree = OpeningTree(self.tree_path)
+
+        with open(self.path, "rb") as f:
+            data = f.read()
+        results = {WHITEWON: 0, DRAW: 0, BLACKWON: 0}
+        start_games = 0
+        for offset, record, hashes, moves in iter_games(data):
+            if not record["fen"] and moves:
+                start_games += 1
+                if record["result"] in results:
+                    results[record["result"]] += 1
+                start_hash = hashes[0]
+        moves = tree.get_moves(start_hash)
+        self.assertEqual(sum(move[1] for move in moves), start_games)
+        self.assertEqual(sum(move[2] for move in moves), results[WHITEWON])
+        self.assertEqual(sum(move[3] for move in moves), results[DRAW])
+        self.assertEqual(sum(move[4] for move in moves), results[BLACKWON])
+        for move, games, white_wins, draws, black_wins, elo in moves:
+            self.assertGreaterEqual(games, white_wins + draws + black_wins)
+            self.assertTrue(elo == 0 or 1000 < elo < 3000)
+        self.assertEqual(tree.get_moves(12345), [])
+        tree.close()
+
+    def test5(self):
+        """Testing pages of the games of a position and reading games lazily"""
+
+        build_position_index(self.path, self.index_path, self.tree_path)
+        index = PositionIndex(self.index_path)
+        board = LBoard(NORMALCHESS)
+        board.applyFen(FEN_START)
+        board.applyMove(parseSAN(board, "e4"))
+        start_hash = board.hash
+        games = list(index.iter_games(start_hash))
+        self.assertGreater(len(games), 5)
+        self.assertEqual(len(set(offset for offset, ply in games)), len(games))
+        for skip in (0, 1, 3, len(games) - 1, len(games)):
+            self.assertEqual(list(index.iter_games(start_hash, skip)), games[skip:])
+        index.close()
+
+        # Only one game is read ahead of the replayed one
+        with open(self.path, "rb") as f:
+            data = f.read()
+        scanned = []
+
+        def scan_games(*args, **kwargs):
+            for tags in read_scan_games(*args, **kwargs):
+                scanned.append(tags)
+                yield tags
+
+        read_scan_games = position_index.scan_games
+        position_index.scan_games = scan_games
+        try:
+            next(iter_games(data))
+        finally:
+            position_index.scan_games = read_scan_games
+        self.assertLessEqual(len(scanned), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
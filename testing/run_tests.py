@@ -33,7 +33,16 @@ modules_to_test = (
     'savegame',
     'dialogs',
     'learn',
-    'remotegame'
+    'remotegame',
+    'smp',
+    'transposition',
+    'fastperft',
+    'benchmark',
+    'pgnimport',
+    'positionindex',
+    'bookbuilder',
+    'polyglotbook',
+    'ecoclassifier'
 )
 
 
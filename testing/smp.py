@@ -0,0 +1,127 @@
+import sys
+import time
+import unittest
+from unittest import mock
+
+from pychess.Utils.const import NORMALCHESS, hashfEXACT
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils import lsearch
+from pychess.Utils.lutils import lsmp
+from pychess.Utils.lutils.lsmp import HelperPool
+from pychess.Utils.lutils.TranspositionTable import SharedTranspositionTable, \
+    entryType
+
+FEN = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+class SmpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = lsearch.table
+        self.board = LBoard(NORMALCHESS)
+        self.board.applyFen(FEN)
+
+    def tearDown(self):
+        lsearch.table = self.table
+        lsearch.searching = False
+        lsearch.nodes = 0
+
+    def test1(self):
+        """Testing lazy SMP search with two helper processes"""
+
+        pool = HelperPool(2)
+        try:
+            self.assertTrue(isinstance(lsearch.table, SharedTranspositionTable))
+
+            lsearch.searching = True
+            lsearch.endtime = sys.maxsize
+            pool.start(self.board)
+            for depth in range(1, 4):
+                lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
+                mvs, scr = lsearch.alphaBeta(self.board, depth)
+            pool.halt()
+
+            self.assertNotEqual(mvs, [])
+            self.assertGreater(pool.getNodes(), 0)
+        finally:
+            pool.close()
+
+    def test2(self):
+        """Testing shared transposition table entries seen by every attached table"""
+
+        table = SharedTranspositionTable(1024 * 1024)
+        other = SharedTranspositionTable(table.maxSize, table.name, table.shared)
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        self.assertEqual(other.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+
+        # Attaching by name in the owner's process leaves the segment to
+        # the resource tracker, which the owner unlinks it from
+        with mock.patch("multiprocessing.resource_tracker.unregister") as unregister:
+            named = SharedTranspositionTable(table.maxSize, table.name)
+            unregister.assert_not_called()
+        self.assertEqual(named.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+        named.close()
+
+    def test3(self):
+        """Testing torn shared transposition table entries are never probed"""
+
+        table = SharedTranspositionTable(1024 * 1024)
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        index = (self.board.hash % table.buckets) * 4 * entryType.size
+        # Overwrite the score only, as a concurrent writer might
+        table.data[index + 8] ^= 0xff
+        self.assertEqual(table.probe(self.board, 4, -100, 100), None)
+
+        # Another write of the same position repairs the entry
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        self.assertEqual(table.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+
+    def test4(self):
+        """Testing the search_id of the main search seen by attached tables"""
+
+        table = SharedTranspositionTable(1024 * 1024)
+        other = SharedTranspositionTable(table.maxSize, table.name, table.shared)
+        table.newSearch()
+        table.newSearch()
+        self.assertEqual(other.search_id, 0)
+        other.loadSearch()
+        self.assertEqual(other.search_id, 2)
+
+        # Entries recorded by the helpers don't look older than the main ones
+        other.record(self.board, 1234, 56, hashfEXACT, 4)
+        index = (self.board.hash % table.buckets) * 4 * entryType.size
+        self.assertEqual(table.data[index + 4], 2)
+
+    def test5(self):
+        """Testing halting helper processes of which one died"""
+
+        pool = HelperPool(2)
+        try:
+            lsearch.searching = True
+            lsearch.endtime = sys.maxsize
+            pool.start(self.board)
+            dead = pool.processes[0]
+            dead.kill()
+            dead.join()
+
+            start = time.monotonic()
+            pool.halt()
+            self.assertLess(time.monotonic() - start, lsmp.HALT_TIMEOUT)
+            self.assertIsNot(pool.processes[0], dead)
+            self.assertTrue(all(process.is_alive() for process in pool.processes))
+
+            # The replaced helper searches again
+            pool.start(self.board)
+            for depth in range(1, 3):
+                lsearch.timecheck_counter = lsearch.TIMECHECK_FREQ
+                lsearch.alphaBeta(self.board, depth)
+            pool.halt()
+            self.assertGreater(pool.nodes[0], 0)
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pychess.Players.PyChess import PyChess
+from pychess.Utils.const import NORMALCHESS, WHITE, hashfEXACT
+from pychess.Utils.lutils.LBoard import LBoard
+from pychess.Utils.lutils.TranspositionTable import TranspositionTable, \
+    FileTranspositionTable
+from pychess.Utils.lutils import lsearch, leval
+
+FEN = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+class FileTranspositionTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "hash.bin")
+        self.board = LBoard(NORMALCHESS)
+        self.board.applyFen(FEN)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test1(self):
+        """Testing persistent transposition table entries surviving a restart"""
+
+        table = FileTranspositionTable(1024 * 1024, self.path)
+        table.newSearch()
+        table.newSearch()
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        del table
+
+        table = FileTranspositionTable(1024 * 1024, self.path)
+        self.assertEqual(table.search_id, 2)
+        self.assertEqual(table.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+
+    def test2(self):
+        """Testing persistent transposition table cleared on size change"""
+
+        table = FileTranspositionTable(1024 * 1024, self.path)
+        table.newSearch()
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        del table
+
+        table = FileTranspositionTable(2 * 1024 * 1024, self.path)
+        self.assertEqual(table.search_id, 0)
+        self.assertEqual(table.probe(self.board, 4, -100, 100), None)
+
+    @unittest.skipIf(os.name == "nt", "Mapped files can't be truncated on Windows")
+    def test3(self):
+        """Testing persistent transposition table not cleared while in use"""
+
+        table = FileTranspositionTable(1024 * 1024, self.path)
+        table.record(self.board, 1234, 56, hashfEXACT, 4)
+        with self.assertRaises(OSError):
+            FileTranspositionTable(2 * 1024 * 1024, self.path)
+        self.assertEqual(os.path.getsize(self.path), len(table.mapping))
+        self.assertEqual(table.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+
+        # Another engine with the same size shares it
+        other = FileTranspositionTable(1024 * 1024, self.path)
+        self.assertEqual(other.probe(self.board, 4, -100, 100),
+                         (1234, 56, hashfEXACT))
+        other.close()
+        table.close()
+
+        table = FileTranspositionTable(2 * 1024 * 1024, self.path)
+        self.assertEqual(table.probe(self.board, 4, -100, 100), None)
+        table.close()
+
+
+class HashSizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxSize = lsearch.table.maxSize
+        self.pawnHashSize = leval.PAWN_HASH_SIZE
+        self.board = LBoard(NORMALCHESS)
+        self.board.applyFen(FEN)
+
+    def tearDown(self):
+        lsearch.table = TranspositionTable(self.maxSize)
+        leval.setPawnHashSize(self.pawnHashSize)
+
+    def test1(self):
+        """Testing memory command resizing both hash tables"""
+
+        engine = PyChess()
+        engine.setMemory(4)
+        self.assertEqual(leval.PAWN_HASH_SIZE, 4096)
+        self.assertEqual(lsearch.table.maxSize + 4096 * leval.pawnEntryType.size,
+                         4 * 1024 * 1024)
+
+        engine.setHashSize(1024 * 1024)
+        self.assertEqual(lsearch.table.maxSize, 1024 * 1024)
+
+    def test2(self):
+        """Testing pawn structure evaluation with a tiny pawn hash"""
+
+        score = leval.evaluateComplete(self.board, WHITE)
+        leval.setPawnHashSize(256)
+        self.assertEqual(leval.evaluateComplete(self.board, WHITE), score)
+        self.assertEqual(leval.evaluateComplete(self.board, WHITE), score)
+
+
+if __name__ == '__main__':
+    unittest.main()
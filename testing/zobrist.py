@@ -1,3 +1,4 @@
+import pickle
 import unittest
 
 from pychess.Utils.Board import Board
@@ -91,6 +92,45 @@ class ZobristTestCase(unittest.TestCase):
 
         self.assertEqual(hash1, hash2)
 
+    def testHistory_1(self):
+        """Testing clones sharing the move history"""
+
+        self.make_move("c3b5")
+        self.make_move("e8g8")
+        clone = self.board.clone()
+        self.assertIs(clone.history, self.board.history)
+
+        clone.popMove()
+        clone.popMove()
+        self.make_move("a1b1")
+        self.assertEqual(clone.hash, self._fenHash())
+        self.assertEqual(len(self.board.hist_move), 3)
+        self.assertEqual(self.board.lastMove, parseAN(clone, "a1b1"))
+        self.assertEqual(clone.history, None)
+
+    def _fenHash(self):
+        board = LBoard(Board)
+        board.applyFen(FEN)
+        return board.hash
+
+    def testHistory_2(self):
+        """Testing repetition count and pickling of a long history"""
+
+        for i in range(500):
+            self.make_move("c3b5")
+            self.make_move("a6b7")
+            self.make_move("b5c3")
+            self.make_move("b7a6")
+        self.assertEqual(self.board.repetitionCount(), 3)
+        self.assertEqual(self.board.repetitionCount(1000), 501)
+
+        board = pickle.loads(pickle.dumps(self.board))
+        self.assertEqual(board.hist_hash, self.board.hist_hash)
+        for i in range(2000):
+            board.popMove()
+        self.assertEqual(board.hash, self._fenHash())
+        self.assertEqual(board.history, None)
+
 
 if __name__ == '__main__':
     unittest.main()